@@ -0,0 +1,676 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import filecmp
+import platform
+import contextlib
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import matplotlib.colors as mcolors
+
+import parce
+from layer_stack import LayerStack
+from layer_partitions import TILE, PartitionedStack, commit
+from stock_analytics import scan_analytics
+from interpolation import METHODS, interpolate_points, interpolate_values
+from surface_reader import read_surface_file
+from surface_tiles import X_RANGE, Y_RANGE
+
+try:
+    import resource
+except ImportError:  # нет на Windows — пиковый RSS не сообщается
+    resource = None
+
+# --- Бенчмарк конвейера на синтетическом складе ---
+# Генератор пишет surface-tank файлы (объём в первой строке, затем x y z)
+# и quality.csv с минутными значениями KL_320_FINAL. Поверхность — сетка
+# колонок в пределах validatePoints: штабелёр отсыпает кучи вдоль пути,
+# заборщик срезает траншею, 'mixed' чередует отсыпку и выемку.
+# Стадии load / quality / accumulate / serialize / interpolate замеряются
+# по отдельности: время и пропускная способность — в проходе без трассировки,
+# пик памяти — во втором проходе под tracemalloc (он сильно замедляет JSON).
+PATTERNS = ('stack', 'reclaim', 'mixed')
+Z_MAX = 21000
+SCAN_INTERVAL = timedelta(minutes=5)
+START = datetime(2025, 5, 1, 0, 0, 0)
+QUALITY_START = START - timedelta(minutes=10)
+
+
+# --- Синтетические сканы по одному: (время, x, y, z), без записи на диск ---
+def synthetic_scans(grid=(120, 100), scans=40, pattern='mixed', noise=0.0, seed=0, interval=SCAN_INTERVAL):
+    rng = np.random.default_rng(seed)
+    nx, ny = grid
+    xs = np.round(np.linspace(X_RANGE[0] * 0.95, X_RANGE[1] * 0.95, nx), 2)
+    ys = np.round(np.linspace(Y_RANGE[0] * 0.95, Y_RANGE[1] * 0.95, ny), 2)
+    gx, gy = np.meshgrid(xs, ys, indexing='ij')
+    # Начальный штабель — пологий вал вдоль x
+    height = 4000 * np.exp(-(gy / (0.4 * Y_RANGE[1])) ** 2) + 500
+
+    for s in range(scans):
+        stacking = pattern == 'stack' or (pattern == 'mixed' and (s // 5) % 2 == 0)
+        phase = (s % 20) / 20
+        if stacking:
+            # Куча под разгрузкой штабелёра, который идёт вдоль x
+            cx = X_RANGE[0] * 0.8 + phase * 1.6 * X_RANGE[1]
+            cy = rng.uniform(-0.3, 0.3) * Y_RANGE[1]
+            heap = 1500 * np.exp(-((gx - cx) ** 2 + (gy - cy) ** 2) / (2 * (0.08 * X_RANGE[1]) ** 2))
+            height = np.minimum(height + heap, Z_MAX)
+        else:
+            # Заборщик срезает полосу до уровня cut
+            cx = X_RANGE[1] * 0.8 - phase * 1.6 * X_RANGE[1]
+            band = np.abs(gx - cx) < 0.06 * X_RANGE[1]
+            cut = height.max() * rng.uniform(0.3, 0.7)
+            height = np.where(band, np.minimum(height, cut), height)
+        scan = height + rng.normal(0, noise, height.shape) if noise else height
+        scan = np.clip(scan, 0, Z_MAX)
+
+        t = START + interval * s + timedelta(seconds=int(rng.integers(0, 60)))
+        yield t, gx.ravel(), gy.ravel(), np.round(scan.ravel(), 2)
+
+
+# --- Качество раз в минуту с QUALITY_START: случайное блуждание по всем четырём классам ---
+def synthetic_quality(scans, seed=0, interval=SCAN_INTERVAL):
+    rng = np.random.default_rng([seed, 1])
+    minutes = int((START + interval * scans - QUALITY_START).total_seconds() // 60) + 30
+    return np.clip(35 + np.cumsum(rng.normal(0, 0.8, minutes)), 20, 45)
+
+
+# --- Генерация синтетических сканов и качества в out_dir ---
+def generate(out_dir, grid=(120, 100), scans=40, pattern='mixed', noise=0.0, seed=0, interval=SCAN_INTERVAL):
+    os.makedirs(out_dir, exist_ok=True)
+    nx, ny = grid
+    cell = (X_RANGE[1] - X_RANGE[0]) * (Y_RANGE[1] - Y_RANGE[0]) * 0.95 ** 2 / max(nx - 1, 1) / max(ny - 1, 1)
+    for t, xs, ys, zs in synthetic_scans(grid, scans, pattern, noise, seed, interval):
+        name = f"surface-tank {t:%d.%m.%Y}  {t:%H-%M-%S} .txt"
+        rows = np.stack([xs, ys, zs], axis=1)
+        with open(os.path.join(out_dir, name), 'w') as f:
+            f.write(f"{zs.sum() * cell / 1e9:.3f}\n")
+            f.write(('%.2f %.2f %.2f\n' * len(rows)) % tuple(rows.ravel().tolist()))
+
+    quality = synthetic_quality(scans, seed, interval)
+    with open(os.path.join(out_dir, parce.QUALITY_CSV), 'w') as f:
+        f.write('Timestamp,KL_320_FINAL\n')
+        f.writelines(f"{QUALITY_START + timedelta(minutes=m):%Y-%m-%d %H:%M:%S},{q:.2f}\n"
+                     for m, q in enumerate(quality.tolist()))
+    return out_dir
+
+
+# --- Замер стадии: время, число элементов, байты, пик памяти ---
+class Stage:
+    def __init__(self, name, unit):
+        self.name, self.unit = name, unit
+        self.seconds = 0.0
+        self.items = 0
+        self.bytes = 0
+        self.peak = 0
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self.started
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1] - self.base)
+
+    def result(self):
+        return {
+            'seconds': round(self.seconds, 6),
+            'items': self.items,
+            'unit': self.unit,
+            'items_per_s': round(self.items / self.seconds, 1) if self.seconds else None,
+            'bytes': self.bytes,
+            'mb_per_s': round(self.bytes / 1e6 / self.seconds, 3) if self.seconds and self.bytes else None,
+            'peak_mb': round(self.peak / 1e6, 3) if tracemalloc.is_tracing() else None,
+        }
+
+
+# --- Прогон стадий по сгенерированным файлам ---
+def run(data_dir, out_dir, resolution=50, interpolate_every=1):
+    stages = {name: Stage(name, unit) for name, unit in (
+        ('load', 'points'), ('quality', 'scans'), ('accumulate', 'points'),
+        ('serialize', 'scans'), ('interpolate', 'cells'))}
+    os.makedirs(out_dir, exist_ok=True)
+    parce.INPUT_DIR = data_dir
+    files = parce.list_surface_files()
+    times = [parce.parse_surface_timestamp(f) for f in files]
+
+    with stages['quality'] as st:
+        quality_index = parce.load_quality(os.path.join(data_dir, parce.QUALITY_CSV))
+        qualities = quality_index.at_many(times, parce.QUALITY_WINDOW)
+        st.items += len(files)
+        st.bytes += os.path.getsize(os.path.join(data_dir, parce.QUALITY_CSV))
+
+    stack = LayerStack()
+    for n, (file, quality) in enumerate(zip(files, qualities)):
+        if quality is None:
+            continue
+        with stages['load'] as st:
+            scan = read_surface_file(file)
+            st.items += len(scan.xyz)
+            st.bytes += os.path.getsize(file)
+
+        with stages['accumulate'] as st:
+            xyz = scan.xyz
+            stack.apply_scan(xyz[:, 0], xyz[:, 1], xyz[:, 2], quality, parce.get_color(quality))
+            st.items += len(xyz)
+
+        with stages['serialize'] as st:
+            path = os.path.join(out_dir, f"{os.path.splitext(os.path.basename(file))[0]}.json")
+            with open(path, 'w') as f:
+                json.dump({'surface_points': stack.surface_points(), 'array': stack.to_grid(),
+                           'avg_disappeared_quality': None}, f, indent=2)
+            st.items += 1
+            st.bytes += os.path.getsize(path)
+
+        if n % interpolate_every == 0:
+            with stages['interpolate'] as st:
+                xs, ys, zs, _, codes = stack.surface()
+                rgb = np.array([mcolors.to_rgb(c) for c in stack.palette])[codes]
+                _, _, grid_z, _ = interpolate_points(np.stack([xs, ys, zs], axis=1), rgb, resolution, 1, True)
+                st.items += grid_z.size
+    return {name: stage.result() for name, stage in stages.items()}
+
+
+# --- Долгий прогон накопления в памяти: рост слоёв и влияние сжатия на объёмы и сортность ---
+# Сканы применяются к стеку с политикой сжатия (tolerance, max_layers); с
+# compare=True рядом ведётся стек без сжатия и по каждому скану сравнивается
+# аналитика (объём, сортность, объёмы классов, выработка). Пиковый RSS
+# осмысленно сравнивать только между прогонами без compare.
+def soak(grid=(60, 50), scans=8760, pattern='mixed', noise=0.0, seed=0, interval=timedelta(hours=1),
+         tolerance=None, max_layers=None, compare=False, report_every=1000):
+    quality = synthetic_quality(scans, seed, interval)
+    stack = LayerStack()
+    reference = LayerStack() if compare else None
+    deviation = {}
+    merged = 0
+    started = time.perf_counter()
+    for n, (t, xs, ys, zs) in enumerate(synthetic_scans(grid, scans, pattern, noise, seed, interval)):
+        q = float(quality[int((t - QUALITY_START).total_seconds() // 60)])
+        color = parce.get_color(q)
+        before = stack.snapshot() if compare else None
+        stack.apply_scan(xs, ys, zs, q, color)
+        merged += stack.compact(tolerance, max_layers)
+        if compare:
+            ref_before = reference.snapshot()
+            reference.apply_scan(xs, ys, zs, q, color)
+            row = scan_analytics(before, stack, parce.QUALITY_CLASSES, parce.get_color)
+            ref_row = scan_analytics(ref_before, reference, parce.QUALITY_CLASSES, parce.get_color)
+            # Отклонение за прогон (max_abs) и в конце (final); scale — наибольшее значение
+            # без сжатия, относительно него считается доля (выработка бывает почти нулевой)
+            for key, value in ref_row.items():
+                if value is None or row[key] is None:
+                    continue
+                dev = deviation.setdefault(key, {'max_abs': 0.0, 'final': 0.0, 'scale': 0.0})
+                diff = abs(row[key] - value)
+                dev['max_abs'] = max(dev['max_abs'], diff)
+                dev['final'] = diff
+                dev['scale'] = max(dev['scale'], abs(value))
+        if report_every and (n + 1) % report_every == 0:
+            count = stack.count[:stack.size]
+            print(f"[+] {n + 1} сканов: слоёв {int(count.sum())}, в колонке до {int(count.max())}, "
+                  f"{time.perf_counter() - started:.1f} с")
+
+    count = stack.count[:stack.size]
+    arrays = (stack.col_x, stack.col_y, stack.col_rank, stack.known, stack.acc_z, stack.acc_color,
+              stack.count, stack.z, stack.quality, stack.color)
+    result = {
+        'seconds': round(time.perf_counter() - started, 3),
+        'columns': int(stack.size),
+        'layers': int(count.sum()),
+        'layers_per_column_max': int(count.max()),
+        'layers_per_column_mean': round(float(count.mean()), 3),
+        'merged_layers': merged,
+        'stack_mb': round(sum(a.nbytes for a in arrays) / 1e6, 3),
+        'checkpoint_mb': round(sum(a.nbytes for a in stack.state().values()) / 1e6, 3),
+    }
+    if compare:
+        ref_count = reference.count[:reference.size]
+        result['reference_layers'] = int(ref_count.sum())
+        result['reference_layers_per_column_max'] = int(ref_count.max())
+        result['deviation'] = {k: {'max_abs': round(d['max_abs'], 6), 'final': round(d['final'], 6),
+                                   'max_share': round(d['max_abs'] / d['scale'], 6) if d['scale'] else None}
+                               for k, d in deviation.items()}
+    return result
+
+
+# --- Весь parce.process_all: по одному скану против чтения наперёд и фоновой записи ---
+# Оба варианта пишут одни и те же файлы (проверяется побайтно). latency —
+# добавочная задержка чтения каждого файла, секунд: так выглядит сетевая
+# папка вроде P:/, где конвейер и выигрывает. JSON с отступами кодируется
+# чистым Python под GIL, поэтому на одном ядре перекрываются в основном
+# ожидания диска и сети, а не сама сериализация.
+def pipeline(data_dir, out_dir, formats=('json',), repeats=3, latency=0.0):
+    settings = {name: getattr(parce, name) for name in (
+        'INPUT_DIR', 'OUTPUT_DIR', 'CHECKPOINT_PATH', 'OUTPUT_FORMATS', 'METRICS_LOG', 'METRICS_PROM',
+        'PREFETCH', 'WRITE_QUEUE', 'read_surface_file')}
+    modes = {'sequential': {'PREFETCH': 0, 'WRITE_QUEUE': 0},
+             'pipelined': {'PREFETCH': settings['PREFETCH'], 'WRITE_QUEUE': settings['WRITE_QUEUE']}}
+    read = settings['read_surface_file']
+
+    def slow_read(path):
+        time.sleep(latency)
+        return read(path)
+
+    result = {}
+    try:
+        parce.INPUT_DIR = data_dir
+        parce.OUTPUT_FORMATS = tuple(formats)
+        parce.METRICS_LOG = parce.METRICS_PROM = None
+        if latency:
+            parce.read_surface_file = slow_read
+        for repeat in range(repeats):
+            for mode, overrides in modes.items():
+                parce.OUTPUT_DIR = os.path.join(out_dir, mode)
+                parce.CHECKPOINT_PATH = os.path.join(out_dir, f"{mode}.npz")
+                if os.path.exists(parce.CHECKPOINT_PATH):
+                    os.remove(parce.CHECKPOINT_PATH)
+                for name, value in overrides.items():
+                    setattr(parce, name, value)
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                    metrics = parce.process_all()
+                seconds = time.perf_counter() - started
+                best = result.setdefault(mode, {'seconds': None})
+                if best['seconds'] is None or seconds < best['seconds']:
+                    best.update({'seconds': round(seconds, 3),
+                                 'stages': {k: round(v, 3) for k, v in metrics.seconds.items()}})
+    finally:
+        for name, value in settings.items():
+            setattr(parce, name, value)
+
+    a, b = (os.path.join(out_dir, mode) for mode in modes)
+    mismatched = []
+    for root, _, files in os.walk(a):
+        for name in files:
+            path = os.path.join(root, name)
+            other = os.path.join(b, os.path.relpath(path, a))
+            if not os.path.exists(other) or not filecmp.cmp(path, other, shallow=False):
+                mismatched.append(os.path.relpath(path, a))
+    result['identical'] = not mismatched
+    result['mismatched'] = mismatched[:10]
+    result['speedup'] = round(result['sequential']['seconds'] / result['pipelined']['seconds'], 3)
+    return result
+
+
+# --- Методы интерполяции против cubic на поверхности синтетического склада ---
+# Для каждого разрешения и метода: время, ячеек без значения (без заполнения)
+# и отклонение Z и цвета от cubic в ячейках, где cubic даёт значение;
+# с memory=True — пик памяти отдельным проходом под tracemalloc.
+def interpolation_report(grid=(120, 100), scans=40, pattern='mixed', noise=0.0, seed=0, interval=SCAN_INTERVAL,
+                         resolutions=(50, 100, 200, 400, 800), methods=METHODS, radius=None, fill=True, memory=True):
+    quality = synthetic_quality(scans, seed, interval)
+    stack = LayerStack()
+    for t, xs, ys, zs in synthetic_scans(grid, scans, pattern, noise, seed, interval):
+        q = float(quality[int((t - QUALITY_START).total_seconds() // 60)])
+        stack.apply_scan(xs, ys, zs, q, parce.get_color(q))
+    xs, ys, zs, _, codes = stack.surface()
+    data = np.stack([xs, ys, zs], axis=1)
+    colors = np.array([mcolors.to_rgb(c) for c in stack.palette])[codes]
+
+    rows = []
+    for res in resolutions:
+        reference = None
+        for method in ('cubic',) + tuple(m for m in methods if m != 'cubic'):
+            started = time.perf_counter()
+            _, _, raw_z, raw_rgb = interpolate_points(data, colors, res, 1, True, method, radius)
+            seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            _, _, grid_z, _ = interpolate_points(data, colors, res, 1, True, method, radius, fill=True)
+            filled_seconds = time.perf_counter() - started
+            if method == 'cubic':
+                reference = raw_z, raw_rgb
+            valid = ~np.isnan(reference[0]) & ~np.isnan(raw_z)
+            dz = np.abs(raw_z[valid] - reference[0][valid])
+            row = {
+                'resolution': res, 'method': method, 'cells': int(raw_z.size),
+                'seconds': round(seconds, 4), 'filled_seconds': round(filled_seconds, 4),
+                'holes': int(np.isnan(raw_z).sum()), 'holes_filled': int(np.isnan(grid_z).sum()),
+                'z_rmse': round(float(np.sqrt((dz ** 2).mean())), 3) if dz.size else None,
+                'z_max_abs': round(float(dz.max()), 3) if dz.size else None,
+                'z_range': round(float(np.nanmax(reference[0]) - np.nanmin(reference[0])), 3),
+                'rgb_mean_abs': round(float(np.abs(raw_rgb[valid] - reference[1][valid]).mean()), 4),
+                'peak_mb': None,
+            }
+            if memory:
+                tracemalloc.start()
+                interpolate_points(data, colors, res, 1, True, method, radius, fill)
+                row['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+                tracemalloc.stop()
+            rows.append(row)
+    return rows
+
+
+# --- Стек по разделам на диске против LayerStack в памяти ---
+# Оба стека получают одни и те же сканы; после каждого сравниваются пропавшие
+# точки, surface() и layers() (должны совпадать побайтно). Время — накопление
+# со сжатием, пик памяти — отдельным проходом под tracemalloc (только
+# накопление: вывод по разделам всё равно собирает весь штабель). Затем
+# интерполяция 'idw' последней поверхности целиком и по квадратам tile; на
+# регулярной сетке колонок много равноудалённых соседей, поэтому кроме
+# совпадения сообщается наибольшее расхождение.
+def partitions_report(grid=(120, 100), scans=40, pattern='mixed', noise=0.0, seed=0, interval=SCAN_INTERVAL,
+                      tile=TILE, tolerance=None, max_depth=None, resolution=400, radius=None, memory=True):
+    quality = synthetic_quality(scans, seed, interval)
+    work = tempfile.mkdtemp(prefix='bench_')
+    try:
+        def accumulate(stack, t, xs, ys, zs, q):
+            lost = stack.apply_scan_lost(xs, ys, zs, q, parce.get_color(q))
+            stack.compact(tolerance, max_depth)
+            if isinstance(stack, PartitionedStack):
+                commit(stack.directory, stack.meta(t, None))
+            return lost
+
+        plain, parted = LayerStack(), PartitionedStack.create(os.path.join(work, 'parts'), tile)
+        seconds = {'memory': 0.0, 'partitions': 0.0}
+        mismatched, touched = [], []
+        for n, (t, xs, ys, zs) in enumerate(synthetic_scans(grid, scans, pattern, noise, seed, interval)):
+            q = float(quality[int((t - QUALITY_START).total_seconds() // 60)])
+            results = {}
+            for name, stack in (('memory', plain), ('partitions', parted)):
+                started = time.perf_counter()
+                lost = accumulate(stack, t, xs, ys, zs, q)
+                seconds[name] += time.perf_counter() - started
+                results[name] = lost + stack.surface() + stack.layers()
+            touched.append(len(parted.touched))
+            if not all(np.array_equal(a, b) and a.dtype == b.dtype
+                       for a, b in zip(results['memory'], results['partitions'])):
+                mismatched.append(n)
+
+        peaks = {}
+        if memory:
+            for name, stack in (('memory', LayerStack()),
+                                ('partitions', PartitionedStack.create(os.path.join(work, 'traced'), tile))):
+                tracemalloc.start()
+                for t, xs, ys, zs in synthetic_scans(grid, scans, pattern, noise, seed, interval):
+                    accumulate(stack, t, xs, ys, zs, float(quality[int((t - QUALITY_START).total_seconds() // 60)]))
+                peaks[name] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+                tracemalloc.stop()
+
+        # Интерполяция последней поверхности: 'idw' целиком против квадратов
+        xs, ys, zs, _, _ = plain.surface()
+        points = np.column_stack([xs, ys])
+        radius = radius or 4 * max(np.ptp(xs) / max(grid[0] - 1, 1), np.ptp(ys) / max(grid[1] - 1, 1))
+        gx, gy = np.meshgrid(np.linspace(xs.min(), xs.max(), resolution), np.linspace(ys.min(), ys.max(), resolution))
+        cells = np.column_stack([gx.ravel(), gy.ravel()])
+        interpolation = {}
+        grids = {}
+        for name, step in (('whole', None), ('tiled', tile)):
+            started = time.perf_counter()
+            grids[name] = interpolate_values(points, zs[:, None], cells, 'idw', radius, True, tile=step)
+            interpolation[name] = {'seconds': round(time.perf_counter() - started, 4), 'peak_mb': None}
+            if memory:
+                tracemalloc.start()
+                interpolate_values(points, zs[:, None], cells, 'idw', radius, True, tile=step)
+                interpolation[name]['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+                tracemalloc.stop()
+        interpolation['identical'] = bool(np.array_equal(grids['whole'], grids['tiled'], equal_nan=True))
+        diff = np.abs(grids['whole'] - grids['tiled'])
+        interpolation['differing_cells'] = int((diff > 0).sum())
+        interpolation['max_abs_diff'] = float(np.nanmax(diff)) if diff.size else 0.0
+        interpolation['radius'] = radius
+        interpolation['cells'] = len(cells)
+
+        files = [os.path.join(root, f) for root, _, names in os.walk(parted.directory) for f in names]
+        return {
+            'columns': plain.size, 'partitions': len(parted.partitions),
+            'touched_mean': round(float(np.mean(touched)), 2) if touched else 0,
+            'memory_seconds': round(seconds['memory'], 3), 'partitions_seconds': round(seconds['partitions'], 3),
+            'memory_peak_mb': peaks.get('memory'), 'partitions_peak_mb': peaks.get('partitions'),
+            'disk_mb': round(sum(os.path.getsize(f) for f in files) / 1e6, 2),
+            'identical': not mismatched, 'mismatched_scans': mismatched[:10],
+            'interpolation': interpolation,
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+# --- Холодный старт: отдельный процесс python на команду, лучшее из repeats ---
+# parse — один скан с чистой контрольной точкой, первый раз без кэша качества
+# (CSV разбирается pandas), затем с кэшем; рабочая папка процесса — work,
+# туда же пишутся замеры и кэш.
+def startup(data_dir, work, repeats=5):
+    here = os.path.dirname(os.path.abspath(__file__))
+    cli = os.path.join(here, 'cli.py')
+    # Вход interp.py — строки x y z цвет: первый скан, окрашенный по высоте
+    scan = os.path.join(work, 'colored.txt')
+    first = min(f for f in os.listdir(data_dir) if f.startswith('surface-tank'))
+    xyz = read_surface_file(os.path.join(data_dir, first)).xyz
+    with open(scan, 'w') as f:
+        f.writelines(f"{x:.2f} {y:.2f} {z:.2f} {parce.get_color(30 + 10 * z / Z_MAX)}\n" for x, y, z in xyz.tolist())
+    parse = [sys.executable, cli, 'parse', '--input', data_dir, '--output', os.path.join(work, 'parse'),
+             '--checkpoint', os.path.join(work, 'checkpoint.npz')]
+    commands = {
+        'cli --help': [sys.executable, cli, '--help'],
+        'import parce': [sys.executable, '-c', 'import parce'],
+        'import interp': [sys.executable, '-c', 'import interp'],
+        'parse (без кэша качества)': parse,
+        'parse (с кэшем качества)': parse,
+        'interpolate один файл': [sys.executable, cli, 'interpolate', scan, '--output', os.path.join(work, 'interp'),
+                                  '--resolution', '50', '--scale', '1'],
+    }
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([here, os.environ.get('PYTHONPATH', '')]))
+    result = {}
+    for name, command in commands.items():
+        best = None
+        for _ in range(repeats):
+            for path in [os.path.join(work, 'checkpoint.npz')] + \
+                    ([os.path.join(work, 'quality_cache.npz')] if 'без кэша' in name else []):
+                if os.path.exists(path):
+                    os.remove(path)
+            started = time.perf_counter()
+            subprocess.run(command, cwd=work, env=env, check=True, stdout=subprocess.DEVNULL)
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+        result[name] = round(best, 3)
+    return result
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 1e6 if sys.platform == 'darwin' else rss / 1e3, 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера на синтетическом складе")
+    parser.add_argument('--grid', type=int, nargs=2, default=(120, 100), metavar=('NX', 'NY'))
+    parser.add_argument('--scans', type=int, default=40)
+    parser.add_argument('--pattern', choices=PATTERNS, default='mixed')
+    parser.add_argument('--noise', type=float, default=0.0, help="шум сканера по z, единиц координат")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resolution', type=int, default=50, help="сторона сетки интерполяции")
+    parser.add_argument('--interpolate-every', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help="без второго прохода под tracemalloc (нет пиков памяти)")
+    parser.add_argument('--data', help="папка для синтетики (по умолчанию временная)")
+    parser.add_argument('--output', default='benchmark_results.jsonl', help="куда дописать результат (JSON lines)")
+    parser.add_argument('--interval', type=float, default=5, help="минут между сканами")
+    parser.add_argument('--soak', action='store_true', help="только накопление в памяти (например, год: --scans 8760 --interval 60)")
+    parser.add_argument('--merge-tolerance', type=float, help="для --soak и --partitions: LayerStack.compact(tolerance)")
+    parser.add_argument('--max-layers', type=int, help="для --soak и --partitions: LayerStack.compact(max_depth)")
+    parser.add_argument('--compare', action='store_true', help="для --soak: сравнить аналитику со стеком без сжатия")
+    parser.add_argument('--startup', action='store_true',
+                        help="холодный старт команд cli.py на одном синтетическом скане (отдельные процессы)")
+    parser.add_argument('--interpolation', action='store_true',
+                        help="методы интерполяции против cubic по времени и точности на разных разрешениях")
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[50, 100, 200, 400, 800],
+                        help="для --interpolation: стороны сетки")
+    parser.add_argument('--methods', nargs='+', choices=METHODS, default=list(METHODS), help="для --interpolation")
+    parser.add_argument('--radius', type=float, help="для --interpolation и --partitions: радиус поиска соседей 'idw'")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="parce.process_all по одному скану против чтения наперёд и фоновой записи")
+    parser.add_argument('--formats', nargs='+', default=['json'], help="для --pipeline: parce.OUTPUT_FORMATS")
+    parser.add_argument('--repeats', type=int, default=3, help="для --pipeline и --startup: лучший из стольких прогонов")
+    parser.add_argument('--latency', type=float, default=0.0, help="для --pipeline: задержка чтения файла, мс")
+    parser.add_argument('--partitions', action='store_true',
+                        help="стек по разделам на диске против LayerStack в памяти, idw по квадратам против целиком")
+    parser.add_argument('--tile', type=float, default=TILE, help="для --partitions: сторона раздела и квадрата idw")
+    args = parser.parse_args(argv)
+    interval = timedelta(minutes=args.interval)
+    environment = {'python': platform.python_version(), 'numpy': np.__version__,
+                   'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+    if args.soak:
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('data', 'output')},
+            'environment': environment,
+            'soak': soak(tuple(args.grid), args.scans, args.pattern, args.noise, args.seed, interval,
+                         args.merge_tolerance, args.max_layers, args.compare),
+            'max_rss_mb': max_rss_mb(),
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        for key, value in result['soak'].items():
+            if key != 'deviation':
+                print(f"{key:<32} {value}")
+        for key, dev in result['soak'].get('deviation', {}).items():
+            share = '-' if dev['max_share'] is None else f"{dev['max_share']:.2%}"
+            print(f"{'отклонение ' + key:<32} макс. {dev['max_abs']:.6g} ({share}), в конце {dev['final']:.6g}")
+        print(f"[+] Пиковый RSS: {result['max_rss_mb']} МБ, результат дописан в {args.output}")
+        return result
+
+    if args.startup:
+        work = tempfile.mkdtemp(prefix='bench_')
+        try:
+            data_dir = os.path.join(work, 'input')
+            generate(data_dir, tuple(args.grid), 1, args.pattern, args.noise, args.seed, interval)
+            timings = startup(data_dir, work, args.repeats)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('data', 'output')},
+            'environment': environment,
+            'startup': timings,
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        for name, seconds in timings.items():
+            print(f"{name:<28} {seconds:>7.3f} с")
+        print(f"[+] Лучшее из {args.repeats} запусков, результат дописан в {args.output}")
+        return result
+
+    if args.partitions:
+        report = partitions_report(tuple(args.grid), args.scans, args.pattern, args.noise, args.seed, interval,
+                                   args.tile, args.merge_tolerance, args.max_layers, args.resolution,
+                                   args.radius, memory=not args.no_memory)
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('data', 'output')},
+            'environment': environment,
+            'partitions': report,
+            'max_rss_mb': max_rss_mb(),
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        for key, value in report.items():
+            if key != 'interpolation':
+                print(f"{key:<24} {value}")
+        interpolation = report['interpolation']
+        for name in ('whole', 'tiled'):
+            peak = '-' if interpolation[name]['peak_mb'] is None else f"{interpolation[name]['peak_mb']:.1f}"
+            print(f"idw {name:<20} {interpolation[name]['seconds']:>8.3f} с, пик {peak} МБ")
+        verdict = 'совпадает' if interpolation['identical'] else \
+            f"различается в {interpolation['differing_cells']} ячейках, до {interpolation['max_abs_diff']:.3g}"
+        print(f"[+] idw по квадратам {verdict} ({interpolation['cells']} ячеек, радиус {interpolation['radius']:.1f}); "
+              f"результат дописан в {args.output}")
+        return result
+
+    if args.interpolation:
+        rows = interpolation_report(tuple(args.grid), args.scans, args.pattern, args.noise, args.seed, interval,
+                                    args.resolutions, args.methods, args.radius, memory=not args.no_memory)
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('data', 'output')},
+            'environment': environment,
+            'interpolation': rows,
+            'max_rss_mb': max_rss_mb(),
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        print(f"{'сетка':>6} {'метод':<7} {'время, с':>9} {'с заполн.':>9} {'пустых':>8} "
+              f"{'СКО Z':>8} {'макс. Z':>9} {'цвет':>7} {'пик, МБ':>8}")
+        for r in rows:
+            rmse = '-' if r['z_rmse'] is None else f"{r['z_rmse']:.1f}"
+            worst = '-' if r['z_max_abs'] is None else f"{r['z_max_abs']:.1f}"
+            peak = '-' if r['peak_mb'] is None else f"{r['peak_mb']:.1f}"
+            print(f"{r['resolution']:>6} {r['method']:<7} {r['seconds']:>9.3f} {r['filled_seconds']:>9.3f} "
+                  f"{r['holes']:>8} {rmse:>8} {worst:>9} {r['rgb_mean_abs']:>7.4f} {peak:>8}")
+        print(f"[+] Отклонения — от cubic в ячейках, где оба метода дают значение; результат дописан в {args.output}")
+        return result
+
+    work = tempfile.mkdtemp(prefix='bench_')
+    data_dir = args.data or os.path.join(work, 'input')
+    if args.pipeline:
+        try:
+            generate(data_dir, tuple(args.grid), args.scans, args.pattern, args.noise, args.seed, interval)
+            compared = pipeline(data_dir, os.path.join(work, 'output'), args.formats, args.repeats,
+                                args.latency / 1000)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        result = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('data', 'output')},
+            'environment': environment,
+            'pipeline': compared,
+            'max_rss_mb': max_rss_mb(),
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        for mode in ('sequential', 'pipelined'):
+            stages = compared[mode]['stages']
+            waits = ', '.join(f"{k} {stages[k]:.2f} с" for k in ('load_wait', 'write_wait') if k in stages)
+            print(f"{mode:<12} {compared[mode]['seconds']:>9.3f} с  {waits}")
+        print(f"[+] Ускорение: {compared['speedup']:.2f}x, файлы "
+              f"{'совпадают' if compared['identical'] else 'различаются: ' + ', '.join(compared['mismatched'])}")
+        print(f"[+] Результат дописан в {args.output}")
+        return result
+
+    try:
+        started = time.perf_counter()
+        generate(data_dir, tuple(args.grid), args.scans, args.pattern, args.noise, args.seed, interval)
+        generated = time.perf_counter() - started
+        stages = run(data_dir, os.path.join(work, 'output'), args.resolution, args.interpolate_every)
+        if not args.no_memory:
+            tracemalloc.start()
+            traced = run(data_dir, os.path.join(work, 'traced'), args.resolution, args.interpolate_every)
+            tracemalloc.stop()
+            for name, stage in traced.items():
+                stages[name]['peak_mb'] = stage['peak_mb']
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('data', 'output')},
+        'environment': environment,
+        'generate_seconds': round(generated, 3),
+        'stages': stages,
+        'max_rss_mb': max_rss_mb(),
+    }
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+    print(f"{'стадия':<12} {'время, с':>9} {'элементов/с':>13} {'МБ/с':>8} {'пик, МБ':>8}")
+    for name, s in stages.items():
+        mb_per_s = '-' if s['mb_per_s'] is None else f"{s['mb_per_s']:.2f}"
+        peak = '-' if s['peak_mb'] is None else f"{s['peak_mb']:.2f}"
+        print(f"{name:<12} {s['seconds']:>9.3f} {s['items_per_s'] or 0:>13,.0f} {mb_per_s:>8} {peak:>8}")
+    print(f"[+] Пиковый RSS: {result['max_rss_mb']} МБ, результат дописан в {args.output}")
+    return result
+
+
+if __name__ == '__main__':
+    main()
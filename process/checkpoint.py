@@ -0,0 +1,44 @@
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+
+# --- Отпечаток настроек, от которых зависит накопленное состояние ---
+# Качество до последнего обработанного скана, пороги цветов (константы и код
+# функции get_color, а для замыкания — ещё и захваченные значения) и прочие
+# настройки вроде окна усреднения.
+def settings_digest(quality_index, until, get_color, *settings):
+    h = hashlib.sha256()
+    h.update(quality_index.digest(until).encode())
+    code = get_color.__code__
+    h.update(code.co_code)
+    h.update(repr(code.co_consts).encode())
+    if get_color.__closure__:
+        h.update(repr([cell.cell_contents for cell in get_color.__closure__]).encode())
+    h.update(repr(settings).encode())
+    return h.hexdigest()
+
+
+# --- Сохранение контрольной точки (атомарно: временный файл + replace) ---
+def save_checkpoint(path, state, last_time, digest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, last_time=np.datetime64(last_time, 'ns'), digest=np.str_(digest), **state)
+    os.replace(tmp_path, path)
+
+
+# --- Загрузка контрольной точки: (state, last_time, digest) или None ---
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            state = {k: data[k] for k in data.files if k not in ('last_time', 'digest')}
+            last_time = data['last_time'].astype('datetime64[us]').item()
+            digest = str(data['digest'])
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"[!] Контрольная точка {path} повреждена: {e}")
+        return None
+    return state, last_time, digest
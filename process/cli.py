@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import argparse
+
+# --- Точка входа: python cli.py <команда> ---
+#   parse        накопление слоёв и вывод для сайта (parce.process_all)
+#   interpolate  интерполяция файла или папки на сетку (interp.py)
+#   process-all  старый конвейер окраски и интерполяции (process_all.py)
+#   watch        наблюдение за папкой сканов (watch.py)
+# Модуль команды, а с ним numpy, scipy и pandas, импортируется только при
+# запуске этой команды; --help и разбор аргументов их не трогают.
+# Пути и настройки без флагов берутся из настроек модуля команды.
+
+
+# --- Флаги -> настройки модуля (только заданные) ---
+def configure(module, args, names):
+    for flag, name in names.items():
+        value = getattr(args, flag, None)
+        if value is not None:
+            setattr(module, name, tuple(value) if isinstance(value, list) else value)
+
+
+PARCE_FLAGS = {'input': 'INPUT_DIR', 'quality': 'QUALITY_CSV', 'output': 'OUTPUT_DIR',
+               'checkpoint': 'CHECKPOINT_PATH', 'formats': 'OUTPUT_FORMATS', 'partitions': 'PARTITION_DIR'}
+
+
+def run_parse(args):
+    import parce
+    configure(parce, args, PARCE_FLAGS)
+    parce.process_all()
+
+
+def run_watch(args):
+    import parce
+    import watch
+    configure(parce, args, PARCE_FLAGS)
+    watch.watch()
+
+
+def run_process_all(args):
+    import process_all
+    configure(process_all, args, {'input': 'INPUT_DIR', 'quality': 'QUALITY_CSV', 'output': 'OUTPUT_DIR',
+                                  'checkpoint': 'CHECKPOINT_PATH', 'workers': 'WORKERS', 'method': 'INTERPOLATION',
+                                  'radius': 'IDW_RADIUS', 'fill': 'FILL_HOLES'})
+    if args.workers is not None:
+        process_all.MAX_PENDING = 2 * args.workers
+    process_all.process_all()
+
+
+# --- Один файл — сразу в этом процессе, папка — через process_folder ---
+def run_interpolate(args):
+    from pathlib import Path
+    import interp
+    method = args.method or interp.METHOD
+    radius = args.radius if args.radius is not None else interp.IDW_RADIUS
+    fill = args.fill if args.fill is not None else interp.FILL_HOLES
+    tile = args.tile if args.tile is not None else interp.TILE
+    if os.path.isdir(args.path):
+        interp.process_folder(args.path, args.output, args.resolution, args.scale, args.colors,
+                              args.workers or interp.WORKERS, method, radius, fill, tile)
+        return 0
+    output_path = Path(args.output)
+    output_path.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    message = interp.interpolate_file(Path(args.path), output_path, args.resolution, args.scale, args.colors,
+                                      method, radius, fill, tile)
+    if message:
+        print(message)
+        return 1
+    print(f"[+] {output_path / Path(args.path).name} за {time.perf_counter() - started:.2f} с")
+    return 0
+
+
+def parser():
+    root = argparse.ArgumentParser(description="Обработка сканов штабеля")
+    commands = root.add_subparsers(dest='command', required=True)
+
+    for name, run, summary in (('parse', run_parse, "накопление слоёв и вывод для сайта"),
+                               ('watch', run_watch, "наблюдение за папкой сканов")):
+        sub = commands.add_parser(name, help=summary)
+        sub.add_argument('--input', help="папка со сканами и CSV качества")
+        sub.add_argument('--quality', help="имя CSV качества в папке сканов")
+        sub.add_argument('--output', help="папка для вывода")
+        sub.add_argument('--checkpoint', help="файл контрольной точки")
+        sub.add_argument('--formats', nargs='+', choices=('json', 'binary', 'delta', 'tiles'))
+        sub.add_argument('--partitions', help="папка стека слоёв по разделам (очень большие сканы) вместо контрольной точки")
+        sub.set_defaults(run=run)
+
+    sub = commands.add_parser('interpolate', help="интерполяция файла или папки на сетку")
+    sub.add_argument('path', nargs='?', default='./inputFiles', help="файл x y z цвет или папка с такими файлами")
+    sub.add_argument('--output', default='./output', help="папка для результатов")
+    sub.add_argument('--resolution', type=int, default=200, help="сторона сетки до масштаба")
+    sub.add_argument('--scale', type=float, default=0.5)
+    sub.add_argument('--no-colors', dest='colors', action='store_false', help="цвет ближайшей точки без сглаживания")
+    sub.add_argument('--workers', type=int, help="процессов для папки")
+    sub.add_argument('--tile', type=float, help="для idw с --radius: считать сетку квадратами с такой стороной")
+    sub.set_defaults(run=run_interpolate)
+
+    sub = commands.add_parser('process-all', help="окраска поднявшихся точек и интерполяция (process_all.py)")
+    sub.add_argument('--input', help="папка со сканами")
+    sub.add_argument('--quality', help="CSV качества")
+    sub.add_argument('--output', help="папка для результатов")
+    sub.add_argument('--checkpoint', help="файл контрольной точки")
+    sub.add_argument('--workers', type=int, help="процессов для интерполяции")
+    sub.set_defaults(run=run_process_all)
+
+    for sub in (commands.choices['interpolate'], commands.choices['process-all']):
+        sub.add_argument('--method', choices=('cubic', 'linear', 'idw'), help="метод интерполяции")
+        sub.add_argument('--radius', type=float, help="для idw: радиус поиска соседей")
+        sub.add_argument('--fill', action='store_true', default=None, help="заполнять ячейки вне охвата скана")
+    return root
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    return args.run(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import re
+
+import numpy as np
+
+from surface_reader import read_surface_file
+
+# --- Интерполяция скана на регулярную сетку ---
+# Методы:
+#   'cubic'  — Клаф — Точер по триангуляции Делоне (как griddata(..., 'cubic')), по умолчанию
+#   'linear' — линейная по той же триангуляции; на крупных сетках в 2-3 раза быстрее cubic
+#   'idw'    — обратные расстояния по k ближайшим точкам из KD-дерева в радиусе radius;
+#              без триангуляции: на мелких сетках на порядок быстрее, но время растёт
+#              с числом ячеек быстрее, чем у linear (замеры: benchmark.py --interpolation)
+# Вне выпуклой оболочки (cubic, linear) и там, где в радиусе нет точек (idw),
+# получается NaN. С fill=True такие ячейки получают значение ближайшей точки
+# скана — сетка выходит полной. Ячейки считаются кусками по chunk штук,
+# поэтому временные массивы интерполятора не растут с разрешением.
+# scipy (и matplotlib для цветов не в виде '#rrggbb') импортируются при первом
+# вызове: импорт модуля не тянет их в холодный старт.
+#
+# tile — для сканов в десятки миллионов точек: сетка считается квадратами со
+# стороной tile, KD-дерево каждого строится только по точкам квадрата с
+# запасом radius (для fill — полосы с растущим запасом), так что в памяти не
+# бывает дерева по всему скану. Только для 'idw' с radius: соседи ячейки в радиусе
+# целиком попадают в запас, и результат совпадает с расчётом без tile (кроме
+# равноудалённых соседей сверх k — порядок их выбора может отличаться).
+# 'cubic' и 'linear' опираются на общую триангуляцию и градиенты по соседним
+# треугольникам — по квадратам их не посчитать без швов.
+METHODS = ('cubic', 'linear', 'idw')
+CHUNK = 1 << 14  # ячеек сетки за один вызов интерполятора
+IDW_NEIGHBORS = 8
+IDW_POWER = 2
+HEX = re.compile(r'#[0-9a-fA-F]{6}')
+
+
+# --- RGB 0..1 для цветов палитры: (n, 3), как matplotlib.colors.to_rgb ---
+def palette_rgb(palette):
+    rgb = []
+    for color in palette:
+        if HEX.fullmatch(color):
+            rgb.append(tuple(int(color[i:i + 2], 16) / 255 for i in (1, 3, 5)))
+        else:
+            import matplotlib.colors as mcolors
+            rgb.append(mcolors.to_rgb(color))
+    return np.array(rgb, dtype=float).reshape(-1, 3)
+
+
+# --- Значения в ячейках cells (M, 2) кусками: evaluate(куску) -> (len, k) ---
+def _chunked(evaluate, cells, channels, chunk=CHUNK):
+    out = np.empty((len(cells), channels))
+    for start in range(0, len(cells), chunk):
+        out[start:start + chunk] = evaluate(cells[start:start + chunk])
+    return out
+
+
+# --- Взвешивание по обратным расстояниям; точное совпадение берёт значение точки ---
+def _idw(tree, values, cells, radius, neighbors, power):
+    k = min(neighbors, len(values))
+    dist, idx = tree.query(cells, k=k, distance_upper_bound=np.inf if radius is None else radius, workers=-1)
+    dist = dist.reshape(len(cells), k)
+    idx = idx.reshape(len(cells), k)
+    found = np.isfinite(dist)
+    with np.errstate(divide='ignore'):
+        weights = np.where(found, 1.0 / np.maximum(dist, 1e-12) ** power, 0.0)
+    total = weights.sum(axis=1, keepdims=True)
+    # Отсутствующие соседи имеют индекс len(values) — берём любую точку с нулевым весом
+    picked = values[np.where(found, idx, 0)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = (weights[..., None] * picked).sum(axis=1) / total
+    result[total[:, 0] == 0] = np.nan
+    return result
+
+
+# --- 'idw' по квадратам сетки со стороной tile (см. шапку модуля) ---
+# Ячейки идут полосами шириной tile по x: точки полосы с запасом radius
+# выбираются маской по всему скану и сортируются по y, квадраты полосы берут
+# из них диапазон по y. В памяти, кроме результата, — только точки и дерево
+# одного квадрата и порядок ячеек по x.
+def _idw_tiled(points, values, cells, radius, fill, neighbors, power, tile, chunk):
+    from scipy.spatial import cKDTree
+    px, py = points[:, 0], points[:, 1]
+    by_x = np.argsort(cells[:, 0], kind='stable')
+    # Номер полосы по отсортированным x не убывает — границы полос там, где он меняется
+    strips = (cells[by_x, 0] - cells[by_x[0], 0]) // tile
+    edges = np.flatnonzero(np.r_[True, strips[1:] != strips[:-1], True])
+    del strips
+    y0 = cells[:, 1].min()
+    result = np.full((len(cells), values.shape[1]), np.nan)
+    for start, stop in zip(edges[:-1], edges[1:]):
+        strip = by_x[start:stop]
+        lo, hi = cells[strip].min(axis=0), cells[strip].max(axis=0)
+        near = np.flatnonzero((px >= lo[0] - radius) & (px <= hi[0] + radius))
+        near = near[np.argsort(py[near], kind='stable')]
+        near_y = py[near]
+        square = (cells[strip, 1] - y0) // tile
+        by_y = np.argsort(square, kind='stable')
+        square = square[by_y]
+        bounds = np.flatnonzero(np.r_[True, square[1:] != square[:-1], True])
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            part = strip[by_y[first:last]]
+            part_y = cells[part, 1]
+            selected = near[np.searchsorted(near_y, part_y.min() - radius, 'left'):
+                            np.searchsorted(near_y, part_y.max() + radius, 'right')]
+            if len(selected):
+                tree, selected_values = cKDTree(points[selected]), values[selected]
+                result[part] = _chunked(lambda p: _idw(tree, selected_values, p, radius, neighbors, power),
+                                        cells[part], values.shape[1], chunk)
+            if fill:
+                _fill_square(points, values, cells, result, part, radius or tile)
+    return result
+
+
+# --- Пустые ячейки квадрата part — значением ближайшей точки скана ---
+# Запас вокруг квадрата растёт, пока ближайшая точка не окажется ближе
+# запаса: тогда точка ближе неё обязана лежать в прямоугольнике с запасом.
+def _fill_square(points, values, cells, result, part, halo):
+    from scipy.spatial import cKDTree
+    holes = part[np.isnan(result[part]).any(axis=1)]
+    if not len(holes):
+        return
+    lo, hi = cells[holes].min(axis=0), cells[holes].max(axis=0)
+    while len(holes):
+        halo *= 2
+        near = np.flatnonzero((points[:, 0] >= lo[0] - halo) & (points[:, 0] <= hi[0] + halo))
+        near = near[(points[near, 1] >= lo[1] - halo) & (points[near, 1] <= hi[1] + halo)]
+        if not len(near):
+            continue
+        dist, idx = cKDTree(points[near]).query(cells[holes], workers=-1)
+        found = (dist <= halo) | (len(near) == len(points))
+        result[holes[found]] = values[near[idx[found]]]
+        holes = holes[~found]
+
+
+# --- Значения (N, k) точек points (N, 2) в ячейках cells (M, 2): (M, k), NaN — нет значения ---
+def interpolate_values(points, values, cells, method='cubic', radius=None, fill=False,
+                       neighbors=IDW_NEIGHBORS, power=IDW_POWER, chunk=CHUNK, tile=None):
+    if method not in METHODS:
+        raise ValueError(f"Неизвестный метод интерполяции: {method} (есть {', '.join(METHODS)})")
+    if tile is not None:
+        if method != 'idw' or radius is None:
+            raise ValueError("Интерполяция по квадратам (tile) — только для 'idw' с заданным radius")
+        return _idw_tiled(points, values, cells, radius, fill, neighbors, power, tile, chunk)
+    from scipy.spatial import cKDTree
+    tree = None
+    if method == 'idw':
+        tree = cKDTree(points)
+        result = _chunked(lambda part: _idw(tree, values, part, radius, neighbors, power),
+                          cells, values.shape[1], chunk)
+    else:
+        from scipy.interpolate import CloughTocher2DInterpolator, LinearNDInterpolator
+        from scipy.spatial import Delaunay
+        tri = Delaunay(points)
+        interpolator = (CloughTocher2DInterpolator if method == 'cubic' else LinearNDInterpolator)(tri, values)
+        result = _chunked(interpolator, cells, values.shape[1], chunk)
+    if fill:
+        holes = np.flatnonzero(np.isnan(result).any(axis=1))
+        if len(holes):
+            tree = tree if tree is not None else cKDTree(points)
+            result[holes] = _chunked(lambda part: values[tree.query(part, workers=-1)[1]],
+                                     cells[holes], values.shape[1], chunk)
+    return result
+
+
+# --- Сетка res x res по охвату точек, Z и цвета (RGB 0..1) в ячейках ---
+# interpolate_colors=False — цвет ближайшей точки без сглаживания; иначе
+# цвета интерполируются тем же методом, что и Z, а пустые ячейки цвета
+# (без fill) получают средний цвет скана, как раньше.
+def interpolate_points(data, colors, base_resolution=200, scale=0.5, interpolate_colors=True,
+                       method='cubic', radius=None, fill=False, chunk=CHUNK, tile=None):
+    res = int(base_resolution * scale)
+    x, y, z = data[:, 0], data[:, 1], data[:, 2]
+
+    grid_x, grid_y = np.meshgrid(
+        np.linspace(x.min(), x.max(), res),
+        np.linspace(y.min(), y.max(), res)
+    )
+    points = np.column_stack([x, y])
+    cells = np.column_stack([grid_x.ravel(), grid_y.ravel()])
+
+    if interpolate_colors:
+        # Z и каналы RGB — одним интерполятором (одна триангуляция или одно дерево на файл)
+        grid = interpolate_values(points, np.column_stack([z, colors]), cells, method, radius, fill,
+                                  chunk=chunk, tile=tile).reshape(res, res, 4)
+        grid_z = grid[..., 0]
+        grid_rgb = grid[..., 1:]
+        mean_val = np.nanmean(colors, axis=0)
+        grid_rgb = np.where(np.isnan(grid_rgb), mean_val, grid_rgb)
+        grid_rgb = np.clip(grid_rgb, 0, 1)
+    else:
+        grid_z = interpolate_values(points, z[:, None], cells, method, radius, fill, chunk=chunk,
+                                    tile=tile).reshape(res, res)
+        # Ближайший цвет (без сглаживания)
+        from scipy.interpolate import NearestNDInterpolator
+        grid_rgb = _chunked(NearestNDInterpolator(points, colors), cells, 3, chunk).reshape(res, res, 3)
+        grid_rgb[np.isnan(grid_rgb)] = 0  # на всякий случай
+        grid_rgb = np.clip(grid_rgb, 0, 1)
+
+    return grid_x, grid_y, grid_z, grid_rgb
+
+
+# --- Точки скана с цветом (N, 3) и их цвета RGB 0..1 (для interp.py и process_all.py) ---
+def load_points(file_path):
+    scan = read_surface_file(file_path, header=False)
+    rows = scan.columns >= 4
+    # RGB — один раз на цвет палитры, а не на каждую точку
+    return scan.xyz[rows], palette_rgb(scan.palette)[scan.codes[rows]]
+
+
+# --- Запись сетки: строки 'x y z #rrggbb' ---
+def save_interpolated_points(file_path, grid_x, grid_y, grid_z, grid_rgb):
+    # Ячейки без Z пропускаются; цвета переводятся в hex один раз на каждый различный цвет,
+    # весь файл собирается одной строкой формата и пишется одним вызовом
+    keep = ~np.isnan(grid_z)
+    rgb = (np.clip(grid_rgb[keep], 0, 1) * 255).astype(int)
+    palette, codes = np.unique(rgb, axis=0, return_inverse=True)
+    hex_colors = np.array(['#%02x%02x%02x' % tuple(c) for c in palette.tolist()], dtype=object)
+    rows = np.empty((len(rgb), 4), dtype=object)
+    rows[:, 0] = grid_x[keep].tolist()
+    rows[:, 1] = grid_y[keep].tolist()
+    rows[:, 2] = grid_z[keep].tolist()
+    rows[:, 3] = hex_colors[codes.ravel()]
+    with open(file_path, 'w') as f:
+        f.write(('%.3f %.3f %.3f %s\n' * len(rows)) % tuple(rows.ravel().tolist()))
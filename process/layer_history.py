@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+
+import numpy as np
+
+# --- История слоёв по колонкам: журнал событий и индекс ---
+# Журнал только дописывается. После каждого скана для каждой изменившейся
+# колонки пишутся события: 'remove' для снятых слоёв (глубина keep и выше) и
+# 'add' для новых слоёв на тех же глубинах. Одна запись — 32 байта:
+#   events.bin   time (ns), col, depth, kind (0 — remove, 1 — add), код цвета, z, quality
+#   columns.bin  x, y (float64) колонки с номером col — в порядке появления
+#   palette.txt  цвета, по одному в строке — код цвета = номер строки
+# Индекс сортирует события по (колонка, глубина, время). Слой колонки на
+# глубине d в момент T — последнее событие (col, d) не позже T, если это
+# 'add', поэтому состояние колонки или окна восстанавливается бинарным
+# поиском, без проигрывания сканов.
+EVENT = np.dtype([('time', '<i8'), ('col', '<u4'), ('depth', '<u2'), ('kind', 'u1'), ('color', 'u1'),
+                  ('z', '<f8'), ('quality', '<f8')])
+REMOVE, ADD = 0, 1
+
+
+def _paths(directory):
+    return (os.path.join(directory, 'events.bin'), os.path.join(directory, 'columns.bin'),
+            os.path.join(directory, 'palette.txt'))
+
+
+def _read_palette(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+# --- События скана: before — stack.snapshot() до скана, stack — после ---
+def scan_events(before, stack, time):
+    after = stack.state()
+    n, size = len(before['count']), len(after['count'])
+    width = max(before['z'].shape[1], after['z'].shape[1])
+    old, new = {}, {}
+    for name in ('z', 'quality', 'color'):
+        old[name] = np.zeros((size, width), dtype=after[name].dtype)
+        old[name][:n, :before[name].shape[1]] = before[name]
+        new[name] = np.zeros((size, width), dtype=after[name].dtype)
+        new[name][:, :after[name].shape[1]] = after[name]
+    old_count = np.zeros(size, dtype=np.int64)
+    old_count[:n] = before['count']
+    new_count = after['count']
+
+    # keep — сколько нижних слоёв совпадает до и после скана
+    depth = np.arange(width)
+    same = (old['z'] == new['z']) & (old['quality'] == new['quality']) & (old['color'] == new['color'])
+    same &= depth < np.minimum(old_count, new_count)[:, None]
+    keep = np.argmin(np.concatenate([same, np.zeros((size, 1), dtype=bool)], axis=1), axis=1)
+
+    removed = (depth >= keep[:, None]) & (depth < old_count[:, None])
+    added = (depth >= keep[:, None]) & (depth < new_count[:, None])
+    cols_r, depth_r = np.nonzero(removed)
+    cols_a, depth_a = np.nonzero(added)
+    events = np.zeros(len(cols_r) + len(cols_a), dtype=EVENT)
+    events['time'] = np.datetime64(time, 'ns').astype(np.int64)
+    events['col'] = np.r_[cols_r, cols_a]
+    events['depth'] = np.r_[depth_r, depth_a]
+    events['kind'] = np.r_[np.full(len(cols_r), REMOVE), np.full(len(cols_a), ADD)]
+    for name in ('z', 'quality', 'color'):
+        events[name] = np.r_[old[name][cols_r, depth_r], new[name][cols_a, depth_a]]
+    return events
+
+
+# --- Дописать события скана, новые колонки и новые цвета ---
+def append_scan(directory, before, stack, time):
+    append_events(directory, scan_events(before, stack, time),
+                  stack.col_x[:stack.size], stack.col_y[:stack.size], stack.palette)
+
+
+# --- То же по готовым событиям; col_x, col_y — все колонки стека, palette — вся палитра ---
+def append_events(directory, events, col_x, col_y, palette):
+    os.makedirs(directory, exist_ok=True)
+    events_path, columns_path, palette_path = _paths(directory)
+    with open(events_path, 'ab') as f:
+        f.write(events.tobytes())
+    known = os.path.getsize(columns_path) // 16 if os.path.exists(columns_path) else 0
+    with open(columns_path, 'ab') as f:
+        f.write(np.stack([col_x[known:], col_y[known:]], axis=1).tobytes())
+    known = len(_read_palette(palette_path))
+    with open(palette_path, 'a') as f:
+        f.writelines(f"{c}\n" for c in palette[known:])
+
+
+# --- Обрезать историю до контрольной точки (события позже last_time, лишние колонки и цвета) ---
+def trim_history(directory, last_time, stack):
+    events_path, columns_path, palette_path = _paths(directory)
+    if not os.path.exists(events_path):
+        return
+    times = np.fromfile(events_path, dtype=EVENT)['time']
+    end = int(np.searchsorted(times, np.datetime64(last_time, 'ns').astype(np.int64), side='right'))
+    for path, size in ((events_path, end * EVENT.itemsize), (columns_path, stack.size * 16)):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+    palette = _read_palette(palette_path)
+    if len(palette) > len(stack.palette):
+        with open(palette_path, 'w') as f:
+            f.writelines(f"{c}\n" for c in palette[:len(stack.palette)])
+
+
+# --- Индекс журнала: состояние колонки или окна на любой момент ---
+class HistoryIndex:
+    def __init__(self, directory):
+        events_path, columns_path, palette_path = _paths(directory)
+        events = np.fromfile(events_path, dtype=EVENT)
+        self.columns = np.fromfile(columns_path, dtype='<f8').reshape(-1, 2)
+        self.palette = _read_palette(palette_path)
+        self.times = np.unique(events['time'])
+        # Сортировка по (колонка, глубина, номер скана, remove раньше add)
+        self.rank = len(self.times) + 1
+        group = events['col'].astype(np.int64) << 16 | events['depth']
+        key = group * self.rank + np.searchsorted(self.times, events['time'])
+        order = np.lexsort((events['kind'], key))
+        self.events = events[order]
+        self.group = group[order]
+        self.key = key[order]
+        # Самая большая глубина, встречавшаяся у колонки
+        self.depth = np.zeros(len(self.columns), dtype=np.int64)
+        np.maximum.at(self.depth, events['col'].astype(np.int64), events['depth'].astype(np.int64) + 1)
+        self.lookup = {xy: i for i, xy in enumerate(map(tuple, self.columns.tolist()))}
+
+    # --- Слои колонок cols в момент time: список (x, y, точки снизу вверх) ---
+    def columns_at(self, cols, time):
+        import pandas as pd
+        cols = np.asarray(cols, dtype=np.int64)
+        t = np.searchsorted(self.times, np.datetime64(pd.Timestamp(time), 'ns').astype(np.int64), side='right') - 1
+        owner = np.repeat(np.arange(len(cols)), self.depth[cols])
+        depth = np.arange(len(owner)) - np.repeat(np.cumsum(self.depth[cols]) - self.depth[cols], self.depth[cols])
+        group = cols[owner] << 16 | depth
+        # Последнее событие (колонка, глубина) не позже time
+        i = np.searchsorted(self.key, group * self.rank + t, side='right') - 1
+        hit = (i >= 0) & (t >= 0)
+        i = np.where(hit, i, 0)
+        if len(self.key):
+            hit &= (self.group[i] == group) & (self.events['kind'][i] == ADD)
+        found = self.events[i[hit]]
+        bounds = np.searchsorted(owner[hit], np.arange(len(cols) + 1)).tolist()
+        zs, qs, ks = found['z'].tolist(), found['quality'].tolist(), found['color'].tolist()
+        result = []
+        for k, (x, y) in enumerate(self.columns[cols].tolist()):
+            result.append((x, y, [{'x': x, 'y': y, 'z': zs[j], 'quality': qs[j], 'color': self.palette[ks[j]]}
+                                  for j in range(bounds[k], bounds[k + 1])]))
+        return result
+
+    def column(self, x, y, time):
+        col = self.lookup.get((float(x), float(y)))
+        return [] if col is None else self.columns_at([col], time)[0][2]
+
+    # --- Окно x0..x1, y0..y1 в момент time: словарь x -> y -> точки, как 'array' в JSON ---
+    def window(self, x0, x1, y0, y1, time):
+        xs, ys = self.columns[:, 0], self.columns[:, 1]
+        cols = np.flatnonzero((xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1))
+        grid = {}
+        for x, y, points in self.columns_at(cols, time):
+            if points:
+                grid.setdefault(x, {})[y] = points
+        return grid
+
+
+if __name__ == '__main__':
+    # python layer_history.py папка_истории "2025-05-26 23:30:00" x y
+    # python layer_history.py папка_истории "2025-05-26 23:30:00" x0 x1 y0 y1
+    directory, moment, *coords = sys.argv[1:]
+    index = HistoryIndex(directory)
+    coords = [float(c) for c in coords]
+    result = index.column(*coords, moment) if len(coords) == 2 else index.window(*coords, moment)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,286 @@
+import os
+import json
+import shutil
+from datetime import datetime
+
+import numpy as np
+
+from layer_stack import LayerStack, WHITE
+
+# --- Стек слоёв по пространственным разделам на диске ---
+# Плоскость делится на квадраты со стороной tile; колонка (x, y) живёт в
+# разделе (floor(x / tile), floor(y / tile)). Каждый раздел — отдельный
+# LayerStack, его массивы лежат в папке раздела файлами .npy и читаются
+# через np.load(mmap_mode='r'). Скан применяется раздел за разделом:
+# в памяти только точки скана и один раздел, нетронутые разделы не читаются.
+#
+# Результат совпадает с общим LayerStack: слои колонки зависят только от
+# точек этой колонки, а общее для всех — палитра, порядок первого появления
+# x (col_rank) и порядок создания колонок — ведётся здесь же: палитра и
+# x_rank разделяются всеми разделами, вместо номера колонки хранится col_seq
+# = (номер скана << 32) | номер первой точки колонки в скане. Порядок вывода
+# (col_rank, col_seq) тот же, что (col_rank, номер колонки) в общем стеке.
+#
+# Раздел, изменённый сканом, пишется в новую папку <ix>_<iy>.<номер скана>;
+# commit пишет meta.json (палитра, x_rank, поколения разделов, время
+# последнего скана и отпечаток) через временный файл и os.replace и только
+# потом удаляет заменённые поколения — после сбоя meta.json указывает на
+# целое состояние предыдущего скана.
+#
+# Вывод тоже собирается по разделам: слои каждого раздела в порядке вывода
+# хранятся в памяти (outputs) и пересчитываются только для разделов,
+# записанных сканом; после open — один раз при первом выводе. surface() и
+# layers() сливают их, не читая разделы с диска. Число колонок, слоёв и
+# наибольшая глубина разделов ведутся в meta.json — замеры не трогают
+# разделы вовсе. Сам вывод (JSON, .srf, тайлы) по-прежнему описывает весь
+# штабель и собирается в памяти целиком; кэш outputs — ещё столько же.
+#
+# Аналитика (stock_analytics.py) и журнал слоёв (layer_history.py)
+# сравнивают весь стек до и после скана; по разделам они не ведутся
+# (parce.py предупреждает об этом при запуске).
+TILE = 5000.0  # сторона раздела, единиц координат
+META = 'meta.json'
+ARRAYS = ('col_x', 'col_y', 'col_rank', 'col_seq', 'known', 'acc_z', 'acc_color', 'count', 'z', 'quality', 'color')
+SEQ_SHIFT = 32
+
+
+class PartitionedStack:
+    def __init__(self, directory, tile=TILE):
+        self.directory = directory
+        self.tile = tile
+        self.palette = [WHITE]
+        self.palette_index = {WHITE: 0}
+        self.x_rank = {}
+        self.partitions = {}   # (ix, iy) -> поколение (номер скана, которым раздел записан)
+        self.stats = {}        # (ix, iy) -> (колонок, слоёв, наибольшая глубина)
+        self.outputs = {}      # (ix, iy) -> слои раздела в порядке вывода (см. output_layers)
+        self.scans = 0
+        self.size = 0
+        self.eroded = 0
+        self.touched = []      # разделы, изменённые последним сканом
+        self.unsettled = set() # разделы, в которых последнее сжатие по tolerance ещё сливало слои
+        self.last_time = None
+        self.digest = None
+        self._layers = None    # собранный вывод layers() до следующей записи раздела
+
+    # --- Пустой стек: папка очищается ---
+    @classmethod
+    def create(cls, directory, tile=TILE):
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        return cls(directory, tile)
+
+    # --- Зафиксированное состояние из meta.json или None; незафиксированные поколения удаляются ---
+    @classmethod
+    def open(cls, directory):
+        path = os.path.join(directory, META)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            meta = json.load(f)
+        stack = cls(directory, meta['tile'])
+        stack.palette = meta['palette']
+        stack.palette_index = {c: i for i, c in enumerate(stack.palette)}
+        stack.x_rank = {x: rank for x, rank in meta['x_rank']}
+        stack.partitions = {(ix, iy): gen for ix, iy, gen in meta['partitions']}
+        stack.stats = {(ix, iy): (columns, layers, deepest) for ix, iy, columns, layers, deepest in meta['stats']}
+        stack.unsettled = {(ix, iy) for ix, iy in meta['unsettled']}
+        stack.scans = meta['scans']
+        stack.size = meta['size']
+        stack.last_time = datetime.fromisoformat(meta['last_time']) if meta['last_time'] else None
+        stack.digest = meta['digest']
+        remove_stale(directory, meta)
+        return stack
+
+    def _path(self, key, gen):
+        return os.path.join(self.directory, f"{key[0]}_{key[1]}.{gen}")
+
+    def _read(self, key, names=ARRAYS):
+        path = self._path(key, self.partitions[key])
+        return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in names}
+
+    # --- Раздел как LayerStack с общими палитрой и x_rank, плюс col_seq ---
+    def _load(self, key):
+        if key in self.partitions:
+            state = self._read(key)
+            stack = LayerStack.from_state(dict(state, palette=np.array(self.palette)))
+            seq = np.array(state['col_seq'])
+        else:
+            stack = LayerStack()
+            seq = np.zeros(0, dtype=np.int64)
+        stack.palette = self.palette
+        stack.palette_index = self.palette_index
+        stack.x_rank = self.x_rank
+        return stack, seq
+
+    def _save(self, key, stack, seq):
+        path = self._path(key, self.scans)
+        os.makedirs(path, exist_ok=True)
+        state = dict(stack.state(), col_seq=seq)
+        # Через временный файл: файл того же поколения мог быть открыт через mmap
+        for name in ARRAYS:
+            tmp_path = os.path.join(path, f"{name}.tmp.npy")
+            np.save(tmp_path, state[name])
+            os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+        self.partitions[key] = self.scans
+        self.outputs[key] = output_layers(state)
+        counts = state['count']
+        self.stats[key] = (len(counts), int(counts.sum()), int(counts.max()) if len(counts) else 0)
+        self._layers = None
+        if key not in self.touched:
+            self.touched.append(key)
+
+    # --- Применение скана: как LayerStack.apply_scan ---
+    def apply_scan(self, xs, ys, zs, quality, color):
+        return self.apply_scan_lost(xs, ys, zs, quality, color)[2].tolist()
+
+    def apply_scan_lost(self, xs, ys, zs, quality, color):
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        zs = np.asarray(zs, dtype=float)
+        self.eroded = 0
+        self.scans += 1
+        self.touched = []
+        if len(zs) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # Ранги новых x — в порядке первого появления в скане, как их раздаёт общий стек
+        values, first = np.unique(xs, return_index=True)
+        for _, x in sorted((i, x) for x, i in zip(values.tolist(), first.tolist()) if x not in self.x_rank):
+            self.x_rank[x] = len(self.x_rank)
+
+        cells = np.stack([np.floor(xs / self.tile), np.floor(ys / self.tile)], axis=1).astype(np.int64)
+        keys, part = np.unique(cells, axis=0, return_inverse=True)
+        part = part.ravel()
+        order = np.argsort(part, kind='stable')
+        bounds = np.r_[0, np.cumsum(np.bincount(part, minlength=len(keys)))]
+
+        lost = []
+        for p, key in enumerate(map(tuple, keys.tolist())):
+            idx = order[bounds[p]:bounds[p + 1]]
+            stack, seq = self._load(key)
+            old = stack.size
+            pidx, layer, q = stack.apply_scan_lost(xs[idx], ys[idx], zs[idx], quality, color)
+            self.eroded += stack.eroded
+            if stack.size > old:
+                seq = np.concatenate([seq, self._first_points(stack, old, xs[idx], ys[idx], idx)])
+                self.size += stack.size - old
+            self._save(key, stack, seq)
+            lost.append((idx[pidx], layer, q))
+
+        pidx = np.concatenate([p for p, _, _ in lost])
+        layer = np.concatenate([j for _, j, _ in lost])
+        values = np.concatenate([q for _, _, q in lost])
+        order = np.lexsort((layer, pidx))
+        return pidx[order], layer[order], values[order]
+
+    # --- col_seq новых колонок: стек создаёт их в порядке первой точки; номер точки — в общем скане ---
+    def _first_points(self, stack, old, xs, ys, idx):
+        # Пара (x, y) как комплексное число: np.unique и searchsorted сортируют по x, затем по y
+        pairs, first = np.unique(xs + 1j * ys, return_index=True)
+        new = stack.col_x[old:stack.size] + 1j * stack.col_y[old:stack.size]
+        return (np.int64(self.scans) << SEQ_SHIFT) | idx[first[np.searchsorted(pairs, new)]].astype(np.int64)
+
+    # --- Сжатие слоёв, как LayerStack.compact ---
+    # Сжатие колонки зависит только от её слоёв. Предел глубины повторно
+    # ничего не меняет, а после слияния по tolerance новые средние могут
+    # слиться с соседями на следующем скане — такой раздел остаётся в
+    # unsettled и сжимается снова, пока проход не уберёт ни одного слоя.
+    # Остальные разделы, которых скан не касался, не читаются.
+    def compact(self, tolerance=None, max_depth=None):
+        if tolerance is None and not max_depth:
+            return 0
+        removed = 0
+        for key in self.touched + [key for key in sorted(self.unsettled) if key not in self.touched]:
+            stack, seq = self._load(key)
+            merged = stack.compact(tolerance, max_depth)
+            if merged:
+                self._save(key, stack, seq)
+            if merged and tolerance is not None:
+                self.unsettled.add(key)
+            else:
+                self.unsettled.discard(key)
+            removed += merged
+        return removed
+
+    # --- Колонок, слоёв и наибольшая глубина колонки, как LayerStack.layer_stats (по meta, без чтения разделов) ---
+    def layer_stats(self):
+        stats = list(self.stats.values())
+        return (sum(columns for columns, _, _ in stats), sum(layers for _, layers, _ in stats),
+                max((deepest for _, _, deepest in stats), default=0))
+
+    # --- Верхняя точка каждой непустой колонки, как LayerStack.surface ---
+    def surface(self):
+        col_x, col_y, counts, z, quality, color = self.layers()
+        filled = counts > 0
+        top = (np.cumsum(counts) - 1)[filled]
+        return col_x[filled], col_y[filled], z[top], quality[top], color[top]
+
+    # --- Все слои в порядке колонок, как LayerStack.layers ---
+    # Слои разделов (outputs) уже упорядочены внутри раздела; здесь они
+    # сливаются в общий порядок (col_rank, col_seq). Результат хранится до
+    # следующей записи раздела — surface() после layers() его не пересобирает.
+    def layers(self):
+        if self._layers is not None:
+            return self._layers
+        if not self.partitions:
+            return (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0),
+                    np.zeros(0, dtype=np.uint8))
+        for key in self.partitions:
+            if key not in self.outputs:
+                self.outputs[key] = output_layers(self._read(key))
+        parts = [self.outputs[key] for key in self.partitions]
+        merged = {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+        order = np.lexsort((merged['seq'], merged['rank']))
+        counts = merged['count']
+        # Слои колонки i в merged: starts[i] .. starts[i] + counts[i]; собираем их в порядке order
+        starts = np.cumsum(counts) - counts
+        ordered = counts[order]
+        take = np.repeat(starts[order] - (np.cumsum(ordered) - ordered), ordered) + np.arange(ordered.sum())
+        self._layers = (merged['x'][order], merged['y'][order], ordered,
+                        merged['z'][take], merged['quality'][take], merged['color'][take])
+        return self._layers
+
+    # --- Снимок meta.json; записывает его commit (можно в фоновом потоке) ---
+    def meta(self, last_time, digest):
+        self.last_time = last_time
+        self.digest = digest
+        return {
+            'tile': self.tile, 'scans': self.scans, 'size': self.size, 'palette': list(self.palette),
+            'x_rank': [[x, rank] for x, rank in self.x_rank.items()],
+            'partitions': [[ix, iy, gen] for (ix, iy), gen in self.partitions.items()],
+            'stats': [[ix, iy, *stats] for (ix, iy), stats in self.stats.items()],
+            'unsettled': [list(key) for key in sorted(self.unsettled)],
+            'last_time': last_time.isoformat() if last_time else None, 'digest': digest,
+        }
+
+
+# --- Слои раздела в порядке вывода, как их отдаёт LayerStack.layers(), плюс col_rank и col_seq колонок ---
+def output_layers(state):
+    order = np.lexsort((state['col_seq'], state['col_rank']))
+    counts = np.asarray(state['count'])[order]
+    filled = np.arange(state['z'].shape[1]) < counts[:, None]
+    return {'rank': state['col_rank'][order], 'seq': state['col_seq'][order], 'x': state['col_x'][order],
+            'y': state['col_y'][order], 'count': counts, 'z': state['z'][order][filled],
+            'quality': state['quality'][order][filled], 'color': state['color'][order][filled]}
+
+
+# --- Записать meta.json атомарно и удалить поколения разделов, которые он заменил ---
+def commit(directory, meta):
+    path = os.path.join(directory, META)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path)
+    remove_stale(directory, meta, meta['scans'])
+
+
+# Поколения не из meta; с before — только старше этого скана (новее пишет основной поток)
+def remove_stale(directory, meta, before=None):
+    current = {f"{ix}_{iy}.{gen}" for ix, iy, gen in meta['partitions']}
+    for name in os.listdir(directory):
+        base, _, gen = name.rpartition('.')
+        if not base or not gen.isdigit() or name in current:
+            continue
+        if before is None or int(gen) < before:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
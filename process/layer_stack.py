@@ -0,0 +1,386 @@
+import numpy as np
+
+WHITE = '#ffffff'
+
+
+# --- Накопительный стек слоёв на массивах ---
+# Вместо словаря словарей со списками точек каждая колонка (x, y) хранит
+# свои слои в строке предвыделенных массивов z / quality / код цвета,
+# отсортированных по z снизу вверх, плюс количество слоёв в колонке.
+# Скан применяется целиком одним пакетным обновлением по всем колонкам;
+# результат совпадает с поточечным циклом из parce.process_all.
+class LayerStack:
+    def __init__(self, columns=1024, depth=8):
+        self.index = {}        # (x, y) -> номер колонки
+        self.x_rank = {}       # x -> порядок первого появления (порядок ключей в JSON)
+        self.size = 0
+        self.palette = [WHITE]
+        self.palette_index = {WHITE: 0}
+        self._alloc(columns, depth)
+        self._order = None
+        self.eroded = 0        # колонок, срезанных последним сканом (новая точка ниже верхнего слоя)
+
+    def _alloc(self, columns, depth):
+        self.col_x = np.zeros(columns)
+        self.col_y = np.zeros(columns)
+        self.col_rank = np.zeros(columns, dtype=np.int64)
+        self.known = np.zeros(columns, dtype=bool)
+        self.acc_z = np.zeros(columns)
+        self.acc_color = np.zeros(columns, dtype=np.uint8)
+        self.count = np.zeros(columns, dtype=np.int64)
+        self.z = np.zeros((columns, depth))
+        self.quality = np.zeros((columns, depth))
+        self.color = np.zeros((columns, depth), dtype=np.uint8)
+
+    # --- Состояние в виде массивов (для контрольной точки) ---
+    def state(self):
+        n = self.size
+        depth = max(int(self.count[:n].max()) if n else 0, 1)
+        return {
+            'col_x': self.col_x[:n], 'col_y': self.col_y[:n], 'col_rank': self.col_rank[:n],
+            'known': self.known[:n], 'acc_z': self.acc_z[:n], 'acc_color': self.acc_color[:n],
+            'count': self.count[:n], 'z': self.z[:n, :depth], 'quality': self.quality[:n, :depth],
+            'color': self.color[:n, :depth], 'palette': np.array(self.palette),
+        }
+
+    # --- Копия слоёв колонок (например, до применения скана) ---
+    def snapshot(self):
+        state = self.state()
+        return {name: state[name].copy() for name in ('count', 'z', 'quality', 'color')}
+
+    @classmethod
+    def from_state(cls, state):
+        n, depth = state['z'].shape
+        # _apply читает не меньше двух слоёв колонки, даже если сохранён один
+        stack = cls(max(n, 1), max(depth, 2))
+        stack.palette = [str(c) for c in state['palette']]
+        stack.palette_index = {c: i for i, c in enumerate(stack.palette)}
+        for name in ('col_x', 'col_y', 'col_rank', 'known', 'acc_z', 'acc_color', 'count'):
+            getattr(stack, name)[:n] = state[name]
+        for name in ('z', 'quality', 'color'):
+            getattr(stack, name)[:n, :depth] = state[name]
+        stack.size = n
+        for col, (x, y, rank) in enumerate(zip(stack.col_x[:n].tolist(), stack.col_y[:n].tolist(),
+                                               stack.col_rank[:n].tolist())):
+            stack.index[(x, y)] = col
+            stack.x_rank.setdefault(x, rank)
+        return stack
+
+    # --- Рост массивов ---
+    def _grow(self, columns, depth):
+        old_columns, old_depth = self.z.shape
+        if columns <= old_columns and depth <= old_depth:
+            return
+        columns = max(columns, old_columns * 2 if columns > old_columns else old_columns)
+        depth = max(depth, old_depth * 2 if depth > old_depth else old_depth)
+        old = (self.col_x, self.col_y, self.col_rank, self.known, self.acc_z,
+               self.acc_color, self.count, self.z, self.quality, self.color)
+        self._alloc(columns, depth)
+        for new, prev in zip((self.col_x, self.col_y, self.col_rank, self.known, self.acc_z,
+                              self.acc_color, self.count), old[:7]):
+            new[:old_columns] = prev
+        for new, prev in zip((self.z, self.quality, self.color), old[7:]):
+            new[:old_columns, :old_depth] = prev
+
+    def color_code(self, color):
+        code = self.palette_index.get(color)
+        if code is None:
+            code = len(self.palette)
+            self.palette.append(color)
+            self.palette_index[color] = code
+        return code
+
+    # --- Номера колонок для точек скана (новые колонки создаются в порядке появления) ---
+    def _columns(self, xs, ys):
+        index = self.index
+        keys = list(zip(xs.tolist(), ys.tolist()))
+        cols = np.fromiter((index.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+        missing = np.flatnonzero(cols < 0)
+        if len(missing):
+            self._grow(self.size + len(missing), self.z.shape[1])
+            for i in missing.tolist():
+                key = keys[i]
+                col = index.get(key)
+                if col is None:
+                    col = self.size
+                    self.size += 1
+                    index[key] = col
+                    x, y = key
+                    if x not in self.x_rank:
+                        self.x_rank[x] = len(self.x_rank)
+                    self.col_x[col] = x
+                    self.col_y[col] = y
+                    self.col_rank[col] = self.x_rank[x]
+                cols[i] = col
+            self._order = None
+        return cols
+
+    # --- Применение скана ---
+    # Возвращает качества пропавших точек в том же порядке, в каком их
+    # собирал поточечный цикл (по точкам скана, внутри колонки снизу вверх).
+    def apply_scan(self, xs, ys, zs, quality, color):
+        return self.apply_scan_lost(xs, ys, zs, quality, color)[2].tolist()
+
+    # --- То же; пропавшие точки — массивы (номер точки скана, слой, качество) ---
+    def apply_scan_lost(self, xs, ys, zs, quality, color):
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        zs = np.asarray(zs, dtype=float)
+        self.eroded = 0
+        if len(zs) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        code = self.color_code(color)
+        cols = self._columns(xs, ys)
+
+        # Повтор одной колонки внутри скана обрабатывается отдельным проходом,
+        # чтобы каждый проход обновлял каждую колонку не больше одного раза
+        order = np.argsort(cols, kind='stable')
+        sorted_cols = cols[order]
+        starts = np.flatnonzero(np.r_[True, sorted_cols[1:] != sorted_cols[:-1]])
+        group = np.repeat(starts, np.diff(np.r_[starts, len(cols)]))
+        occurrence = np.empty(len(cols), dtype=np.int64)
+        occurrence[order] = np.arange(len(cols)) - group
+
+        lost = []
+        for rnd in range(int(occurrence.max()) + 1):
+            points = np.flatnonzero(occurrence == rnd)
+            lost.append(self._apply(cols[points], zs[points], points, quality, code))
+
+        if len(lost) == 1:
+            return lost[0]
+        pidx = np.concatenate([p for p, _, _ in lost])
+        layer = np.concatenate([j for _, j, _ in lost])
+        values = np.concatenate([q for _, _, q in lost])
+        order = np.lexsort((layer, pidx))
+        return pidx[order], layer[order], values[order]
+
+    def _apply(self, cols, zs, pidx, quality, code):
+        rows = np.arange(len(cols))
+        n_colors = len(self.palette)
+
+        # Шаг 1: накопленные изменения (максимальный z и цвет последнего подъёма)
+        known = self.known[cols]
+        rise = known & (zs > self.acc_z[cols])
+        current = np.where(rise, code, np.where(known, self.acc_color[cols], 0)).astype(np.uint8)
+        update = ~known | rise
+        self.acc_z[cols[update]] = zs[update]
+        self.acc_color[cols[rise]] = code
+        self.known[cols] = True
+
+        # Шаг 2: текущие слои колонок
+        n = self.count[cols]
+        width = max(int(n.max()), 2)
+        Z = self.z[cols, :width]
+        Q = self.quality[cols, :width]
+        K = self.color[cols, :width]
+        j = np.arange(width)
+        valid = j < n[:, None]
+        top_i = np.maximum(n - 1, 0)
+        top = np.where(n > 0, Z[rows, top_i], -np.inf)
+        erode = (n > 0) & (zs < top)
+        self.eroded += int(erode.sum())
+
+        # Шаг 3a: новая точка ниже накопленных — срезаем всё, что выше неё
+        removed = valid & (Z >= zs[:, None]) & erode[:, None]
+        gone = removed & (Q >= 1)
+        lost_rows, lost_layers = np.nonzero(gone)
+        lost = (pidx[lost_rows], lost_layers, Q[lost_rows, lost_layers])
+        remaining = valid & ~removed
+
+        # Для каждого цвета с нечётным числом срезанных точек — дубликат
+        # последней оставшейся точки этого цвета чуть ниже новой точки
+        dup_first = np.full((len(cols), n_colors), width, dtype=np.int64)
+        dup_z = np.repeat((zs - 0.1)[:, None], n_colors, axis=1)
+        dup_q = np.zeros((len(cols), n_colors))
+        dup_k = np.repeat(np.arange(n_colors, dtype=np.uint8)[None, :], len(cols), axis=0)
+        dup_valid = np.zeros((len(cols), n_colors), dtype=bool)
+        for k in range(n_colors):
+            gone_k = gone & (K == k)
+            left_k = remaining & (K == k)
+            has_left = left_k.any(axis=1)
+            last = width - 1 - np.argmax(left_k[:, ::-1], axis=1)
+            odd = erode & (gone_k.sum(axis=1) % 2 == 1) & has_left
+            dup_first[:, k] = np.where(gone_k.any(axis=1), np.argmax(gone_k, axis=1), width)
+            dup_q[:, k] = Q[rows, last]
+            dup_valid[:, k] = odd
+        # Дубликаты добавляются в порядке первого появления цвета среди срезанных
+        dup_order = np.argsort(dup_first, axis=1, kind='stable')
+        dup_z = np.take_along_axis(dup_z, dup_order, axis=1)
+        dup_q = np.take_along_axis(dup_q, dup_order, axis=1)
+        dup_k = np.take_along_axis(dup_k, dup_order, axis=1)
+        dup_valid = np.take_along_axis(dup_valid, dup_order, axis=1)
+
+        # Шаг 3b: новая точка выше или равна — убираем верхнюю из трёх одного цвета
+        grow = ~erode
+        second_i = np.maximum(n - 2, 0)
+        pop = grow & (n > 2) & (K[rows, top_i] == current) & (K[rows, second_i] == current)
+        n2 = n - pop
+        kept = np.where(erode[:, None], remaining, j < n2[:, None])
+
+        # Переход цвета: точка-пара над предыдущей, если под ней нет такого же цвета
+        prev_i = np.maximum(n2 - 1, 0)
+        prev_z = Z[rows, prev_i]
+        prev_k = K[rows, prev_i]
+        change = grow & (n2 > 0) & (zs > prev_z) & (current != prev_k)
+        below = (j < (n2 - 1)[:, None]) & (K == prev_k[:, None]) & (Z < prev_z[:, None])
+        pair = change & ~below.any(axis=1)
+
+        # Шаг 4: вставка (дубликаты, пара, новая точка) одной устойчивой сортировкой по z
+        all_z = np.concatenate([Z, dup_z, (prev_z + 0.1)[:, None], zs[:, None]], axis=1)
+        all_q = np.concatenate([Q, dup_q, Q[rows, prev_i][:, None],
+                                np.full((len(cols), 1), quality)], axis=1)
+        all_k = np.concatenate([K, dup_k, prev_k[:, None], current[:, None]], axis=1)
+        all_valid = np.concatenate([kept, dup_valid, pair[:, None],
+                                    np.ones((len(cols), 1), dtype=bool)], axis=1)
+        order = np.argsort(np.where(all_valid, all_z, np.inf), axis=1, kind='stable')
+        all_z = np.take_along_axis(all_z, order, axis=1)
+        all_q = np.take_along_axis(all_q, order, axis=1)
+        all_k = np.take_along_axis(all_k, order, axis=1)
+        total = all_valid.sum(axis=1)
+        all_valid = np.arange(all_z.shape[1]) < total[:, None]
+
+        # Шаг 5: сверху вниз из трёх подряд точек одного цвета убираем среднюю
+        down = np.argsort(np.where(all_valid, -all_z, np.inf), axis=1, kind='stable')
+        down_k = np.take_along_axis(all_k, down, axis=1)
+        i = np.arange(all_z.shape[1])
+        inner = np.zeros_like(all_valid)
+        inner[:, 1:-1] = (down_k[:, 1:-1] == down_k[:, :-2]) & (down_k[:, 1:-1] == down_k[:, 2:])
+        inner &= (i + 1 < total[:, None])
+        keep = np.zeros_like(all_valid)
+        np.put_along_axis(keep, down, all_valid & ~inner, axis=1)
+        compact = np.argsort(~keep, axis=1, kind='stable')
+        count = keep.sum(axis=1)
+
+        self._grow(self.size, all_z.shape[1])
+        w = all_z.shape[1]
+        self.z[cols, :w] = np.take_along_axis(all_z, compact, axis=1)
+        self.quality[cols, :w] = np.take_along_axis(all_q, compact, axis=1)
+        self.color[cols, :w] = np.take_along_axis(all_k, compact, axis=1)
+        self.count[cols] = count
+        return lost
+
+    # --- Сжатие слоёв: слияние соседних слоёв и предел глубины колонки ---
+    # tolerance: соседние слои одного цвета, качество которых отличается не
+    # больше чем на tolerance, сливаются (0 — только равное качество; сравнение
+    # попарное, цепочка близких слоёв сливается целиком). max_depth: если слоёв
+    # в колонке больше, нижние сливаются в один. Слитый слой получает самую
+    # высокую z группы, среднее качество по толщинам (толщина — подъём над
+    # нижележащими, как в stock_analytics) и цвет самого толстого слоя. Общий
+    # объём и средняя сортность колонки при этом не меняются; объёмы классов
+    # меняются, только если среднее качество попало в другой класс.
+    # Возвращает число убранных слоёв.
+    def compact(self, tolerance=None, max_depth=None):
+        n = self.size
+        if n == 0 or (tolerance is None and not max_depth):
+            return 0
+        count = self.count[:n]
+        width = int(count.max())
+        if width < 2:
+            return 0
+        Z, Q, K = self.z[:n, :width], self.quality[:n, :width], self.color[:n, :width]
+        filled = np.arange(width) < count[:, None]
+        tops = np.maximum.accumulate(np.where(filled, np.maximum(Z, 0), 0), axis=1)
+        thick = tops - np.concatenate([np.zeros((n, 1)), tops[:, :-1]], axis=1)
+
+        # Новая группа начинается с каждого слоя, который не сливается с нижним
+        start = filled.copy()
+        if tolerance is not None:
+            start[:, 1:] &= ~((K[:, 1:] == K[:, :-1]) & (np.abs(Q[:, 1:] - Q[:, :-1]) <= tolerance))
+        group = np.cumsum(start, axis=1) - 1
+        if max_depth:
+            excess = np.maximum(start.sum(axis=1) - max_depth, 0)
+            group = np.maximum(group - excess[:, None], 0)
+
+        rows, cols = np.nonzero(filled)
+        key = rows * width + group[rows, cols]
+        first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        last = np.r_[first[1:], len(key)] - 1
+        removed = len(key) - len(first)
+        if removed == 0:
+            return 0
+        z, q, k, w = Z[rows, cols], Q[rows, cols], K[rows, cols], thick[rows, cols]
+        new_z = np.maximum.reduceat(z, first)
+        weight = np.add.reduceat(w, first)
+        new_q = np.where(weight > 0, np.add.reduceat(w * q, first) / np.where(weight > 0, weight, 1), q[last])
+        # Неслитый слой сохраняет качество точно (w * q / w может отличаться в последнем знаке):
+        # сжатие колонки не зависит от того, сливалось ли что-то в других колонках
+        new_q = np.where(last == first, q[first], new_q)
+        # Цвет самого толстого слоя группы (при равной толщине — верхнего)
+        thickest = np.lexsort((np.arange(len(key)), w, key))[last]
+        new_k = k[thickest]
+
+        group_rows = rows[first]
+        group_cols = group[group_rows, cols[first]]
+        self.z[:n, :width] = 0
+        self.quality[:n, :width] = 0
+        self.color[:n, :width] = 0
+        self.z[group_rows, group_cols] = new_z
+        self.quality[group_rows, group_cols] = new_q
+        self.color[group_rows, group_cols] = new_k
+        self.count[:n] = np.bincount(group_rows, minlength=n)
+        return removed
+
+    # --- Колонок, слоёв всего и наибольшая глубина колонки (для замеров) ---
+    def layer_stats(self):
+        count = self.count[:self.size]
+        return self.size, int(count.sum()), int(count.max()) if self.size else 0
+
+    # --- Порядок колонок как у словаря accumulated_point_grid ---
+    def output_order(self):
+        if self._order is None:
+            self._order = np.lexsort((np.arange(self.size), self.col_rank[:self.size]))
+        return self._order
+
+    # --- Верхняя точка каждой непустой колонки: массивы x, y, z, quality, код цвета ---
+    def surface(self):
+        order = self.output_order()
+        order = order[self.count[order] > 0]
+        top = self.count[order] - 1
+        return (self.col_x[order], self.col_y[order], self.z[order, top],
+                self.quality[order, top], self.color[order, top])
+
+    def surface_points(self):
+        return surface_points(self.surface(), self.palette)
+
+    def column(self, col):
+        n = int(self.count[col])
+        x = float(self.col_x[col])
+        y = float(self.col_y[col])
+        palette = self.palette
+        return [{'x': x, 'y': y, 'z': z, 'quality': q, 'color': palette[k]}
+                for z, q, k in zip(self.z[col, :n].tolist(), self.quality[col, :n].tolist(),
+                                   self.color[col, :n].tolist())]
+
+    # --- Все слои в порядке колонок: x, y и число слоёв по колонкам + плоские z / quality / код цвета ---
+    def layers(self):
+        order = self.output_order()
+        counts = self.count[order]
+        filled = np.arange(self.z.shape[1]) < counts[:, None]
+        return (self.col_x[order], self.col_y[order], counts,
+                self.z[order][filled], self.quality[order][filled], self.color[order][filled])
+
+    # --- Вложенный словарь x -> y -> слои, как 'array' в JSON ---
+    def to_grid(self):
+        return grid_points(self.layers(), self.palette)
+
+
+# --- Точки JSON по массивам surface() / layers() (можно строить вне стека, по копиям) ---
+def surface_points(surface, palette):
+    xs, ys, zs, qs, ks = (a.tolist() for a in surface)
+    return [{'x': x, 'y': y, 'z': z, 'quality': q, 'color': palette[k]}
+            for x, y, z, q, k in zip(xs, ys, zs, qs, ks)]
+
+
+def grid_points(layers, palette):
+    col_x, col_y, counts, zs, qs, ks = layers
+    owner = np.repeat(np.arange(len(counts)), counts)
+    points = [{'x': x, 'y': y, 'z': z, 'quality': q, 'color': palette[k]}
+              for x, y, z, q, k in zip(col_x[owner].tolist(), col_y[owner].tolist(),
+                                       zs.tolist(), qs.tolist(), ks.tolist())]
+    ends = np.cumsum(counts).tolist()
+    grid = {}
+    start = 0
+    for x, y, end in zip(col_x.tolist(), col_y.tolist(), ends):
+        grid.setdefault(x, {})[y] = points[start:end]
+        start = end
+    return grid
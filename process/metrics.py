@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- Замеры конвейера: таймеры стадий, счётчики, журнал и файл для Prometheus ---
+# Metrics копит время по стадиям и счётчики за весь запуск и отдельно по
+# текущему файлу. По каждому обработанному файлу в журнал (JSON lines)
+# дописывается строка: время стадий, счётчики и показатели стека слоёв.
+# Итоги за запуск переписываются в текстовый файл в формате Prometheus
+# (для textfile collector у node_exporter) — через временный файл и
+# os.replace, чтобы сборщик не прочитал его наполовину.
+# Профилирование включается отдельно (profile=('cprofile', 'tracemalloc')):
+# на каждый файл пишется <имя>.prof для pstats / snakeviz и/или <имя>.mem.txt
+# с пиком и крупнейшими выделениями памяти по строкам кода.
+PREFIX = 'drilling'
+PROFILERS = ('cprofile', 'tracemalloc')
+TOP_ALLOCATIONS = 25  # строк в отчёте tracemalloc
+
+
+class Metrics:
+    def __init__(self, log_path=None, prom_path=None, profile=(), profile_dir='profiles'):
+        self.log_path = log_path
+        self.prom_path = prom_path
+        self.profile = tuple(profile or ())
+        self.profile_dir = profile_dir
+        self.seconds = {}   # стадия -> секунд за запуск
+        self.calls = {}     # стадия -> сколько раз выполнялась
+        self.counters = {}  # растут за запуск: points, bytes_written, ...
+        self.gauges = {}    # последнее значение: columns, layers_max, ...
+        self.record = None  # строка журнала текущего файла
+
+    # --- Время стадии ---
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name, seconds, calls=1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+        if self.record is not None:
+            self.record['stages'][name] = self.record['stages'].get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.record is not None:
+            self.record['counters'][name] = self.record['counters'].get(name, 0) + value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+        if self.record is not None:
+            self.record['gauges'][name] = value
+
+    # --- Показатели стека слоёв: колонки, слои, слоёв на колонку ---
+    def layers(self, stack):
+        columns, layers, deepest = stack.layer_stats()
+        self.gauge('columns', int(columns))
+        self.gauge('layers', layers)
+        self.gauge('layers_per_column_mean', layers / columns if columns else 0.0)
+        self.gauge('layers_per_column_max', deepest)
+
+    # --- Размер записанного файла или папки ---
+    def written(self, path):
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(path) for name in names)
+        else:
+            size = os.path.getsize(path)
+        self.count('bytes_written', size)
+        return size
+
+    # --- Обработка одного файла: строка журнала и профили (tag различает процессы) ---
+    @contextmanager
+    def file(self, path, tag=None, write=True):
+        name = os.path.basename(str(path))
+        record = {'time': datetime.now().isoformat(timespec='seconds'), 'file': name,
+                  'stages': {}, 'counters': {}, 'gauges': {}}
+        self.record = record
+        profiler = cProfile.Profile() if 'cprofile' in self.profile else None
+        tracing = 'tracemalloc' in self.profile and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+            record['seconds'] = time.perf_counter() - started
+            self.record = None
+            stem = os.path.join(self.profile_dir, os.path.splitext(name)[0] + (f".{tag}" if tag else ''))
+            if profiler or tracing:
+                os.makedirs(self.profile_dir, exist_ok=True)
+            if profiler:
+                profiler.dump_stats(f"{stem}.prof")
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+                tracemalloc.stop()
+                record['peak_mb'] = peak / 1e6
+                with open(f"{stem}.mem.txt", 'w') as f:
+                    f.write(f"peak {peak / 1e6:.3f} MB\n")
+                    f.writelines(f"{stat}\n" for stat in top)
+            if write:
+                self.write(record)
+
+    # --- Добавить к итогам строку, посчитанную в другом процессе ---
+    def merge(self, record, other):
+        for name, seconds in other['stages'].items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+            record['stages'][name] = record['stages'].get(name, 0.0) + seconds
+        for name, value in other['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+            record['counters'][name] = record['counters'].get(name, 0) + value
+        for name, value in other['gauges'].items():
+            self.gauges[name] = record['gauges'][name] = value
+        record['seconds'] += other['seconds']
+        if 'peak_mb' in other:
+            record['peak_mb'] = max(record.get('peak_mb', 0.0), other['peak_mb'])
+
+    # --- Строка в журнал и обновлённые итоги для Prometheus ---
+    def write(self, record):
+        self.counters['files'] = self.counters.get('files', 0) + 1
+        if self.log_path:
+            line = dict(record, seconds=round(record['seconds'], 6),
+                        stages={k: round(v, 6) for k, v in record['stages'].items()})
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(line) + '\n')
+        if self.prom_path:
+            tmp = f"{self.prom_path}.tmp"
+            with open(tmp, 'w') as f:
+                f.write(self.exposition())
+            os.replace(tmp, self.prom_path)
+
+    # --- Итоги за запуск в текстовом формате Prometheus ---
+    def exposition(self):
+        lines = [f"# HELP {PREFIX}_stage_seconds_total Время стадии за запуск, с",
+                 f"# TYPE {PREFIX}_stage_seconds_total counter"]
+        lines += [f'{PREFIX}_stage_seconds_total{{stage="{name}"}} {value:.6f}' for name, value in self.seconds.items()]
+        lines += [f"# HELP {PREFIX}_stage_calls_total Сколько раз выполнялась стадия",
+                  f"# TYPE {PREFIX}_stage_calls_total counter"]
+        lines += [f'{PREFIX}_stage_calls_total{{stage="{name}"}} {value}' for name, value in self.calls.items()]
+        for name, value in self.counters.items():
+            lines += [f"# TYPE {PREFIX}_{name}_total counter", f"{PREFIX}_{name}_total {value}"]
+        for name, value in self.gauges.items():
+            lines += [f"# TYPE {PREFIX}_{name} gauge", f"{PREFIX}_{name} {value}"]
+        return '\n'.join(lines) + '\n'
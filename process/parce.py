@@ -3,13 +3,56 @@ import glob
 import re
 import shutil
 import json
+import hashlib
 from datetime import datetime
-import pandas as pd
+import numpy as np
+
+from checkpoint import load_checkpoint, save_checkpoint, settings_digest
+from layer_stack import LayerStack, grid_points, surface_points
+from layer_partitions import PartitionedStack, commit as commit_partitions
+from metrics import Metrics
+from quality_index import read_quality
+from surface_format import EXTENSIONS, write_layers
+from surface_reader import read_surface_file
+from surface_tiles import write_tiles
+from layer_history import append_events, scan_events, trim_history
+from scan_pipeline import BackgroundWriter, Prefetcher, run_tasks
+from surface_manifest import MANIFEST_FILE, add_scan, trim_manifest
+from stock_analytics import append_row, scan_analytics, trim_series
 
 # --- Настройки ---
 INPUT_DIR = 'P:/sdf/logs13052025/surf/dry' # папка с surface-файлами и CSV
 QUALITY_CSV = 'quality.csv'  # имя CSV-файла
+QUALITY_COLUMN = 'KL_320_FINAL'  # столбец качества в CSV
+QUALITY_CACHE = 'quality_cache.npz'  # разобранный CSV качества для быстрого старта (см. quality_index.py), None — без кэша
 OUTPUT_DIR = '../public/surfaces'  # папка для вывода
+QUALITY_WINDOW = None  # окно усреднения качества (например '5min'), None — последнее значение
+CHECKPOINT_PATH = 'checkpoint.npz'  # контрольная точка накопленного состояния
+OUTPUT_FORMATS = ('json',)  # форматы вывода: 'json', 'binary' (.srf, см. surface_format.py), 'delta' (.srfd, см. surface_delta.py),
+                            # 'tiles' (квадродерево тайлов в OUTPUT_DIR/tiles, см. surface_tiles.py)
+BINARY_COMPRESSION = None  # сжатие .srf: None (можно отображать в память), 'gzip' или 'zstd'
+KEYFRAME_INTERVAL = 20  # для 'delta': ключевой кадр раз в столько сканов
+ANALYTICS_FILE = None  # временной ряд объёмов и сортности в OUTPUT_DIR (см. stock_analytics.py), например 'analytics.csv';
+                      # None — не считать. OUTPUT_DIR раздаётся сайтом; каждый скан с рядом ещё и копирует слои стека
+MANIFEST = MANIFEST_FILE  # оглавление сканов в OUTPUT_DIR для /api/surfaces (см. surface_manifest.py), None — не вести
+HISTORY_DIR = None  # журнал событий слоёв в OUTPUT_DIR (см. layer_history.py), например 'history'; None — не вести.
+                   # Журнал только растёт, а OUTPUT_DIR раздаётся сайтом; каждый скан с ним ещё и копирует слои стека
+CELL_AREA = None  # площадь ячейки сетки, единиц координат²; None — по шагу сетки колонок
+VOLUME_UNIT = 1e9  # единиц координат³ в единице объёма аналитики: 1e9 — координаты сканера в мм, объёмы в м³
+                   # (по сохранённым сканам: ёмкость ~3764 x 3120, высота до ~1770 — мм, ~12 м³); для координат в м — 1
+METRICS_LOG = 'metrics.jsonl'  # замеры по каждому файлу, JSON lines (см. metrics.py), None — не писать
+METRICS_PROM = 'metrics.prom'  # итоги запуска в текстовом формате Prometheus, None — не писать
+PROFILE = ()  # профили по каждому файлу в PROFILE_DIR: 'cprofile' и/или 'tracemalloc'
+PROFILE_DIR = 'profiles'
+PREFETCH = 4  # сканов читается наперёд в пуле потоков (см. scan_pipeline.py), 0 — по одному
+READ_THREADS = 2  # потоков чтения
+WRITE_QUEUE = 2  # сканов в очереди фоновой записи, 0 — писать сразу, без фонового потока
+MAX_LAYERS = None  # больше слоёв в колонке — нижние сливаются в один (см. LayerStack.compact), None — без предела
+LAYER_MERGE_TOLERANCE = None  # сливать соседние слои одного цвета с разницей качества не больше этой (0 — только равные),
+                              # None — не сливать; рвёт пары точек цвета, объёмы классов уходят сильнее, чем от MAX_LAYERS
+PARTITION_DIR = None  # для сканов в десятки миллионов точек: стек слоёв по разделам на диске (см. layer_partitions.py),
+                      # вместо CHECKPOINT_PATH; None — весь стек в памяти. Аналитика и журнал слоёв при этом не ведутся
+PARTITION_SIZE = 5000.0  # сторона раздела, единиц координат
 
 # --- Цвет по качеству ---
 def get_color(quality):
@@ -22,6 +65,9 @@ def get_color(quality):
     else:
         return '#FFE066'   # Бедная
 
+# --- Классы качества (цвета get_color) для аналитики ---
+QUALITY_CLASSES = (('rich', '#A259FF'), ('target', '#04bd3b'), ('ordinary', '#2CD9C5'), ('poor', '#FFE066'))
+
 # --- Получение datetime из имени файла ---
 def parse_surface_timestamp(filename):
     match = re.search(r'surface-tank (\d{2})\.(\d{2})\.(\d{4})\s+(\d{2})-(\d{2})-(\d{2})', filename)
@@ -32,220 +78,293 @@ def parse_surface_timestamp(filename):
 
 # --- Загрузка качества ---
 def load_quality(csv_path):
-    df = pd.read_csv(csv_path, parse_dates=['Timestamp'])
-    df.sort_values('Timestamp', inplace=True)
-    return df
+    return read_quality(csv_path, QUALITY_COLUMN, QUALITY_CACHE)
 
 # --- Найти качество по ближайшему прошедшему времени ---
-def get_quality_for_timestamp(surface_time, quality_df):
-    past = quality_df[quality_df['Timestamp'] <= surface_time]
-    if past.empty:
-        return None
-    return past.iloc[-1]['KL_320_FINAL']
-
-# --- Загрузка surface-файла ---
-def load_surface(filepath):
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-    
-    # Получаем объем из первой строки
-    volume = float(lines[0].strip()) if lines else 0
-    print(f"[+] Объем: {volume}")
-    coords = []
-    for line in lines[1:]:  # Пропускаем первую строку с объемом
-        parts = line.strip().split()
-        if len(parts) >= 3:  # Может быть 3 или 4 части (x y z color)
-            try:
-                x, y, z = map(float, parts[:3])
-                # Округляем Z до десятков
-             
-                color = parts[3] if len(parts) > 3 else '#ffffff'
-                coords.append((x, y, z, color))
-            except ValueError:
-                pass
-    return volume, coords
-
-# --- Основной процесс ---
-def process_all():
-    # Очищаем и создаем выходную директорию
-    if os.path.exists(OUTPUT_DIR):
-        shutil.rmtree(OUTPUT_DIR)
-    os.makedirs(OUTPUT_DIR)
-
-    quality_df = load_quality(os.path.join(INPUT_DIR, QUALITY_CSV))
+def get_quality_for_timestamp(surface_time, quality_index):
+    return quality_index.at(surface_time, QUALITY_WINDOW)
+
+# --- Отпечаток настроек накопления для контрольной точки ---
+def state_digest(quality_index, until):
+    # Политика сжатия слоёв учитывается, только если включена: прежние контрольные точки остаются годными
+    policy = (LAYER_MERGE_TOLERANCE, MAX_LAYERS) if LAYER_MERGE_TOLERANCE is not None or MAX_LAYERS else ()
+    return settings_digest(quality_index, until, get_color, QUALITY_WINDOW, *policy)
+
+# --- Контрольная точка: (стек, время последнего скана) или (None, None) ---
+def resume(quality_index):
+    if PARTITION_DIR:
+        stack = PartitionedStack.open(PARTITION_DIR)
+        if stack is None:
+            return None, None
+        state, last_time, digest = stack, stack.last_time, stack.digest
+    else:
+        checkpoint = load_checkpoint(CHECKPOINT_PATH)
+        if checkpoint is None:
+            return None, None
+        state, last_time, digest = checkpoint
+    if digest != state_digest(quality_index, last_time):
+        print("[!] Контрольная точка устарела (изменились качество или пороги), пересчитываем всё")
+        return None, None
+    print(f"[+] Продолжаем с контрольной точки: {last_time}")
+    return (state if PARTITION_DIR else LayerStack.from_state(state)), last_time
 
+# --- Пустой стек слоёв: в памяти или по разделам в PARTITION_DIR ---
+def new_stack():
+    if PARTITION_DIR:
+        return PartitionedStack.create(PARTITION_DIR, PARTITION_SIZE)
+    return LayerStack()
+
+# Аналитика и журнал слоёв сравнивают стек до и после скана целиком — по разделам не ведутся
+def tracks_layers():
+    return not PARTITION_DIR
+
+# --- Начальное состояние: с контрольной точки или с чистого листа ---
+def open_state(quality_index):
+    # Продолжаем с контрольной точки, если она совпадает с текущими качеством и порогами
+    stack, last_time = resume(quality_index)
+    if stack is None:
+        # Очищаем и создаем выходную директорию
+        if os.path.exists(OUTPUT_DIR):
+            shutil.rmtree(OUTPUT_DIR)
+        # Накопленные изменения и PointGrid хранятся в массивах LayerStack
+        stack = new_stack()
+    else:
+        # Убираем то, что записано после контрольной точки
+        if ANALYTICS_FILE and tracks_layers():
+            trim_series(os.path.join(OUTPUT_DIR, ANALYTICS_FILE), last_time)
+        if MANIFEST:
+            trim_manifest(os.path.join(OUTPUT_DIR, MANIFEST), last_time)
+        if HISTORY_DIR and tracks_layers():
+            trim_history(os.path.join(OUTPUT_DIR, HISTORY_DIR), last_time, stack)
+    if not tracks_layers() and (ANALYTICS_FILE or HISTORY_DIR):
+        print("[!] Стек по разделам (PARTITION_DIR): аналитика и журнал слоёв не ведутся")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    return stack, last_time
+
+# --- Surface-файлы по времени (только новее after, если задано) ---
+def list_surface_files(after=None):
     surface_files = glob.glob(os.path.join(INPUT_DIR, 'surface-tank *.txt'))
     surface_files = sorted(surface_files, key=parse_surface_timestamp)
+    if after is not None:
+        surface_files = [f for f in surface_files if parse_surface_timestamp(f) > after]
+    return surface_files
 
-    # Словарь для хранения накопленных изменений
-    # Ключ: (x, y), Значение: (z, color)
-    accumulated_changes = {}
-    # Накопительный PointGrid
-    accumulated_point_grid = {}
-    files_info = []
-    prev_volume = None
-
-    for file in surface_files:
-        surface_time = parse_surface_timestamp(file)
-        quality = get_quality_for_timestamp(surface_time, quality_df)
-        if quality is None:
-            print(f"[!] Нет качества для {file}, пропускаем")
-            continue
-
-        current_volume, current_coords = load_surface(file)
-        colored_points = []
-        surface_points = []
-        disappeared_points_quality = []
-
-        prev_volume = current_volume
-
-        for x, y, z, _ in current_coords:
-            key = (x, y)
-            current_z = z
-            current_color = '#ffffff'
-
-            # Проверяем, есть ли уже накопленное изменение для этой точки
-            if key in accumulated_changes:
-                prev_z, prev_color = accumulated_changes[key]
-                # Если текущая точка выше накопленной
-                if current_z > prev_z:
-                    # Обновляем накопленное изменение
-                    accumulated_changes[key] = (current_z, get_color(quality))
-                    current_color = get_color(quality)
-                else:
-                    # Используем накопленный цвет
-                    current_color = prev_color
-            else:
-                # Первое появление точки
-                accumulated_changes[key] = (current_z, '#ffffff')
-
-            # Добавляем точку с накопленным цветом
-            colored_points.append(f"{x:.2f} {y:.2f} {current_z:.2f} {current_color}")
-
-            # Добавляем точку в накопительный PointGrid
-            if x not in accumulated_point_grid:
-                accumulated_point_grid[x] = {}
-            if y not in accumulated_point_grid[x]:
-                accumulated_point_grid[x][y] = []
-            
-            point = {
-                'x': x,
-                'y': y,
-                'z': current_z,
-                'quality': quality,
-                'color': current_color
-            }
-
-            # Получаем текущий массив точек для координаты
-            points = accumulated_point_grid[x][y]
-
-            if points and current_z < max(p['z'] for p in points):          
-                # Если новая точка ниже накопленных — удаляем все точки выше неё
-                color_counts = {}  # Словарь для подсчета точек по цветам
-                for p in points:
-                    if p['z'] >= current_z and p['quality'] >= 1:
-                        disappeared_points_quality.append(p['quality'])
-                        # Подсчитываем количество точек каждого цвета
-                        color = p['color']
-                        color_counts[color] = color_counts.get(color, 0) + 1
-                
-                # Удаляем точки выше текущей
-                points = [p for p in points if p['z'] < current_z]
-                
-                # Проверяем каждый цвет на нечетное количество
-                for color, count in color_counts.items():
-                    if count % 2 != 0:  # Если количество нечетное
-                        # Находим последнюю точку этого цвета
-                        last_point = next((p for p in reversed(points) if p['color'] == color), None)
-                        if last_point:
-                            # Создаем дубликат точки под новой точкой
-                            duplicate_point = {
-                                'x': last_point['x'],
-                                'y': last_point['y'],
-                                'z': current_z - 0.1,  # Размещаем чуть ниже новой точки
-                                'quality': last_point['quality'],
-                                'color': color
-                            }
-                            points.append(duplicate_point)
-                            # Сортируем точки по z
-                            points.sort(key=lambda p: p['z'])
-            else:
-                # Если новая точка выше или равна — обычная логика с цветом
-                if len(points) > 2 and points[-1]['color'] == current_color and points[-2]['color'] == current_color:
-                    # Удаляем предпоследнюю точку
-                    points.pop(-1)
-                # --- Новая логика для перехода цвета ---
-                if points:
-                    prev_point = points[-1]
-                    # Новая точка выше предыдущей и цвет отличается
-                    if current_z > prev_point['z'] and current_color != prev_point['color']:
-                        # Проверяем, есть ли точка-пара под предыдущей (с тем же цветом и z < prev_point['z'])
-                        has_pair = any(
-                            p['color'] == prev_point['color'] and p['z'] < prev_point['z']
-                            for p in points[:-1]
-                        )
-                        if not has_pair:
-                            # Добавляем точку такого же цвета как предыдущая чуть выше предыдущей
-                            pair_point = {
-                                'x': prev_point['x'],
-                                'y': prev_point['y'],
-                                'z': prev_point['z'] + 0.1,  # немного выше
-                                'quality': prev_point['quality'],
-                                'color': prev_point['color']
-                            }
-                            points.append(pair_point)
-                            points.sort(key=lambda p: p['z'])
-
-            # Добавляем новую точку
-            points.append(point)
-            # Сортируем точки по z
-            points.sort(key=lambda p: p['z'])
-
-            # Оптимизация: удаляем среднюю из трёх подряд точек одного цвета по z сверху вниз
-            points_sorted = sorted(points, key=lambda p: -p['z'])
-            optimized_points = []
-            i = 0
-            while i < len(points_sorted):
-                if i >= 2 and \
-                   points_sorted[i]['color'] == points_sorted[i-1]['color'] == points_sorted[i-2]['color']:
-                    # Удаляем среднюю точку (i-1)
-                    optimized_points.pop()
-                    optimized_points.append(points_sorted[i])
-                else:
-                    optimized_points.append(points_sorted[i])
-                i += 1
-            # Сохраняем обратно (сортировка по z по возрастанию, если нужно)
-            accumulated_point_grid[x][y] = sorted(optimized_points, key=lambda p: p['z'])
-
-        # После обработки всех точек, формируем surface_points
-        for x in accumulated_point_grid:
-            for y in accumulated_point_grid[x]:
-                if accumulated_point_grid[x][y]:  # Если есть точки для этой координаты
-                    # Берем самую верхнюю точку
-                    surface_points.append(accumulated_point_grid[x][y][-1])
+# --- Записи скана: выполняются по очереди в фоновом потоке (или сразу), возвращают (байт, сообщение) ---
+# digest — hashlib для оглавления: sha256 считается по байтам при записи, без повторного чтения файла
+def _write_json(path, surface, layers, palette, avg_disappeared_quality, message, digest=None):
+    text = json.dumps({
+        'surface_points': surface_points(surface, palette),
+        'array': grid_points(layers, palette),
+        'avg_disappeared_quality': avg_disappeared_quality
+    }, indent=2)
+    # Те же байты, что дал бы текстовый режим: переводы строк платформы, json.dumps пишет только ASCII
+    data = text.replace('\n', os.linesep).encode('ascii')
+    with open(path, 'wb') as f:
+        f.write(data)
+    if digest is not None:
+        digest.update(data)
+    return len(data), message
+
+def _write_binary(path, layers, palette, avg_disappeared_quality, digest=None):
+    size = write_layers(path, layers, palette, avg_disappeared_quality, BINARY_COMPRESSION, digest)
+    return size, f"[+] Бинарный файл: {path} ({size / 1e6:.3f} МБ)"
+
+def _write_delta(delta_writer, base_path, layers, palette, avg_disappeared_quality):
+    path, size = delta_writer.write(base_path, layers, palette, avg_disappeared_quality)
+    return size, f"[+] Цепочка: {path} ({size / 1e6:.3f} МБ)"
+
+def _write_tiles(path, surface, palette):
+    count, size = write_tiles(path, *surface, palette)
+    return size, f"[+] Тайлы: {path} ({count} шт., {size / 1e6:.3f} МБ)"
+
+def _append_analytics(path, row):
+    append_row(path, row, QUALITY_CLASSES)
+    return 0, f"[+] Объём {row['volume']:.3f}, выработано {row['reclaimed_volume']:.3f}"
+
+def _append_history(directory, events, col_x, col_y, palette):
+    append_events(directory, events, col_x, col_y, palette)
+    return 0, None
+
+def _add_to_manifest(path, output_path, surface_time, points, quality, avg_disappeared_quality, digest):
+    add_scan(path, output_path, surface_time, points, quality, avg_disappeared_quality, digest.hexdigest())
+    return 0, None
+
+def _save_checkpoint(state, surface_time, digest):
+    save_checkpoint(CHECKPOINT_PATH, state, surface_time, digest)
+    return 0, None
+
+def _commit_partitions(directory, meta):
+    commit_partitions(directory, meta)
+    return 0, None
+
+# --- Запись контрольной точки стека на момент surface_time (копии массивов, можно в фоне) ---
+def checkpoint_task(stack, surface_time, digest):
+    if PARTITION_DIR:
+        # Разделы уже на диске; фиксирует их meta.json
+        return 'write_checkpoint', _commit_partitions, (stack.directory, stack.meta(surface_time, digest))
+    state = {name: np.array(value) for name, value in stack.state().items()}
+    return 'write_checkpoint', _save_checkpoint, (state, surface_time, digest)
+
+# --- Обработка одного скана: накопление, JSON и контрольная точка ---
+# prefetched — (скан, секунд чтения, секунд ожидания) от Prefetcher; writer —
+# BackgroundWriter, без него всё записывается сразу. Записи получают копии
+# массивов стека, контрольная точка сохраняется последней.
+def process_scan(stack, file, surface_time, quality, quality_index, delta_writer=None, metrics=None,
+                 prefetched=None, writer=None):
+    metrics = metrics or Metrics()
+    with metrics.file(file, write=False) as record:
+        if prefetched is None:
+            with metrics.stage('load'):
+                scan = read_surface_file(file)
+        else:
+            scan, read_seconds, wait_seconds = prefetched
+            metrics.add_time('load', read_seconds)
+            metrics.add_time('load_wait', wait_seconds)
+        print(f"[+] Объем: {scan.volume}")
+        current_volume, coords = scan.volume, scan.xyz
+        metrics.count('points', len(coords))
+
+        with metrics.stage('accumulate'):
+            before = stack.snapshot() if (ANALYTICS_FILE or HISTORY_DIR) and tracks_layers() else None
+            # Весь скан применяется к стеку слоёв одним пакетным обновлением
+            disappeared_points_quality = stack.apply_scan(
+                coords[:, 0], coords[:, 1], coords[:, 2], quality, get_color(quality))
+            # Ограничение роста колонок на долгоживущем штабеле
+            merged_layers = stack.compact(LAYER_MERGE_TOLERANCE, MAX_LAYERS)
+            # Верхняя точка каждой колонки и все слои — копии, их можно писать в фоне
+            surface = stack.surface()
+            layers = stack.layers()
+            palette = list(stack.palette)
+        metrics.count('erosion_events', stack.eroded)
+        metrics.count('disappeared_points', len(disappeared_points_quality))
+        metrics.count('merged_layers', merged_layers)
+        metrics.layers(stack)
 
         # Создаем имя выходного файла
         output_filename = os.path.basename(file)
         output_path = os.path.join(OUTPUT_DIR, output_filename)
+        base_path = os.path.join(OUTPUT_DIR, os.path.splitext(output_filename)[0])
 
         # Считаем среднее качество пропавших точек
         avg_disappeared_quality = None
         if disappeared_points_quality:
             avg_disappeared_quality = sum(disappeared_points_quality) / len(disappeared_points_quality)
 
+        tasks = []
+        # Файл для оглавления — JSON скана (или .srf, если JSON не пишется); его sha256 считается при записи
+        listed_digest = hashlib.sha256()
         # Сохраняем JSON с нужной структурой
-        json_output_path = os.path.join(OUTPUT_DIR, f"{os.path.splitext(output_filename)[0]}.json")
-        with open(json_output_path, 'w') as f:
-            json.dump({
-                'surface_points': surface_points,
-                'array': accumulated_point_grid,
-                'avg_disappeared_quality': avg_disappeared_quality
-            }, f, indent=2)
-
-        print(f"[+] Обработан: {file} -> {output_path} и {json_output_path}")
-        print(f"[+] Количество surface_points: {len(surface_points)}")
+        json_output_path = f"{base_path}.json"
+        if 'json' in OUTPUT_FORMATS:
+            tasks.append(('write_json', _write_json, (json_output_path, surface, layers, palette, avg_disappeared_quality,
+                                                      f"[+] Обработан: {file} -> {output_path} и {json_output_path}",
+                                                      listed_digest)))
+
+        # Компактный бинарный вариант того же скана
+        binary_output_path = f"{base_path}{EXTENSIONS[BINARY_COMPRESSION]}"
+        if 'binary' in OUTPUT_FORMATS:
+            tasks.append(('write_binary', _write_binary, (binary_output_path, layers, palette, avg_disappeared_quality,
+                                                          None if 'json' in OUTPUT_FORMATS else listed_digest)))
+
+        # Цепочка ключевых кадров и дельт
+        if delta_writer is not None:
+            tasks.append(('write_delta', _write_delta, (delta_writer, base_path, layers, palette, avg_disappeared_quality)))
+
+        # Тайлы с уровнями детализации: <OUTPUT_DIR>/tiles/<скан>/<уровень>/<tx>_<ty>.json
+        if 'tiles' in OUTPUT_FORMATS:
+            tasks.append(('write_tiles', _write_tiles,
+                          (os.path.join(OUTPUT_DIR, 'tiles', os.path.splitext(output_filename)[0]), surface, palette)))
+
+        # Объёмы по классам качества и выработка с прошлого скана
+        if ANALYTICS_FILE and tracks_layers():
+            with metrics.stage('analytics'):
+                row = scan_analytics(before, stack, QUALITY_CLASSES, get_color, CELL_AREA, VOLUME_UNIT)
+                row.update({'timestamp': surface_time.isoformat(), 'file': os.path.basename(file),
+                            'scan_volume': current_volume})
+            tasks.append(('write_analytics', _append_analytics, (os.path.join(OUTPUT_DIR, ANALYTICS_FILE), row)))
+
+        # События слоёв для запросов "что было в колонке в момент T"
+        if HISTORY_DIR and tracks_layers():
+            with metrics.stage('history'):
+                events = scan_events(before, stack, surface_time)
+            tasks.append(('write_history', _append_history, (os.path.join(OUTPUT_DIR, HISTORY_DIR), events,
+                                                             stack.col_x[:stack.size].copy(),
+                                                             stack.col_y[:stack.size].copy(), palette)))
+
+        # Запись в оглавление — о JSON скана (или о .srf, если JSON не пишется), когда файл уже на диске
+        listed_path = json_output_path if 'json' in OUTPUT_FORMATS else binary_output_path
+        if MANIFEST and ('json' in OUTPUT_FORMATS or 'binary' in OUTPUT_FORMATS):
+            tasks.append(('write_manifest', _add_to_manifest, (os.path.join(OUTPUT_DIR, MANIFEST), listed_path,
+                                                               surface_time, len(surface[0]), float(quality),
+                                                               avg_disappeared_quality, listed_digest)))
+
+        print(f"[+] Количество surface_points: {len(surface[0])}")
         if avg_disappeared_quality is not None:
             print(f"[+] Среднее качество пропавших точек: {avg_disappeared_quality:.2f}")
 
+        with metrics.stage('checkpoint'):
+            tasks.append(checkpoint_task(stack, surface_time, state_digest(quality_index, surface_time)))
+
+    # Сообщения и строка замеров — когда записи скана выполнены
+    def done(result):
+        for message in result['messages']:
+            print(message)
+        metrics.merge(record, result)
+        metrics.write(record)
+
+    if writer is None:
+        done(run_tasks(tasks))
+    else:
+        metrics.add_time('write_wait', writer.submit(tasks, done))
+    return json_output_path
+
+# --- Запись дельт, если она включена в OUTPUT_FORMATS (цепочка начинается с ключевого кадра) ---
+def new_delta_writer():
+    if 'delta' not in OUTPUT_FORMATS:
+        return None
+    from surface_delta import DeltaWriter
+    return DeltaWriter(KEYFRAME_INTERVAL, BINARY_COMPRESSION)
+
+# --- Замеры стадий по настройкам METRICS_* и PROFILE ---
+def new_metrics():
+    return Metrics(METRICS_LOG, METRICS_PROM, PROFILE, PROFILE_DIR)
+
+# --- Основной процесс; progress(номер, всего, файл) — после каждого скана ---
+def process_all(progress=None):
+    metrics = new_metrics()
+    with metrics.stage('quality'):
+        quality_index = load_quality(os.path.join(INPUT_DIR, QUALITY_CSV))
+    stack, last_time = open_state(quality_index)
+
+    surface_files = list_surface_files(after=last_time)
+    # Качество для всех файлов одним бинарным поиском
+    surface_times = [parse_surface_timestamp(f) for f in surface_files]
+    with metrics.stage('quality'):
+        qualities = quality_index.at_many(surface_times, QUALITY_WINDOW)
+
+    delta_writer = new_delta_writer()
+    # Файлы читаются наперёд, а применяются к стеку строго по времени; записи идут в фоне
+    scans = iter(Prefetcher(read_surface_file, [f for f, q in zip(surface_files, qualities) if q is not None],
+                            PREFETCH, READ_THREADS))
+    writer = BackgroundWriter(WRITE_QUEUE)
+    try:
+        for n, (file, surface_time, quality) in enumerate(zip(surface_files, surface_times, qualities), 1):
+            if quality is None:
+                print(f"[!] Нет качества для {file}, пропускаем")
+                metrics.count('skipped_files')
+            else:
+                _, scan, read_seconds, wait_seconds = next(scans)
+                process_scan(stack, file, surface_time, quality, quality_index, delta_writer, metrics,
+                             (scan, read_seconds, wait_seconds), writer)
+            if progress:
+                progress(n, len(surface_files), file)
+        metrics.add_time('write_wait', writer.close())
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        scans.close()
+    return metrics
+
 if __name__ == '__main__':
     process_all()
@@ -1,18 +1,36 @@
 import os
 import glob
 import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
-import pandas as pd
 import numpy as np
-from scipy.interpolate import griddata
-import matplotlib.colors as mcolors
 from pathlib import Path
 
+from checkpoint import load_checkpoint, save_checkpoint, settings_digest
+from metrics import Metrics
+from interpolation import interpolate_points, load_points, save_interpolated_points
+from quality_index import read_quality
+from surface_reader import read_surface_file
+
 # --- Настройки ---
 INPUT_DIR = './inputFiles'  # папка с исходными файлами
 QUALITY_CSV = 'quality_full.csv'  # имя CSV-файла
+QUALITY_CACHE = './quality_cache_interp.npz'  # разобранный CSV качества (см. quality_index.py), None — без кэша
 TEMP_DIR = './temp'  # временная папка для промежуточных результатов
 OUTPUT_DIR = '../public/surfaces'  # папка для финальных результатов
+QUALITY_WINDOW = None  # окно усреднения качества (например '5min'), None — последнее значение
+CHECKPOINT_PATH = './checkpoint_interp.npz'  # контрольная точка (предыдущий скан)
+WORKERS = os.cpu_count() or 1  # процессов для интерполяции (1 — последовательно, без пула)
+MAX_PENDING = 2 * WORKERS  # сканов в очереди на интерполяцию, не больше
+METRICS_LOG = './metrics_interp.jsonl'  # замеры по каждому файлу, JSON lines (см. metrics.py), None — не писать
+METRICS_PROM = './metrics_interp.prom'  # итоги запуска в текстовом формате Prometheus, None — не писать
+PROFILE = ()  # профили по каждому файлу в PROFILE_DIR: 'cprofile' и/или 'tracemalloc'
+PROFILE_DIR = './profiles'
+INTERPOLATION = 'cubic'  # 'cubic', 'linear' или 'idw' (см. interpolation.py)
+IDW_RADIUS = None  # для 'idw': радиус поиска соседей, единиц координат; None — без ограничения
+FILL_HOLES = False  # заполнять ячейки вне охвата скана значением ближайшей точки (сетка без пропусков)
 
 # --- Функции из parce.py ---
 def get_color(quality):
@@ -31,90 +49,57 @@ def parse_surface_timestamp(filename):
     raise ValueError(f"Cannot parse datetime from {filename}")
 
 def load_quality(csv_path):
-    df = pd.read_csv(csv_path, parse_dates=['Timestamp'])
-    df.sort_values('Timestamp', inplace=True)
-    return df
+    return read_quality(csv_path, cache_path=QUALITY_CACHE)
 
-def get_quality_for_timestamp(surface_time, quality_df):
-    past = quality_df[quality_df['Timestamp'] <= surface_time]
-    if past.empty:
-        return None
-    return past.iloc[-1]['KL_320_FINAL']
+def get_quality_for_timestamp(surface_time, quality_index):
+    return quality_index.at(surface_time, QUALITY_WINDOW)
 
 def load_surface(filepath):
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-    coords = []
-    for line in lines:
-        parts = line.strip().split()
-        if len(parts) == 3:
-            try:
-                x, y, z = map(float, parts)
-                coords.append((x, y, z))
-            except ValueError:
-                pass
-    return coords
-
-# --- Функции из interp.py ---
-def hex_from_rgb(rgb):
-    return '#%02x%02x%02x' % tuple((np.clip(rgb, 0, 1) * 255).astype(int))
-
-def load_points(file_path):
-    data = []
-    colors = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) < 4:
-                continue
-            x, y, z = map(float, parts[:3])
-            hex_color = parts[3]
-            data.append([x, y, z])
-            colors.append(mcolors.to_rgb(hex_color))
-    return np.array(data), np.array(colors)
-
-def interpolate_points(data, colors, base_resolution=200, scale=0.5, interpolate_colors=True):
-    res = int(base_resolution * scale)
-    x, y, z = data[:, 0], data[:, 1], data[:, 2]
-
-    grid_x, grid_y = np.meshgrid(
-        np.linspace(x.min(), x.max(), res),
-        np.linspace(y.min(), y.max(), res)
-    )
-
-    grid_z = griddata((x, y), z, (grid_x, grid_y), method='cubic')
-
-    if interpolate_colors:
-        grid_rgb = []
-        for i in range(3):
-            chan = griddata((x, y), colors[:, i], (grid_x, grid_y), method='cubic')
-            mean_val = np.nanmean(colors[:, i])
-            chan[np.isnan(chan)] = mean_val
-            grid_rgb.append(chan)
-        grid_rgb = np.stack(grid_rgb, axis=-1)
-        grid_rgb = np.clip(grid_rgb, 0, 1)
-    else:
-        grid_rgb = []
-        for i in range(3):
-            chan = griddata((x, y), colors[:, i], (grid_x, grid_y), method='nearest')
-            chan[np.isnan(chan)] = 0
-            grid_rgb.append(chan)
-        grid_rgb = np.stack(grid_rgb, axis=-1)
-        grid_rgb = np.clip(grid_rgb, 0, 1)
-
-    return grid_x, grid_y, grid_z, grid_rgb
-
-def save_interpolated_points(file_path, grid_x, grid_y, grid_z, grid_rgb):
-    h, w = grid_z.shape
-    with open(file_path, 'w') as f:
-        for i in range(h):
-            for j in range(w):
-                z = grid_z[i, j]
-                if np.isnan(z):
-                    continue
-                x, y = grid_x[i, j], grid_y[i, j]
-                color_hex = hex_from_rgb(grid_rgb[i, j])
-                f.write(f"{x:.3f} {y:.3f} {z:.3f} {color_hex}\n")
+    scan = read_surface_file(filepath, header=False)
+    return scan.xyz[scan.columns == 3]
+
+# --- Контрольная точка: (предыдущий скан, время последнего скана) или (None, None) ---
+def resume(quality_index):
+    checkpoint = load_checkpoint(CHECKPOINT_PATH)
+    if checkpoint is None:
+        return None, None
+    state, last_time, digest = checkpoint
+    if digest != settings_digest(quality_index, last_time, get_color, QUALITY_WINDOW):
+        print("[!] Контрольная точка устарела (изменились качество или пороги), пересчитываем всё")
+        return None, None
+    print(f"[+] Продолжаем с контрольной точки: {last_time}")
+    return state['previous_coords'], last_time
+
+# --- Интерполяция одного файла (выполняется в процессе пула): сообщение и замеры ---
+def interpolate_file(file, temp_file, output_file, profile=(), profile_dir=PROFILE_DIR,
+                     method=INTERPOLATION, radius=IDW_RADIUS, fill=FILL_HOLES):
+    metrics = Metrics(profile=profile, profile_dir=profile_dir)
+    with metrics.file(file, tag='interp', write=False) as record:
+        try:
+            with metrics.stage('load_points'):
+                data, colors = load_points(temp_file)
+            with metrics.stage('interpolate'):
+                gx, gy, gz, grgb = interpolate_points(data, colors, base_resolution=50, scale=1, interpolate_colors=True,
+                                                    method=method, radius=radius, fill=fill)
+            metrics.count('cells', int(gz.size))
+            with metrics.stage('write_interpolated'):
+                save_interpolated_points(output_file, gx, gy, gz, grgb)
+            metrics.written(output_file)
+            message = f"[+] Финальный файл сохранен: {output_file}"
+        except Exception as e:
+            metrics.count('errors')
+            message = f"[!] Ошибка при интерполяции {file}: {e}"
+    return message, record
+
+# --- Файл интерполирован: сообщение, строка замеров и контрольная точка на его время ---
+def finish(surface_time, coords, job, record, quality_index, metrics):
+    message, worker_record = job.result()
+    print(message)
+    metrics.merge(record, worker_record)
+    with metrics.stage('checkpoint'):
+        save_checkpoint(CHECKPOINT_PATH, {'previous_coords': coords},
+                        surface_time, settings_digest(quality_index, surface_time, get_color, QUALITY_WINDOW))
+    metrics.write(record)
 
 # --- Основной процесс ---
 def process_all():
@@ -122,69 +107,96 @@ def process_all():
     os.makedirs(TEMP_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    # --- Очищаем output перед началом ---
-    for f in os.listdir(OUTPUT_DIR):
-        file_path = os.path.join(OUTPUT_DIR, f)
-        if os.path.isfile(file_path):
-            os.remove(file_path)
-
     # Загружаем данные о качестве
-    quality_df = load_quality(QUALITY_CSV)
+    metrics = Metrics(METRICS_LOG, METRICS_PROM, PROFILE, PROFILE_DIR)
+    with metrics.stage('quality'):
+        quality_index = load_quality(QUALITY_CSV)
+
+    # Продолжаем с контрольной точки или начинаем заново
+    previous_coords, last_time = resume(quality_index)
+    if last_time is None:
+        # --- Очищаем output перед началом ---
+        for f in os.listdir(OUTPUT_DIR):
+            file_path = os.path.join(OUTPUT_DIR, f)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
 
     # Получаем список файлов
     surface_files = glob.glob(os.path.join(INPUT_DIR, 'surface-tank *.txt'))
     surface_files = sorted(surface_files, key=parse_surface_timestamp)
-
-    previous_coords = None
-
-    for file in surface_files:
+    if last_time is not None:
+        surface_files = [f for f in surface_files if parse_surface_timestamp(f) > last_time]
+    # Качество для всех файлов одним бинарным поиском
+    surface_times = [parse_surface_timestamp(f) for f in surface_files]
+    with metrics.stage('quality'):
+        qualities = quality_index.at_many(surface_times, QUALITY_WINDOW)
+
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(WORKERS) if WORKERS > 1 else None
+    pending = deque()  # (время скана, точки скана, задача интерполяции, замеры) в порядке времени
+    for file, surface_time, quality in zip(surface_files, surface_times, qualities):
         print(f"\nОбработка файла: {file}")
         
         # Шаг 1: Парсинг и добавление цветов
-        surface_time = parse_surface_timestamp(file)
-        quality = get_quality_for_timestamp(surface_time, quality_df)
         if quality is None:
             print(f"[!] Нет качества для {file}, пропускаем")
+            metrics.count('skipped_files')
             continue
 
-        current_coords = load_surface(file)
-        colored_points = []
-
-        for i, (x, y, z) in enumerate(current_coords):
-            color = '#ffffff'  # по умолчанию — белый
-            if previous_coords and i < len(previous_coords):
-                if z > previous_coords[i][2]:
-                    color = get_color(quality)
-            colored_points.append(f"{x:.2f} {y:.2f} {z:.2f} {color}")
-
-        # Сохраняем промежуточный результат
-        temp_file = os.path.join(TEMP_DIR, os.path.basename(file))
-        with open(temp_file, 'w') as f:
-            f.write('\n'.join(colored_points))
-        print(f"[+] Промежуточный файл сохранен: {temp_file}")
-
-        # Шаг 2: Интерполяция
-        try:
-            data, colors = load_points(temp_file)
-            if data.shape[0] < 4:
-                print(f"[!] Пропущено (мало точек): {file}")
-                continue
+        with metrics.file(file, write=False) as record:
+            with metrics.stage('load'):
+                current_coords = load_surface(file)
+            metrics.count('points', len(current_coords))
+
+            # Точка окрашивается, если поднялась относительно точки с тем же номером в предыдущем скане
+            with metrics.stage('color'):
+                colors = np.full(len(current_coords), '#ffffff', dtype=object)  # по умолчанию — белый
+                if previous_coords is not None:
+                    n = min(len(current_coords), len(previous_coords))
+                    raised = current_coords[:n, 2] > previous_coords[:n, 2]
+                    colors[:n][raised] = get_color(quality)
+                    metrics.count('raised_points', int(raised.sum()))
+                colored_points = [f"{x:.2f} {y:.2f} {z:.2f} {color}"
+                                  for (x, y, z), color in zip(current_coords.tolist(), colors.tolist())]
+
+            # Сохраняем промежуточный результат
+            temp_file = os.path.join(TEMP_DIR, os.path.basename(file))
+            with metrics.stage('write_temp'):
+                with open(temp_file, 'w') as f:
+                    f.write('\n'.join(colored_points))
+            print(f"[+] Промежуточный файл сохранен: {temp_file}")
+
+        # Слишком маленький скан не интерполируется и не становится предыдущим
+        if len(current_coords) < 4:
+            print(f"[!] Пропущено (мало точек): {file}")
+            metrics.write(record)
+            continue
 
-            gx, gy, gz, grgb = interpolate_points(data, colors, base_resolution=50, scale=1, interpolate_colors=True)
-            output_file = os.path.join(OUTPUT_DIR, os.path.basename(file))
-            save_interpolated_points(output_file, gx, gy, gz, grgb)
-            print(f"[+] Финальный файл сохранен: {output_file}")
+        # Шаг 2: Интерполяция — от накопленного состояния не зависит, поэтому идёт в пуле
+        output_file = os.path.join(OUTPUT_DIR, os.path.basename(file))
+        args = (file, temp_file, output_file, PROFILE, PROFILE_DIR, INTERPOLATION, IDW_RADIUS, FILL_HOLES)
+        if pool:
+            job = pool.submit(interpolate_file, *args)
+        else:
+            job = Future()
+            job.set_result(interpolate_file(*args))
+        pending.append((surface_time, current_coords, job, record))
+        previous_coords = current_coords
 
-        except Exception as e:
-            print(f"[!] Ошибка при интерполяции {file}: {e}")
+        # Контрольная точка сдвигается только по готовым подряд файлам
+        while pending and (pending[0][2].done() or len(pending) > MAX_PENDING):
+            finish(*pending.popleft(), quality_index, metrics)
 
-        previous_coords = current_coords
+    while pending:
+        finish(*pending.popleft(), quality_index, metrics)
+    if pool:
+        pool.shutdown()
 
     # Очистка временных файлов
     for temp_file in glob.glob(os.path.join(TEMP_DIR, '*.txt')):
         os.remove(temp_file)
     os.rmdir(TEMP_DIR)
-    print("\n[+] Обработка завершена!")
+    print(f"\n[+] Обработка завершена за {time.perf_counter() - started:.2f} с, процессов: {WORKERS}")
 
 if __name__ == '__main__':
     process_all() 
\ No newline at end of file
@@ -0,0 +1,125 @@
+import os
+import hashlib
+import zipfile
+
+import numpy as np
+
+QUALITY_COLUMN = 'KL_320_FINAL'
+CACHE_VERSION = 1
+
+
+# --- Индекс качества по времени ---
+# Отсортированный массив меток времени и значений KL_320_FINAL (или другого
+# столбца column). Поиск «последнего значения не позже t» — бинарный поиск
+# вместо маски по всему DataFrame; средние по окну считаются через
+# префиксные суммы.
+class QualityIndex:
+    def __init__(self, df, column=QUALITY_COLUMN):
+        self._build(df['Timestamp'].to_numpy(dtype='datetime64[ns]'), df[column].to_numpy(dtype=float))
+
+    @classmethod
+    def from_arrays(cls, times, values):
+        index = cls.__new__(cls)
+        index._build(np.asarray(times, dtype='datetime64[ns]'), np.asarray(values, dtype=float))
+        return index
+
+    def _build(self, times, values):
+        self.times = times
+        self.values = values
+        present = ~np.isnan(self.values)
+        self._sums = np.concatenate([[0.0], np.cumsum(np.where(present, self.values, 0.0))])
+        self._counts = np.concatenate([[0], np.cumsum(present)])
+        self._digest_state = (0, hashlib.sha256(), hashlib.sha256())  # (строк учтено, хэш меток, хэш значений)
+
+    def __len__(self):
+        return len(self.times)
+
+    # Позиция после последней записи с Timestamp <= t
+    def _right(self, times):
+        return np.searchsorted(self.times, np.asarray(times, dtype='datetime64[ns]'), side='right')
+
+    # --- Качество на момент t (None, если раньше t данных нет) ---
+    def at(self, t, window=None):
+        return self.at_many([t], window)[0]
+
+    # --- Качество сразу для пачки моментов (как merge_asof) ---
+    # Если задано окно (например '5min'), возвращается среднее KL_320_FINAL
+    # за (t - window, t]; пустое окно — последнее значение до t.
+    def at_many(self, times, window=None):
+        if len(times) == 0:
+            return []
+        hi = self._right(times)
+        last = self.values[np.maximum(hi - 1, 0)]
+        if window is not None:
+            import pandas as pd
+            lo = self._right(np.asarray(times, dtype='datetime64[ns]') - pd.Timedelta(window).to_timedelta64())
+            count = self._counts[hi] - self._counts[lo]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = (self._sums[hi] - self._sums[lo]) / count
+            last = np.where(count > 0, mean, last)
+        return [value if i > 0 else None for i, value in zip(hi.tolist(), last)]
+
+    # --- Дописан ли CSV до момента t (есть запись не раньше t) ---
+    def covers(self, t):
+        return len(self.times) > 0 and self.times[-1] >= np.datetime64(t, 'ns')
+
+    # --- Самая ранняя метка, с которой записи self и other различаются; None — совпадают ---
+    def first_change(self, other):
+        n = min(len(self.times), len(other.times))
+        a, b = self.values[:n], other.values[:n]
+        differ = (self.times[:n] != other.times[:n]) | ((a != b) & ~(np.isnan(a) & np.isnan(b)))
+        if differ.any():
+            i = int(np.argmax(differ))
+            return min(self.times[i], other.times[i])
+        if len(self.times) != len(other.times):
+            return (self if len(self.times) > n else other).times[n]
+        return None
+
+    # --- Отпечаток записей с Timestamp <= until (для проверки контрольных точек) ---
+    # Дописанные позже минуты отпечаток не меняют. Хэши меток и значений
+    # ведутся нарастающим итогом: каждый вызов дохэширует только строки,
+    # добавившиеся с прошлого; until раньше учтённого — хэш заново с начала.
+    def digest(self, until):
+        hi = int(self._right([until])[0])
+        done, times_hash, values_hash = self._digest_state
+        if hi < done:
+            done, times_hash, values_hash = 0, hashlib.sha256(), hashlib.sha256()
+        times_hash.update(self.times[done:hi].tobytes())
+        values_hash.update(self.values[done:hi].tobytes())
+        self._digest_state = (hi, times_hash, values_hash)
+        return hashlib.sha256(times_hash.digest() + values_hash.digest()).hexdigest()
+
+    # --- Взять нарастающий отпечаток у прежнего индекса того же CSV ---
+    # changed_from — other.first_change(self): учтённые other строки годятся,
+    # если все они раньше первой различающейся записи.
+    def adopt_digest(self, other, changed_from):
+        done = other._digest_state[0]
+        if done <= len(self.times) and (changed_from is None or done == 0 or other.times[done - 1] < changed_from):
+            done, times_hash, values_hash = other._digest_state
+            self._digest_state = (done, times_hash.copy(), values_hash.copy())
+
+# --- Индекс из CSV качества (по Timestamp); с cache_path — через кэш .npz ---
+# Кэш годен, пока у CSV тот же путь, размер и время изменения и тот же
+# столбец; тогда pandas не импортируется вовсе — это основная часть
+# холодного старта запуска на один скан. Кэш пишется атомарно.
+def read_quality(csv_path, column=QUALITY_COLUMN, cache_path=None):
+    st = os.stat(csv_path)
+    key = np.str_(f"{CACHE_VERSION}|{os.path.abspath(csv_path)}|{st.st_size}|{st.st_mtime_ns}|{column}")
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                if str(data['key']) == key:
+                    return QualityIndex.from_arrays(data['times'], data['values'])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"[!] Кэш качества {cache_path} не читается: {e}")
+
+    import pandas as pd
+    df = pd.read_csv(csv_path, parse_dates=['Timestamp'])
+    df.sort_values('Timestamp', inplace=True)
+    index = QualityIndex(df, column)
+    if cache_path:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=key, times=index.times, values=index.values)
+        os.replace(tmp_path, cache_path)
+    return index
@@ -0,0 +1,122 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Конвейер сканов: чтение наперёд и запись в фоне ---
+# Prefetcher читает и разбирает следующие файлы в пуле потоков, но отдаёт их
+# строго в порядке списка (по времени скана), поэтому стек слоёв применяет
+# сканы в том же порядке, что и без конвейера. BackgroundWriter выполняет
+# записи скана одним потоком по очереди, в порядке сканов; очередь
+# ограничена depth сканами, дальше основной поток ждёт. Задачи записи
+# получают копии массивов, а не сам стек — следующий скан их не испортит.
+# Контрольная точка — последняя задача скана; после первой ошибки записи
+# следующие задачи не выполняются, чтобы контрольная точка не ушла дальше
+# недописанного скана.
+
+
+# --- Задачи одного скана: [(стадия, функция, аргументы)], функция возвращает (байт, сообщение) ---
+def run_tasks(tasks):
+    result = {'stages': {}, 'counters': {}, 'gauges': {}, 'seconds': 0.0, 'messages': []}
+    for stage, fn, args in tasks:
+        started = time.perf_counter()
+        size, message = fn(*args)
+        seconds = time.perf_counter() - started
+        result['stages'][stage] = result['stages'].get(stage, 0.0) + seconds
+        result['seconds'] += seconds
+        if size:
+            result['counters']['bytes_written'] = result['counters'].get('bytes_written', 0) + size
+        if message:
+            result['messages'].append(message)
+    return result
+
+
+class Prefetcher:
+    def __init__(self, read, paths, depth=4, threads=2):
+        self.read = read
+        self.paths = list(paths)
+        self.depth = depth
+        self.threads = threads
+
+    def _read(self, path):
+        started = time.perf_counter()
+        return self.read(path), time.perf_counter() - started
+
+    # (путь, результат read, секунд чтения, секунд ожидания) в порядке paths
+    def __iter__(self):
+        if self.depth <= 0:
+            for path in self.paths:
+                data, seconds = self._read(path)
+                yield path, data, seconds, seconds
+            return
+        pool = ThreadPoolExecutor(self.threads)
+        ahead = deque()
+        paths = iter(self.paths)
+        try:
+            for path in paths:
+                ahead.append((path, pool.submit(self._read, path)))
+                if len(ahead) >= self.depth:
+                    break
+            while ahead:
+                path, job = ahead.popleft()
+                started = time.perf_counter()
+                data, seconds = job.result()
+                waited = time.perf_counter() - started
+                for next_path in paths:
+                    ahead.append((next_path, pool.submit(self._read, next_path)))
+                    break
+                yield path, data, seconds, waited
+        finally:
+            for _, job in ahead:
+                job.cancel()
+            pool.shutdown()
+
+
+class BackgroundWriter:
+    def __init__(self, depth=2):
+        self.depth = depth
+        self.pool = ThreadPoolExecutor(1) if depth > 0 else None
+        self.pending = deque()  # (задача, done) в порядке сканов
+        self.failed = False
+
+    def _run(self, tasks):
+        if self.failed:
+            raise RuntimeError("Запись пропущена: не удалась запись предыдущего скана")
+        try:
+            return run_tasks(tasks)
+        except BaseException:
+            self.failed = True
+            raise
+
+    # done(результат run_tasks) вызывается в основном потоке, в порядке сканов;
+    # возвращает секунды, которые основной поток ждал очередь
+    def submit(self, tasks, done):
+        if self.pool is None:
+            done(run_tasks(tasks))
+            return 0.0
+        self.pending.append((self.pool.submit(self._run, tasks), done))
+        return self.collect()
+
+    # Готовые задачи по порядку; если очередь длиннее depth — ждём самую старую
+    def collect(self, wait=False):
+        waited = 0.0
+        while self.pending and (wait or len(self.pending) > self.depth or self.pending[0][0].done()):
+            job, done = self.pending.popleft()
+            started = time.perf_counter()
+            result = job.result()
+            waited += time.perf_counter() - started
+            done(result)
+        return waited
+
+    # Дождаться всех записей; возвращает секунды ожидания
+    def close(self):
+        waited = self.collect(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown()
+        return waited
+
+    # После ошибки: недописанные сканы не записываются, текущая запись дожидается
+    def abort(self):
+        self.failed = True
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        self.pending.clear()
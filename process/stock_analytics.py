@@ -0,0 +1,99 @@
+import os
+import csv
+
+import numpy as np
+
+# --- Объёмы и сортность по стеку слоёв ---
+# Колонка (x, y) — столбик площадью в одну ячейку сетки, слои лежат друг на
+# друге от z = 0: толщина слоя — его подъём над самым высоким из слоёв ниже.
+# Слой относится к классу get_color(quality), объём класса — сумма толщин его
+# слоёв, умноженная на площадь ячейки. Между двумя сканами выработано то, что
+# лежало между новой и прежней верхней точкой колонки там, где поверхность
+# опустилась; сортность выработки — среднее качество этих слоёв по толщине.
+# Объёмы делятся на unit — единиц координат³ в единице объёма ряда
+# (parce.VOLUME_UNIT); по умолчанию координаты считаются в мм, объёмы — в м³.
+VOLUME_UNIT = 1e9
+
+
+# --- Нижняя и верхняя граница каждого слоя (пустые ячейки — нулевой толщины) ---
+def _levels(count, z):
+    filled = np.arange(z.shape[1]) < count[:, None]
+    tops = np.maximum.accumulate(np.where(filled, np.maximum(z, 0), 0), axis=1)
+    bottoms = np.concatenate([np.zeros((len(z), 1)), tops[:, :-1]], axis=1)
+    return bottoms, tops
+
+
+# --- Номер класса для каждого слоя; get_color вызывается один раз на значение качества ---
+def _classes(quality, classes, get_color):
+    index = {color: i for i, (_, color) in enumerate(classes)}
+    values, inverse = np.unique(quality, return_inverse=True)
+    codes = np.array([index[get_color(q)] for q in values.tolist()], dtype=np.int64)
+    return codes[inverse].reshape(quality.shape)
+
+
+# --- Площадь ячейки по шагу сетки колонок ---
+def cell_area(col_x, col_y):
+    steps = []
+    for values in (col_x, col_y):
+        diffs = np.diff(np.unique(values))
+        steps.append(diffs.min() if len(diffs) else 1.0)
+    return float(steps[0] * steps[1])
+
+
+# --- Объёмы по классам, общий объём и средняя сортность по толщинам слоёв ---
+def _totals(thickness, quality, codes, classes, area, unit):
+    volumes = np.bincount(codes.ravel(), weights=thickness.ravel(), minlength=len(classes)) * area / unit
+    total = thickness.sum()
+    grade = float((thickness * quality).sum() / total) if total > 0 else None
+    return volumes.tolist(), float(total * area / unit), grade
+
+
+# --- Строка временного ряда для скана: before — stack.snapshot() до скана, stack — после ---
+def scan_analytics(before, stack, classes, get_color, area=None, unit=VOLUME_UNIT):
+    after = stack.state()
+    if area is None:
+        area = cell_area(after['col_x'], after['col_y'])
+    bottoms, tops = _levels(after['count'], after['z'])
+    volumes, volume, grade = _totals(tops - bottoms, after['quality'],
+                                     _classes(after['quality'], classes, get_color), classes, area, unit)
+
+    # Выработка: часть прежних слоёв между новой и прежней вершиной колонки
+    n = len(before['count'])
+    old_bottoms, old_tops = _levels(before['count'], before['z'])
+    new_top = tops[:n, -1]
+    cut = np.clip(old_tops - np.maximum(old_bottoms, new_top[:, None]), 0, None)
+    reclaimed, reclaimed_volume, reclaimed_grade = _totals(
+        cut, before['quality'], _classes(before['quality'], classes, get_color), classes, area, unit)
+
+    row = {'volume': volume, 'grade': grade}
+    row.update({f"volume_{name}": v for (name, _), v in zip(classes, volumes)})
+    row.update({'reclaimed_volume': reclaimed_volume, 'reclaimed_grade': reclaimed_grade})
+    row.update({f"reclaimed_{name}": v for (name, _), v in zip(classes, reclaimed)})
+    return row
+
+
+def fields(classes):
+    return (['timestamp', 'file', 'scan_volume', 'volume', 'grade'] + [f"volume_{name}" for name, _ in classes] +
+            ['reclaimed_volume', 'reclaimed_grade'] + [f"reclaimed_{name}" for name, _ in classes])
+
+
+# --- Дописать строку в CSV временного ряда (заголовок — при создании) ---
+def append_row(path, row, classes):
+    new = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields(classes))
+        if new:
+            writer.writeheader()
+        writer.writerow({k: '' if v is None else v for k, v in row.items()})
+
+
+# --- Убрать строки новее контрольной точки (скан был записан, но не сохранён) ---
+def trim_series(path, last_time):
+    if not os.path.exists(path):
+        return
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    keep = rows[:1] + [r for r in rows[1:] if r[0] <= last_time.isoformat()]
+    if len(keep) != len(rows):
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(keep)
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import tempfile
+
+import numpy as np
+
+from parce import parse_surface_timestamp
+from surface_format import (EXTENSIONS, compress, encode, json_layers, pack, read_buffer,
+                            read_surface, surface, unpack)
+
+# --- Дельты между соседними сканами (.srfd) ---
+# Ключевой кадр — обычный .srf. Дельта хранит только колонки, стек слоёв
+# которых изменился с предыдущего скана: сколько нижних слоёв оставить (keep)
+# и новые слои сверху. Колонки только добавляются и не исчезают, их порядок
+# устойчив, поэтому новые колонки задаются позицией в новом порядке.
+#   palette           n_palette x 8 байт (вся палитра цепочки, только растёт)
+#   new_position      n_new uint32 — позиции новых колонок в порядке этого скана
+#   new_xy            n_new x 2 float32
+#   changed_position  n_changed uint32 — позиции изменённых колонок (по возрастанию)
+#   keep              n_changed uint32 — сколько нижних слоёв колонки сохранить
+#   offsets           (n_changed + 1) uint32 — новые слои изменённой колонки i
+#   layer_z / layer_quality float32, layer_color uint8 — новые слои
+DELTA_MAGIC = b'SRFD'
+DELTA_EXTENSIONS = {None: '.srfd', 'gzip': '.srfd.gz', 'zstd': '.srfd.zst'}
+KEYFRAME_INTERVAL = 20  # ключевой кадр раз в столько сканов
+
+
+def _delta_layout(n_palette, n_new, n_changed, n_layers):
+    return [
+        ('palette', 'S8', (n_palette,)),
+        ('new_position', '<u4', (n_new,)),
+        ('new_xy', '<f4', (n_new, 2)),
+        ('changed_position', '<u4', (n_changed,)),
+        ('keep', '<u4', (n_changed,)),
+        ('offsets', '<u4', (n_changed + 1,)),
+        ('layer_z', '<f4', (n_layers,)),
+        ('layer_quality', '<f4', (n_layers,)),
+        ('layer_color', 'u1', (n_layers,)),
+    ]
+
+
+def decode_delta(buf):
+    return unpack(buf, DELTA_MAGIC, _delta_layout)
+
+
+# Для длин [2, 3] -> [0, 1, 0, 1, 2]
+def _ranges(lengths):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    return np.arange(int(lengths.sum())) - np.repeat(starts, lengths)
+
+
+def _padded(counts, flat, width):
+    out = np.zeros((len(counts), width), dtype=flat.dtype)
+    out[np.arange(width) < counts[:, None]] = flat
+    return out
+
+
+# --- Запись цепочки: ключевой кадр раз в KEYFRAME_INTERVAL сканов, между ними дельты ---
+class DeltaWriter:
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, compression=None):
+        self.keyframe_interval = keyframe_interval
+        self.compression = compression
+        self.palette = []
+        self.palette_index = {}
+        self.prev = None
+        self.since_keyframe = 0
+
+    # layers — (col_x, col_y, counts, z, quality, color) в порядке колонок, как LayerStack.layers()
+    def write(self, base_path, layers, palette, avg_disappeared_quality):
+        col_x, col_y, counts, zs, qs, ks = layers
+        # Коды цветов переводятся в палитру цепочки, чтобы они не менялись между сканами
+        remap = np.array([self.palette_index.setdefault(c, len(self.palette_index)) for c in palette] or [0],
+                         dtype=np.uint8)
+        self.palette = list(self.palette_index)
+        current = {
+            'xy': np.stack([col_x, col_y], axis=1).astype(np.float32),
+            'counts': np.asarray(counts, dtype=np.int64),
+            'z': np.asarray(zs, dtype=np.float32),
+            'quality': np.asarray(qs, dtype=np.float32),
+            'color': remap[np.asarray(ks, dtype=np.int64)] if len(ks) else np.asarray(ks, dtype=np.uint8),
+        }
+        raw = None
+        if self.prev is not None and self.since_keyframe + 1 < self.keyframe_interval:
+            raw = self._delta(current, avg_disappeared_quality)
+        if raw is None:
+            raw = encode(current['xy'][:, 0], current['xy'][:, 1], current['counts'], current['z'],
+                         current['quality'], current['color'], self.palette, avg_disappeared_quality)
+            path = base_path + EXTENSIONS[self.compression]
+            self.since_keyframe = 0
+        else:
+            path = base_path + DELTA_EXTENSIONS[self.compression]
+            self.since_keyframe += 1
+        data = compress(raw, self.compression)
+        with open(path, 'wb') as f:
+            f.write(data)
+        current['index'] = {key: i for i, key in enumerate(map(tuple, current['xy'].tolist()))}
+        self.prev = current
+        return path, len(data)
+
+    # Дельта к предыдущему скану или None, если её не выразить (колонки пропали или переставлены)
+    def _delta(self, current, avg):
+        prev = self.prev
+        keys = map(tuple, current['xy'].tolist())
+        prev_pos = np.fromiter((prev['index'].get(k, -1) for k in keys), dtype=np.int64,
+                               count=len(current['xy']))
+        is_new = prev_pos < 0
+        old = np.flatnonzero(~is_new)
+        if len(old) != len(prev['counts']) or np.any(np.diff(prev_pos[old]) <= 0):
+            return None
+
+        # Сколько нижних слоёв каждой старой колонки совпадает с предыдущим сканом
+        counts = current['counts']
+        new_counts = counts[old]
+        prev_counts = prev['counts']
+        width = int(max(new_counts.max(initial=0), prev_counts.max(initial=0))) + 1
+        same = np.ones((len(old), width), dtype=bool)
+        for name in ('z', 'quality', 'color'):
+            now = _padded(counts, current[name], width)[old]
+            before = _padded(prev_counts, prev[name], width)
+            same &= now == before
+        same &= np.arange(width) < np.minimum(new_counts, prev_counts)[:, None]
+        keep = np.full(len(counts), 0, dtype=np.int64)
+        keep[old] = np.argmin(same, axis=1)
+        changed = is_new & (counts > 0)
+        changed[old] = (keep[old] < new_counts) | (keep[old] < prev_counts)
+        changed_position = np.flatnonzero(changed)
+
+        # Новые слои изменённых колонок: всё выше keep
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        added = counts[changed_position] - keep[changed_position]
+        take = np.repeat(offsets[changed_position] + keep[changed_position], added) + _ranges(added)
+        new_position = np.flatnonzero(is_new)
+        arrays = {
+            'palette': np.array([c.encode('ascii') for c in self.palette], dtype='S8'),
+            'new_position': new_position,
+            'new_xy': current['xy'][new_position],
+            'changed_position': changed_position,
+            'keep': keep[changed_position],
+            'offsets': np.concatenate([[0], np.cumsum(added)]),
+            'layer_z': current['z'][take],
+            'layer_quality': current['quality'][take],
+            'layer_color': current['color'][take],
+        }
+        counts_header = (len(self.palette), len(new_position), len(changed_position), len(take))
+        return pack(DELTA_MAGIC, _delta_layout, counts_header, avg, arrays)
+
+
+# --- Применение дельты к полному состоянию (словарь как у read_surface) ---
+def apply_delta(state, delta):
+    xy = np.asarray(state['column_xy'])
+    offsets = np.asarray(state['offsets'], dtype=np.int64)
+    starts, counts = offsets[:-1], np.diff(offsets)
+    new_position = delta['new_position'].astype(np.int64)
+    if len(new_position):
+        at = new_position - np.arange(len(new_position))
+        xy = np.insert(xy, at, delta['new_xy'], axis=0)
+        starts = np.insert(starts, at, 0)
+        counts = np.insert(counts, at, 0)
+
+    changed = delta['changed_position'].astype(np.int64)
+    keep = counts.copy()
+    keep[changed] = delta['keep']
+    added = np.zeros_like(counts)
+    added[changed] = np.diff(delta['offsets'].astype(np.int64))
+    new_offsets = np.concatenate([[0], np.cumsum(keep + added)])
+
+    source = np.repeat(starts, keep) + _ranges(keep)
+    kept_to = np.repeat(new_offsets[:-1], keep) + _ranges(keep)
+    added_to = np.repeat(new_offsets[:-1][changed] + keep[changed], added[changed]) + _ranges(added[changed])
+    result = {'palette': delta['palette'], 'avg_disappeared_quality': delta['avg_disappeared_quality'],
+              'column_xy': xy, 'offsets': new_offsets.astype('<u4')}
+    for name in ('layer_z', 'layer_quality', 'layer_color'):
+        values = np.empty(int(new_offsets[-1]), dtype=delta[name].dtype)
+        values[kept_to] = np.asarray(state[name])[source]
+        values[added_to] = delta[name]
+        result[name] = values
+    result['surface_xyz'], result['surface_color'] = surface(
+        xy, result['offsets'], result['layer_z'], result['layer_color'])
+    return result
+
+
+# --- Имя скана без расширения цепочки и признак ключевого кадра ---
+def _chain_entry(filename):
+    for extensions, keyframe in ((EXTENSIONS, True), (DELTA_EXTENSIONS, False)):
+        for ext in extensions.values():
+            if filename.endswith(ext):
+                return filename[:-len(ext)], keyframe
+    return None, None
+
+
+# --- Полное состояние скана: ближайший ключевой кадр + дельты после него ---
+def reconstruct(path):
+    directory = os.path.dirname(path) or '.'
+    target, _ = _chain_entry(os.path.basename(path))
+    if target is None:
+        raise ValueError(f"Не файл цепочки: {path}")
+    files = {}
+    for filename in os.listdir(directory):
+        name, keyframe = _chain_entry(filename)
+        if name is not None and (keyframe or name not in files):
+            files[name] = (filename, keyframe)
+    names = sorted((n for n in files if parse_surface_timestamp(n) <= parse_surface_timestamp(target)),
+                   key=parse_surface_timestamp)
+    start = max((i for i, n in enumerate(names) if files[n][1]), default=None)
+    if start is None:
+        raise ValueError(f"Нет ключевого кадра до {target}")
+    state = read_surface(os.path.join(directory, files[names[start]][0]))
+    for name in names[start + 1:]:
+        state = apply_delta(state, decode_delta(read_buffer(os.path.join(directory, files[name][0]))))
+    return state
+
+
+# --- Сравнение объёма: JSON, полный .srf на каждый скан и цепочка кадр + дельты ---
+def benchmark(json_dir, keyframe_interval=KEYFRAME_INTERVAL, compression=None):
+    names = sorted((f for f in os.listdir(json_dir) if f.endswith('.json')), key=parse_surface_timestamp)
+    writer = DeltaWriter(keyframe_interval, compression)
+    json_size = full_size = chain_size = 0
+    expected = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for filename in names:
+            with open(os.path.join(json_dir, filename)) as f:
+                content = json.load(f)
+            layers, palette = json_layers(content)
+            json_size += os.path.getsize(os.path.join(json_dir, filename))
+            full_size += len(compress(encode(*layers, palette, content['avg_disappeared_quality']), compression))
+            path, size = writer.write(os.path.join(out_dir, os.path.splitext(filename)[0]), layers, palette,
+                                      content['avg_disappeared_quality'])
+            chain_size += size
+            expected[path] = (layers, palette)
+
+        # Проверка: каждый скан восстанавливается из цепочки до float32
+        started = time.perf_counter()
+        for path, ((col_x, col_y, counts, zs, qs, ks), colors) in expected.items():
+            state = reconstruct(path)
+            palette = state['palette']
+            assert np.array_equal(state['column_xy'], np.stack([col_x, col_y], axis=1).astype(np.float32))
+            assert np.array_equal(np.diff(state['offsets']), counts)
+            assert np.array_equal(state['layer_z'], zs.astype(np.float32))
+            assert np.array_equal(state['layer_quality'], qs.astype(np.float32))
+            assert [palette[k] for k in state['layer_color'].tolist()] == [colors[k] for k in ks.tolist()]
+        reconstruct_time = (time.perf_counter() - started) / max(len(expected), 1)
+
+    print(f"[+] Сканов: {len(names)}, ключевой кадр каждые {keyframe_interval}, сжатие: {compression}")
+    print(f"[+] JSON:            {json_size / 1e6:8.2f} МБ")
+    print(f"[+] .srf на каждый:  {full_size / 1e6:8.2f} МБ (x{json_size / full_size:.0f} к JSON)")
+    print(f"[+] кадры + дельты:  {chain_size / 1e6:8.2f} МБ (x{json_size / chain_size:.0f} к JSON, "
+          f"x{full_size / chain_size:.1f} к .srf)")
+    print(f"[+] Восстановление скана: {reconstruct_time * 1e3:.1f} мс в среднем")
+
+
+if __name__ == '__main__':
+    # python surface_delta.py ../public/surfaces [интервал ключевых кадров] [gzip|zstd]
+    benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else KEYFRAME_INTERVAL,
+              sys.argv[3] if len(sys.argv) > 3 else None)
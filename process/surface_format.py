@@ -0,0 +1,236 @@
+import os
+import sys
+import gzip
+import json
+import mmap
+import struct
+import time
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него доступны только raw и gzip
+    zstandard = None
+
+# --- Бинарный формат скана (.srf) ---
+# Заголовок фиксированного размера, затем секции с выравниванием по 8 байт,
+# все числа little-endian, поэтому файл без сжатия можно отобразить в память
+# и получить массивы через np.frombuffer без копирования:
+#   palette        n_palette x 8 байт, ASCII '#rrggbb' с нулём в конце
+#   surface_xyz    n_surface x 3 float32 — верхняя точка каждой непустой колонки
+#   surface_color  n_surface uint8 — индекс цвета в palette
+#   column_xy      n_columns x 2 float32
+#   offsets        (n_columns + 1) uint32 — слои колонки i: offsets[i]:offsets[i+1]
+#   layer_z        n_layers float32
+#   layer_quality  n_layers float32
+#   layer_color    n_layers uint8
+MAGIC = b'SRF1'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIIId')  # magic, version, reserved, n_palette, n_surface, n_columns, n_layers, avg
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+EXTENSIONS = {None: '.srf', 'gzip': '.srf.gz', 'zstd': '.srf.zst'}
+
+
+def _layout(n_palette, n_surface, n_columns, n_layers):
+    return [
+        ('palette', 'S8', (n_palette,)),
+        ('surface_xyz', '<f4', (n_surface, 3)),
+        ('surface_color', 'u1', (n_surface,)),
+        ('column_xy', '<f4', (n_columns, 2)),
+        ('offsets', '<u4', (n_columns + 1,)),
+        ('layer_z', '<f4', (n_layers,)),
+        ('layer_quality', '<f4', (n_layers,)),
+        ('layer_color', 'u1', (n_layers,)),
+    ]
+
+
+def _sections(layout):
+    pos = HEADER.size
+    for name, dtype, shape in layout:
+        pos = (pos + 7) & ~7
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        yield name, dtype, shape, pos
+        pos += size
+
+
+# --- Общая упаковка: заголовок (4 счётчика + среднее) и выровненные секции ---
+def pack(magic, layout, counts_header, avg, arrays):
+    avg = np.nan if avg is None else avg
+    buf = bytearray(HEADER.pack(magic, VERSION, 0, *counts_header, avg))
+    for name, dtype, shape, pos in _sections(layout(*counts_header)):
+        buf.extend(b'\0' * (pos - len(buf)))
+        buf.extend(np.ascontiguousarray(arrays[name], dtype=dtype).reshape(shape).tobytes())
+    return bytes(buf)
+
+
+def unpack(buf, magic, layout):
+    found, version, _, *counts_header, avg = HEADER.unpack_from(buf, 0)
+    if found != magic or version != VERSION:
+        raise ValueError(f"Неизвестный формат: {found!r} v{version}")
+    data = {'avg_disappeared_quality': None if np.isnan(avg) else avg}
+    for name, dtype, shape, pos in _sections(layout(*counts_header)):
+        count = int(np.prod(shape))
+        data[name] = np.frombuffer(buf, dtype=dtype, count=count, offset=pos).reshape(shape)
+    data['palette'] = [c.decode('ascii') for c in data['palette']]
+    return data
+
+
+# --- Верхние точки непустых колонок ---
+def surface(column_xy, offsets, layer_z, layer_color):
+    counts = np.diff(offsets)
+    filled = counts > 0
+    top = offsets[1:][filled].astype(np.int64) - 1
+    xyz = np.concatenate([np.asarray(column_xy)[filled], np.asarray(layer_z)[top][:, None]], axis=1)
+    return xyz, np.asarray(layer_color)[top]
+
+
+# --- Кодирование: столбцы колонок и плоские слои -> bytes ---
+def encode(col_x, col_y, counts, layer_z, layer_quality, layer_color, palette, avg_disappeared_quality):
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype('<u4')
+    column_xy = np.stack([col_x, col_y], axis=1)
+    surface_xyz, surface_color = surface(column_xy, offsets, layer_z, layer_color)
+    arrays = {
+        'palette': np.array([c.encode('ascii') for c in palette], dtype='S8'),
+        'surface_xyz': surface_xyz,
+        'surface_color': surface_color,
+        'column_xy': column_xy,
+        'offsets': offsets,
+        'layer_z': layer_z,
+        'layer_quality': layer_quality,
+        'layer_color': layer_color,
+    }
+    counts_header = (len(palette), len(surface_color), len(counts), int(offsets[-1]))
+    return pack(MAGIC, _layout, counts_header, avg_disappeared_quality, arrays)
+
+
+# --- Декодирование: bytes / mmap -> словарь массивов (без копирования) ---
+def decode(buf):
+    return unpack(buf, MAGIC, _layout)
+
+
+def compress(raw, compression):
+    if compression is None:
+        return raw
+    if compression == 'gzip':
+        return gzip.compress(raw, compresslevel=6, mtime=0)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Для сжатия zstd нужен пакет zstandard")
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    raise ValueError(f"Неизвестное сжатие: {compression}")
+
+
+# --- Запись скана из LayerStack ---
+def write_surface(path, stack, avg_disappeared_quality, compression=None):
+    return write_layers(path, stack.layers(), stack.palette, avg_disappeared_quality, compression)
+
+
+# --- Запись скана по массивам LayerStack.layers() и палитре; digest (hashlib) получает записанные байты ---
+def write_layers(path, layers, palette, avg_disappeared_quality, compression=None, digest=None):
+    raw = encode(*layers, palette, avg_disappeared_quality)
+    data = compress(raw, compression)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if digest is not None:
+        digest.update(data)
+    return len(data)
+
+
+# --- Содержимое файла: без сжатия — через mmap, иначе распаковка в память ---
+def read_buffer(path):
+    with open(path, 'rb') as f:
+        head = f.read(4)
+        f.seek(0)
+        if head.startswith(GZIP_MAGIC):
+            return gzip.decompress(f.read())
+        if head == ZSTD_MAGIC:
+            if zstandard is None:
+                raise RuntimeError("Для чтения zstd нужен пакет zstandard")
+            return zstandard.ZstdDecompressor().decompress(f.read())
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Пустой файл: {path}")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_surface(path):
+    return decode(read_buffer(path))
+
+
+# --- JSON-словарь скана (surface_points / array) -> столбцы колонок, слои и палитра ---
+def json_layers(content):
+    palette, palette_index = [], {}
+    col_x, col_y, counts, zs, qs, ks = [], [], [], [], [], []
+    for x, column in content['array'].items():
+        for y, points in column.items():
+            col_x.append(float(x))
+            col_y.append(float(y))
+            counts.append(len(points))
+            for p in points:
+                code = palette_index.setdefault(p['color'], len(palette))
+                if code == len(palette):
+                    palette.append(p['color'])
+                zs.append(p['z'])
+                qs.append(p['quality'])
+                ks.append(code)
+    layers = (np.array(col_x), np.array(col_y), np.array(counts, dtype=np.int64), np.array(zs),
+              np.array(qs), np.array(ks, dtype=np.uint8))
+    return layers, palette
+
+
+def encode_json(content):
+    layers, palette = json_layers(content)
+    return encode(*layers, palette, content.get('avg_disappeared_quality'))
+
+
+# --- Обратно в структуру JSON (float32 -> float, точность 7 знаков) ---
+def to_json(data):
+    palette = data['palette']
+    offsets = data['offsets'].tolist()
+    xs, ys = data['column_xy'][:, 0].tolist(), data['column_xy'][:, 1].tolist()
+    zs, qs, ks = data['layer_z'].tolist(), data['layer_quality'].tolist(), data['layer_color'].tolist()
+    grid = {}
+    surface_points = []
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        points = [{'x': x, 'y': y, 'z': zs[j], 'quality': qs[j], 'color': palette[ks[j]]}
+                  for j in range(offsets[i], offsets[i + 1])]
+        grid.setdefault(x, {})[y] = points
+        if points:
+            surface_points.append(points[-1])
+    return {'surface_points': surface_points, 'array': grid,
+            'avg_disappeared_quality': data['avg_disappeared_quality']}
+
+
+# --- Конвертер JSON -> .srf со сравнением размера и времени разбора ---
+def convert(json_path, compression=None):
+    with open(json_path) as f:
+        content = json.load(f)
+    out_path = os.path.splitext(json_path)[0] + EXTENSIONS[compression]
+    with open(out_path, 'wb') as f:
+        f.write(compress(encode_json(content), compression))
+
+    t = time.perf_counter()
+    with open(json_path) as f:
+        json.load(f)
+    json_time = time.perf_counter() - t
+    t = time.perf_counter()
+    data = read_surface(out_path)
+    data['layer_z'].sum()
+    binary_time = time.perf_counter() - t
+    json_size, binary_size = os.path.getsize(json_path), os.path.getsize(out_path)
+    print(f"[+] {os.path.basename(json_path)} -> {os.path.basename(out_path)}: "
+          f"{json_size / 1e6:.2f} МБ -> {binary_size / 1e6:.3f} МБ (x{json_size / binary_size:.0f}), "
+          f"разбор {json_time * 1e3:.1f} мс -> {binary_time * 1e3:.2f} мс")
+    return out_path
+
+
+if __name__ == '__main__':
+    # python surface_format.py [--gzip|--zstd] file.json ...
+    args = sys.argv[1:]
+    compression = None
+    if args and args[0] in ('--gzip', '--zstd'):
+        compression = args.pop(0)[2:]
+    for path in args:
+        convert(path, compression)
@@ -0,0 +1,89 @@
+import os
+import json
+import hashlib
+
+# --- Оглавление папки вывода (manifest.json) ---
+# Один JSON на все сканы, по времени:
+# {
+#   "version": 1,
+#   "scans": [
+#     {"filename": "surface-tank ... .json", "timestamp": "2025-05-26T23:05:17",
+#      "points": 780, "bytes": 123456, "quality": 37.2,
+#      "avg_disappeared_quality": null, "sha256": "..."}
+#   ]
+# }
+# Маршруты /api/surfaces берут из него список, «следующий» и «последний»
+# скан без readdir и stat на каждый файл. Файл переписывается целиком через
+# временный файл и os.replace, поэтому читатель всегда видит целое оглавление.
+# Записи держатся в памяти (_cache): пока файл тот же, что записан здесь
+# (mtime и размер), он не перечитывается. sha256 скана передаёт тот, кто его
+# записал (посчитан по байтам при записи), — файл скана не читается обратно.
+MANIFEST_FILE = 'manifest.json'
+VERSION = 1
+
+_cache = {}  # путь -> ((mtime_ns, размер) записанного файла, записи)
+
+
+def file_sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return []
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == _stamp(path):
+        return list(cached[1])
+    with open(path) as f:
+        scans = json.load(f)['scans']
+    _cache[path] = (_stamp(path), scans)
+    return list(scans)
+
+
+def _write(path, scans):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': VERSION, 'scans': scans}, f, indent=1)
+    os.replace(tmp_path, path)
+    _cache[path] = (_stamp(path), scans)
+
+
+# --- Добавить (или заменить) запись скана; файл скана уже записан ---
+# sha256 — хэш его байтов, если он уже посчитан при записи; None — прочитать файл.
+def add_scan(path, output_path, surface_time, points, quality, avg_disappeared_quality, sha256=None):
+    entry = {
+        'filename': os.path.basename(output_path),
+        'timestamp': surface_time.isoformat(),
+        'points': points,
+        'bytes': os.path.getsize(output_path),
+        'quality': quality,
+        'avg_disappeared_quality': avg_disappeared_quality,
+        'sha256': sha256 or file_sha256(output_path),
+    }
+    scans = read_manifest(path)
+    if scans and scans[-1]['timestamp'] < entry['timestamp']:
+        # Обычный случай — скан новее всех в оглавлении
+        scans.append(entry)
+    else:
+        scans = [s for s in scans if s['filename'] != entry['filename']]
+        scans.append(entry)
+        scans.sort(key=lambda s: s['timestamp'])
+    _write(path, scans)
+    return entry
+
+
+# --- Убрать записи новее контрольной точки ---
+def trim_manifest(path, last_time):
+    scans = read_manifest(path)
+    keep = [s for s in scans if s['timestamp'] <= last_time.isoformat()]
+    if len(keep) != len(scans):
+        _write(path, keep)
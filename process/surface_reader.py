@@ -0,0 +1,134 @@
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# --- Быстрое чтение surface-файла целиком в массивы NumPy ---
+# Файл разбирается на уровне байтов: границы токенов и строк находятся
+# векторно, первые три токена строки переводятся в float одним astype.
+# Правила те же, что у прежних построчных читателей: строка с тремя и более
+# токенами — точка, если первые три токена — числа (иначе строка
+# пропускается), четвёртый токен — цвет (по умолчанию '#ffffff').
+#   volume   — объём из первой строки (header=True) или None
+#   xyz      — (N, 3) float64
+#   columns  — (N,) число токенов в строке точки (3 — без цвета, 4 и больше — с цветом)
+#   codes    — (N,) индекс цвета точки в palette
+#   palette  — список цветов (str)
+SurfaceScan = namedtuple('SurfaceScan', ['volume', 'xyz', 'columns', 'codes', 'palette'])
+
+DEFAULT_COLOR = '#ffffff'
+MAX_TOKEN = 32  # токены длиннее разбираются поштучно
+
+# Пробельные байты как у str.split() для ASCII
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[[9, 10, 11, 12, 13, 28, 29, 30, 31, 32]] = True
+
+
+# --- Токены фиксированной ширины (байты после конца токена обнулены) ---
+def _tokens(windows, starts, lengths):
+    width = min(max(int(lengths.max(initial=1)), 1), MAX_TOKEN)
+    chars = windows[starts, :width].copy()
+    chars[np.arange(width) >= lengths[:, None]] = 0
+    return chars.view(f'S{width}').ravel()
+
+
+# --- Токены -> float; ok=False там, где float() не разобрал бы токен ---
+def _floats(data, windows, starts, lengths):
+    values = np.empty(len(starts))
+    ok = np.ones(len(starts), dtype=bool)
+    short = lengths <= MAX_TOKEN
+    try:
+        values[short] = _tokens(windows, starts[short], lengths[short]).astype(float)
+        rest = np.flatnonzero(~short)
+    except ValueError:
+        rest = np.arange(len(starts))
+    for i in rest.tolist():
+        try:
+            values[i] = float(data[starts[i]:starts[i] + lengths[i]])
+        except ValueError:
+            values[i] = np.nan
+            ok[i] = False
+    return values, ok
+
+
+# --- Палитра и индексы цветов; '#rrggbb' (до 8 байт) сравниваются как uint64 ---
+def _palette(color_tokens):
+    if color_tokens.dtype == 'S8':
+        keys, codes = np.unique(color_tokens.view(np.uint64), return_inverse=True)
+        palette = keys.view('S8')
+    else:
+        palette, codes = np.unique(color_tokens, return_inverse=True)
+    return [c.decode(errors='replace') for c in palette.tolist()], codes.ravel()
+
+
+def read_surface_file(path, header=True):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    volume = None
+    if header:
+        first = data.split(b'\n', 1)[0].split(b'\r', 1)[0]
+        volume = float(first.strip()) if data else 0
+        data = data[len(first):]
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if len(buf) == 0:
+        return SurfaceScan(volume, np.empty((0, 3)), np.empty(0, dtype=np.int64),
+                           np.empty(0, dtype=np.int64), [])
+
+    # Границы токенов: управляющие байты, не являющиеся пробелами, встречаются
+    # редко — тогда нужна точная таблица, иначе хватает сравнения с пробелом
+    space = buf <= 32
+    if not _WHITESPACE[buf[space]].all():
+        space = _WHITESPACE[buf]
+    token = np.zeros(len(buf) + 2, dtype=np.int8)
+    token[1:-1] = ~space
+    edges = np.flatnonzero(np.diff(token))
+    starts, ends = edges[0::2], edges[1::2]
+    lengths = ends - starts
+
+    # Новая строка начинается с токена, перед которым был перевод строки
+    # (внутри токенов переводов строк нет, поэтому reduceat по [конец i, конец i+1))
+    text = buf[:ends[-1] if len(ends) else 0]
+    newline = (text == 10) | (text == 13)
+    first_token = np.flatnonzero(np.r_[True, np.logical_or.reduceat(newline, ends[:-1])])
+    per_line = np.diff(np.r_[first_token, len(starts)])
+
+    # Окна по MAX_TOKEN байт от каждой позиции буфера (без копирования)
+    windows = sliding_window_view(np.concatenate([buf, np.zeros(MAX_TOKEN, dtype=np.uint8)]), MAX_TOKEN)
+
+    # Строки-точки: три и более токена, первые три — числа
+    rows = first_token[per_line >= 3]
+    columns = per_line[per_line >= 3]
+    xyz = np.empty((len(rows), 3))
+    valid = np.ones(len(rows), dtype=bool)
+    for k in range(3):
+        xyz[:, k], ok = _floats(data, windows, starts[rows + k], lengths[rows + k])
+        valid &= ok
+    xyz, columns, rows = xyz[valid], columns[valid], rows[valid]
+
+    # Цвет — четвёртый токен, если он есть
+    colored = columns > 3
+    at = rows[colored] + 3
+    width = max(len(DEFAULT_COLOR), min(int(lengths[at].max(initial=0)), MAX_TOKEN))
+    color_tokens = np.full(len(rows), DEFAULT_COLOR.encode(), dtype=f'S{width}')
+    color_tokens[colored] = _tokens(windows, starts[at], lengths[at])
+    long_colors = np.flatnonzero(colored)[lengths[at] > MAX_TOKEN]
+    if len(long_colors):
+        color_tokens = color_tokens.astype(object)
+        for i in long_colors.tolist():
+            s = starts[rows[i] + 3]
+            color_tokens[i] = data[s:s + lengths[rows[i] + 3]]
+    palette, codes = _palette(color_tokens)
+    return SurfaceScan(volume, xyz, columns, codes, palette)
+
+
+if __name__ == '__main__':
+    # python surface_reader.py файл ... — скорость чтения
+    for path in sys.argv[1:]:
+        started = time.perf_counter()
+        scan = read_surface_file(path)
+        elapsed = time.perf_counter() - started
+        print(f"[+] {path}: {len(scan.xyz)} точек, {len(scan.palette)} цветов, {elapsed * 1e3:.1f} мс")
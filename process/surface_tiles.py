@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import shutil
+
+import numpy as np
+
+# --- Тайлы скана с уровнями детализации (квадродерево) ---
+# Область — та же, что принимает validatePoints (src/utils/pointParser.ts).
+# Уровень L делит её на 2^L x 2^L тайлов, tx растёт по x, ty — по y, тайл
+# лежит в <папка скана>/<L>/<tx>_<ty>.json. На уровнях кроме последнего тайл
+# прорежен до сетки TILE_CELLS x TILE_CELLS: в каждой ячейке остаётся самая
+# высокая верхняя точка со своим цветом и качеством. На последнем уровне
+# остаются все точки. Пустые тайлы не пишутся, список непустых — в index.json.
+X_RANGE = (-18820, 18820)
+Y_RANGE = (-15600, 15600)
+LEVELS = 5  # уровни 0..LEVELS-1
+TILE_CELLS = 64  # ячеек прореживания по стороне тайла
+
+
+def tile_bounds(level, tx, ty):
+    n = 2 ** level
+    x0, x1 = X_RANGE
+    y0, y1 = Y_RANGE
+    return [x0 + (x1 - x0) * tx / n, x0 + (x1 - x0) * (tx + 1) / n,
+            y0 + (y1 - y0) * ty / n, y0 + (y1 - y0) * (ty + 1) / n]
+
+
+# --- Номер ячейки по оси при n ячейках на всю область (точки за краем — в крайние) ---
+def _cells(values, value_range, n):
+    lo, hi = value_range
+    return np.clip(np.floor((values - lo) / (hi - lo) * n), 0, n - 1).astype(np.int64)
+
+
+# --- Тайлы уровня: (tx, ty, индексы точек в исходном порядке) ---
+def level_tiles(xs, ys, zs, level, levels=LEVELS):
+    n = 2 ** level
+    if level < levels - 1:
+        # Самая высокая точка в каждой ячейке (при равной высоте — первая)
+        cx, cy = _cells(xs, X_RANGE, n * TILE_CELLS), _cells(ys, Y_RANGE, n * TILE_CELLS)
+        cell = cx * (n * TILE_CELLS) + cy
+        order = np.lexsort((-zs, cell))
+        first = np.r_[True, cell[order][1:] != cell[order][:-1]]
+        keep = np.sort(order[first])
+    else:
+        keep = np.arange(len(xs))
+    tile = _cells(xs[keep], X_RANGE, n) * n + _cells(ys[keep], Y_RANGE, n)
+    order = np.argsort(tile, kind='stable')
+    tile, keep = tile[order], keep[order]
+    bounds = np.flatnonzero(np.r_[True, tile[1:] != tile[:-1], True])
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        t = int(tile[start])
+        yield t // n, t % n, keep[start:end]
+
+
+# --- Запись всех тайлов скана в directory; возвращает (число тайлов, байт) ---
+def write_tiles(directory, xs, ys, zs, qs, codes, palette, levels=LEVELS):
+    shutil.rmtree(directory, ignore_errors=True)
+    xs, ys, zs, qs = (np.asarray(a, dtype=float) for a in (xs, ys, zs, qs))
+    codes = np.asarray(codes)
+    index = {'x_range': X_RANGE, 'y_range': Y_RANGE, 'levels': levels, 'tile_cells': TILE_CELLS,
+             'points': len(xs), 'tiles': []}
+    size = 0
+    for level in range(levels):
+        os.makedirs(os.path.join(directory, str(level)), exist_ok=True)
+        for tx, ty, idx in level_tiles(xs, ys, zs, level, levels):
+            points = [{'x': x, 'y': y, 'z': z, 'quality': q, 'color': palette[k]}
+                      for x, y, z, q, k in zip(xs[idx].tolist(), ys[idx].tolist(), zs[idx].tolist(),
+                                               qs[idx].tolist(), codes[idx].tolist())]
+            path = os.path.join(directory, str(level), f"{tx}_{ty}.json")
+            with open(path, 'w') as f:
+                json.dump({'level': level, 'tx': tx, 'ty': ty, 'bounds': tile_bounds(level, tx, ty),
+                           'surface_points': points}, f, separators=(',', ':'))
+            size += os.path.getsize(path)
+            index['tiles'].append([level, tx, ty, len(points)])
+    with open(os.path.join(directory, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+    return len(index['tiles']), size
+
+
+# --- Тайлы из готового JSON скана (surface_points) ---
+def tile_json(json_path, out_dir):
+    with open(json_path) as f:
+        points = json.load(f)['surface_points']
+    palette = sorted({p['color'] for p in points})
+    code = {c: i for i, c in enumerate(palette)}
+    columns = [[p[k] for p in points] for k in ('x', 'y', 'z', 'quality')]
+    directory = os.path.join(out_dir, os.path.splitext(os.path.basename(json_path))[0])
+    count, size = write_tiles(directory, *columns, [code[p['color']] for p in points], palette)
+    print(f"[+] {os.path.basename(json_path)}: {count} тайлов, {size / 1e6:.2f} МБ -> {directory}")
+    return directory
+
+
+if __name__ == '__main__':
+    # python surface_tiles.py папка_тайлов scan.json ...
+    out_dir, *paths = sys.argv[1:]
+    for path in paths:
+        tile_json(path, out_dir)
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
+
+# --- Несколько штабелей (силосов) в одном запуске ---
+# Манифест — JSON со списком штабелей; каждый обрабатывается parce.process_all
+# в отдельном процессе пула. Процесс берёт ровно одну задачу
+# (max_tasks_per_child=1), поэтому настройки модуля parce, стек слоёв и
+# контрольная точка одного штабеля не видны другим.
+#
+# {
+#   "workers": 2,
+#   "tanks": [
+#     {
+#       "name": "tank1",
+#       "input_dir": "P:/sdf/tank1/surf",       папка со сканами
+#       "quality_csv": "quality.csv",           относительно input_dir или абсолютный путь
+#       "quality_column": "KL_320_FINAL",       необязательно
+#       "output_dir": "../public/surfaces/tank1",
+#       "state_dir": "tanks/tank1",             необязательно: контрольная точка, кэш качества, замеры, журнал
+#       "colors": [                             необязательно: пороги классов, первое совпадение
+#         {"name": "rich", "color": "#A259FF", "above": 39},
+#         {"name": "target", "color": "#04bd3b", "min": 35.4, "max": 38.9},
+#         {"name": "ordinary", "color": "#2CD9C5", "min": 30.7, "max": 35.3},
+#         {"name": "poor", "color": "#FFE066"}
+#       ],
+#       "settings": {"MAX_LAYERS": 32}          необязательно: прочие настройки parce
+#     }
+#   ]
+# }
+#
+# Границы класса: above (q > v), min (q >= v), max (q <= v), below (q < v);
+# класс без границ — для всего остального, он должен быть последним.
+# Без "colors" действуют get_color и QUALITY_CLASSES из parce.
+STATE_ROOT = 'tanks'  # state_dir по умолчанию: STATE_ROOT/<name>
+BOUNDS = {'above': float.__gt__, 'min': float.__ge__, 'max': float.__le__, 'below': float.__lt__}
+REQUIRED = ('name', 'input_dir', 'quality_csv', 'output_dir')
+
+
+# --- Цвет по качеству из правил манифеста ---
+def scheme_color(rules):
+    rules = tuple((color, tuple((bound, float(value)) for bound, value in sorted(bounds.items())))
+                  for color, bounds in rules)
+
+    # Без вложенных генераторов: код функции входит в отпечаток контрольной точки
+    def get_color(quality):
+        quality = float(quality)
+        for color, bounds in rules:
+            for bound, value in bounds:
+                if not BOUNDS[bound](quality, value):
+                    break
+            else:
+                return color
+        return rules[-1][0]
+    return get_color
+
+
+# --- Проверка манифеста: список штабелей с заполненными путями ---
+def load_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    tanks = manifest.get('tanks', [])
+    if not tanks:
+        raise ValueError(f"{path}: нет ни одного штабеля в 'tanks'")
+    for tank in tanks:
+        missing = [key for key in REQUIRED if key not in tank]
+        if missing:
+            raise ValueError(f"{path}: у штабеля {tank.get('name', '?')} нет {', '.join(missing)}")
+        tank.setdefault('state_dir', os.path.join(STATE_ROOT, tank['name']))
+        # Относительные пути — от папки манифеста
+        for key in ('input_dir', 'output_dir', 'state_dir'):
+            tank[key] = os.path.join(base, tank[key])
+        for rule in tank.get('colors', ()):
+            unknown = set(rule) - {'name', 'color', *BOUNDS}
+            if unknown or 'name' not in rule or 'color' not in rule:
+                raise ValueError(f"{path}: неверный класс {rule} у штабеля {tank['name']}")
+    for key in ('name', 'output_dir', 'state_dir'):
+        values = [os.path.normcase(str(t[key])) for t in tanks]
+        if len(set(values)) != len(values):
+            raise ValueError(f"{path}: {key} штабелей должны различаться")
+    return manifest
+
+
+# --- Настройки parce для штабеля (в процессе пула) ---
+def configure(parce, tank):
+    state_dir = tank['state_dir']
+    os.makedirs(state_dir, exist_ok=True)
+    parce.INPUT_DIR = tank['input_dir']
+    parce.QUALITY_CSV = tank['quality_csv']
+    parce.QUALITY_COLUMN = tank.get('quality_column', parce.QUALITY_COLUMN)
+    parce.OUTPUT_DIR = tank['output_dir']
+    parce.CHECKPOINT_PATH = os.path.join(state_dir, 'checkpoint.npz')
+    parce.QUALITY_CACHE = os.path.join(state_dir, 'quality_cache.npz')
+    parce.METRICS_LOG = os.path.join(state_dir, 'metrics.jsonl')
+    parce.METRICS_PROM = os.path.join(state_dir, 'metrics.prom')
+    parce.PROFILE_DIR = os.path.join(state_dir, 'profiles')
+    if 'colors' in tank:
+        rules = tank['colors']
+        parce.get_color = scheme_color([(r['color'], {k: v for k, v in r.items() if k in BOUNDS}) for r in rules])
+        parce.QUALITY_CLASSES = tuple((r['name'], r['color']) for r in rules)
+    for name, value in tank.get('settings', {}).items():
+        if not name.isupper() or not hasattr(parce, name):
+            raise ValueError(f"Неизвестная настройка parce: {name}")
+        setattr(parce, name, tuple(value) if isinstance(value, list) else value)
+
+
+# --- Обработка одного штабеля (выполняется в процессе пула) ---
+def run_tank(tank, progress):
+    started = time.perf_counter()
+    log_path = os.path.join(tank['state_dir'], 'process.log')
+    os.makedirs(tank['state_dir'], exist_ok=True)
+    result = {'name': tank['name'], 'files': 0, 'seconds': 0.0, 'error': None}
+    with open(log_path, 'a') as log, contextlib.redirect_stdout(log):
+        try:
+            import parce
+            configure(parce, tank)
+
+            def report(n, total, file):
+                result['files'] = n
+                progress.put((tank['name'], n, total, os.path.basename(file), time.perf_counter() - started))
+
+            metrics = parce.process_all(report)
+            result['stages'] = metrics.seconds
+            result['counters'] = metrics.counters
+        except Exception as e:
+            traceback.print_exc(file=log)
+            result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+# --- Все штабели манифеста в пуле процессов ---
+def run(manifest, workers=None, only=None):
+    tanks = [t for t in manifest['tanks'] if not only or t['name'] in only]
+    workers = max(1, min(workers or manifest.get('workers') or os.cpu_count() or 1, len(tanks)))
+    started = time.perf_counter()
+    results = []
+    with multiprocessing.Manager() as manager:
+        progress = manager.Queue()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                 max_tasks_per_child=1) as pool:
+            pending = {pool.submit(run_tank, tank, progress) for tank in tanks}
+            while pending:
+                try:
+                    name, n, total, file, seconds = progress.get(timeout=0.5)
+                    print(f"[{name}] {n}/{total} {file} ({seconds:.1f} с)")
+                    continue
+                except Empty:
+                    pass
+                for job in [j for j in pending if j.done()]:
+                    pending.discard(job)
+                    results.append(job.result())
+            # Сообщения, пришедшие после последней проверки
+            while not progress.empty():
+                name, n, total, file, seconds = progress.get()
+                print(f"[{name}] {n}/{total} {file} ({seconds:.1f} с)")
+
+    print(f"\n{'штабель':<16} {'сканов':>7} {'время, с':>9} {'сканов/с':>9}  самая долгая стадия")
+    for r in sorted(results, key=lambda r: r['name']):
+        if r['error']:
+            print(f"{r['name']:<16} {r['files']:>7} {r['seconds']:>9.2f} {'-':>9}  [!] {r['error']}")
+            continue
+        slowest = max(r['stages'].items(), key=lambda kv: kv[1], default=('-', 0.0))
+        rate = r['files'] / r['seconds'] if r['seconds'] else 0.0
+        print(f"{r['name']:<16} {r['files']:>7} {r['seconds']:>9.2f} {rate:>9.2f}  {slowest[0]} ({slowest[1]:.2f} с)")
+    print(f"[+] Штабелей: {len(results)}, за {time.perf_counter() - started:.2f} с, процессов: {workers}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обработка нескольких штабелей по манифесту")
+    parser.add_argument('manifest', help="JSON со списком штабелей")
+    parser.add_argument('--workers', type=int, help="процессов (по умолчанию из манифеста или по числу ядер)")
+    parser.add_argument('--only', nargs='+', help="обработать только эти штабели")
+    args = parser.parse_args(argv)
+    results = run(load_manifest(args.manifest), args.workers, args.only)
+    return 1 if any(r['error'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import json
+
+import numpy as np
+import pytest
+
+from layer_stack import LayerStack
+
+# --- LayerStack против исходного поточечного цикла parce.process_all ---
+# ReferenceLoop — цикл из parce.process_all до перехода на LayerStack, без
+# изменений в логике: accumulated_changes, accumulated_point_grid и качества
+# пропавших точек. Серии сканов случайные, на маленькой сетке с немногими
+# значениями z, качества и цвета, чтобы часто встречались повторы колонки в
+# одном скане, срезы ниже верхнего слоя, слияния одного цвета и переходы цвета.
+COLORS = ('#A259FF', '#04bd3b', '#2CD9C5', '#FFE066')
+
+
+class ReferenceLoop:
+    def __init__(self):
+        self.accumulated_changes = {}
+        self.accumulated_point_grid = {}
+
+    def apply_scan(self, coords, quality, color):
+        accumulated_changes = self.accumulated_changes
+        accumulated_point_grid = self.accumulated_point_grid
+        disappeared_points_quality = []
+        for x, y, z in coords:
+            key = (x, y)
+            current_z = z
+            current_color = '#ffffff'
+
+            if key in accumulated_changes:
+                prev_z, prev_color = accumulated_changes[key]
+                if current_z > prev_z:
+                    accumulated_changes[key] = (current_z, color)
+                    current_color = color
+                else:
+                    current_color = prev_color
+            else:
+                accumulated_changes[key] = (current_z, '#ffffff')
+
+            if x not in accumulated_point_grid:
+                accumulated_point_grid[x] = {}
+            if y not in accumulated_point_grid[x]:
+                accumulated_point_grid[x][y] = []
+
+            point = {'x': x, 'y': y, 'z': current_z, 'quality': quality, 'color': current_color}
+            points = accumulated_point_grid[x][y]
+
+            if points and current_z < max(p['z'] for p in points):
+                color_counts = {}
+                for p in points:
+                    if p['z'] >= current_z and p['quality'] >= 1:
+                        disappeared_points_quality.append(p['quality'])
+                        color_counts[p['color']] = color_counts.get(p['color'], 0) + 1
+                points = [p for p in points if p['z'] < current_z]
+                for c, count in color_counts.items():
+                    if count % 2 != 0:
+                        last_point = next((p for p in reversed(points) if p['color'] == c), None)
+                        if last_point:
+                            points.append({'x': last_point['x'], 'y': last_point['y'], 'z': current_z - 0.1,
+                                           'quality': last_point['quality'], 'color': c})
+                            points.sort(key=lambda p: p['z'])
+            else:
+                if len(points) > 2 and points[-1]['color'] == current_color and points[-2]['color'] == current_color:
+                    points.pop(-1)
+                if points:
+                    prev_point = points[-1]
+                    if current_z > prev_point['z'] and current_color != prev_point['color']:
+                        has_pair = any(p['color'] == prev_point['color'] and p['z'] < prev_point['z']
+                                       for p in points[:-1])
+                        if not has_pair:
+                            points.append({'x': prev_point['x'], 'y': prev_point['y'], 'z': prev_point['z'] + 0.1,
+                                           'quality': prev_point['quality'], 'color': prev_point['color']})
+                            points.sort(key=lambda p: p['z'])
+
+            points.append(point)
+            points.sort(key=lambda p: p['z'])
+
+            points_sorted = sorted(points, key=lambda p: -p['z'])
+            optimized_points = []
+            i = 0
+            while i < len(points_sorted):
+                if i >= 2 and points_sorted[i]['color'] == points_sorted[i - 1]['color'] == points_sorted[i - 2]['color']:
+                    optimized_points.pop()
+                    optimized_points.append(points_sorted[i])
+                else:
+                    optimized_points.append(points_sorted[i])
+                i += 1
+            accumulated_point_grid[x][y] = sorted(optimized_points, key=lambda p: p['z'])
+        return disappeared_points_quality
+
+    def surface_points(self):
+        return [points[-1] for column in self.accumulated_point_grid.values()
+                for points in column.values() if points]
+
+
+def random_scan(rng, size=40):
+    xs = rng.choice([-1.5, 0.0, 2.25, 3.0], size)
+    ys = rng.choice([0.5, 1.0, 7.75], size)
+    zs = rng.choice([0.0, 1.0, 2.0, 2.5, 3.0, 5.0, 8.0], size) + rng.choice([0.0, 0.05], size)
+    return xs, ys, zs
+
+
+def assert_same(stack, reference, lost, expected):
+    assert lost == expected
+    assert json.dumps(stack.surface_points()) == json.dumps(reference.surface_points())
+    assert json.dumps(stack.to_grid()) == json.dumps(reference.accumulated_point_grid)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_random_series_match_reference_loop(seed):
+    rng = np.random.default_rng(seed)
+    stack, reference = LayerStack(columns=2, depth=2), ReferenceLoop()
+    for _ in range(12):
+        xs, ys, zs = random_scan(rng, int(rng.integers(1, 60)))
+        quality = float(rng.choice([0.5, 31.0, 36.0, 36.0, 40.5]))
+        color = str(rng.choice(COLORS[:2] if rng.random() < 0.5 else COLORS))
+        expected = reference.apply_scan(list(zip(xs.tolist(), ys.tolist(), zs.tolist())), quality, color)
+        assert_same(stack, reference, stack.apply_scan(xs, ys, zs, quality, color), expected)
+        # Контрольная точка после каждого скана: восстановленный стек продолжает так же
+        stack = LayerStack.from_state(stack.state())
+
+
+def test_repeated_column_in_one_scan():
+    stack, reference = LayerStack(), ReferenceLoop()
+    for coords, quality, color in (([(0.0, 0.0, 1.0), (0.0, 0.0, 3.0), (0.0, 0.0, 2.0), (1.0, 0.0, 1.0)], 36.0, '#a'),
+                                   ([(0.0, 0.0, 4.0), (0.0, 0.0, 4.0), (0.0, 0.0, 0.5)], 40.0, '#b')):
+        xs, ys, zs = (np.array(c) for c in zip(*coords))
+        assert_same(stack, reference, stack.apply_scan(xs, ys, zs, quality, color),
+                    reference.apply_scan(coords, quality, color))
+
+
+def test_erosion_below_top_layer():
+    stack, reference = LayerStack(), ReferenceLoop()
+    for z, quality, color in ((1.0, 36.0, '#a'), (3.0, 40.0, '#b'), (5.0, 31.0, '#c'), (6.0, 0.5, '#a'),
+                              (2.0, 36.0, '#b'), (0.5, 36.0, '#c')):
+        lost = stack.apply_scan(np.array([0.0]), np.array([0.0]), np.array([z]), quality, color)
+        expected = reference.apply_scan([(0.0, 0.0, z)], quality, color)
+        assert_same(stack, reference, lost, expected)
+    assert stack.eroded == 1
+
+
+def test_same_color_merges_and_color_transitions():
+    stack, reference = LayerStack(), ReferenceLoop()
+    for z, color in ((1.0, '#a'), (2.0, '#a'), (3.0, '#a'), (4.0, '#a'), (5.0, '#b'), (6.0, '#a'),
+                     (7.0, '#b'), (8.0, '#b'), (9.0, '#b'), (10.0, '#c')):
+        lost = stack.apply_scan(np.array([0.0, 1.0]), np.array([0.0, 0.0]), np.array([z, z]), 36.0, color)
+        expected = reference.apply_scan([(0.0, 0.0, z), (1.0, 0.0, z)], 36.0, color)
+        assert_same(stack, reference, lost, expected)
+
+
+def test_resume_after_single_scan():
+    # После одного скана в колонках по одному слою — сохранённая глубина 1
+    stack, reference = LayerStack(), ReferenceLoop()
+    for z in (1.0, 2.0, 0.5):
+        lost = stack.apply_scan(np.array([0.0]), np.array([0.0]), np.array([z]), 36.0, '#a')
+        assert_same(stack, reference, lost, reference.apply_scan([(0.0, 0.0, z)], 36.0, '#a'))
+        stack = LayerStack.from_state(stack.state())
@@ -0,0 +1,285 @@
+import os
+import json
+import shutil
+import time
+import fnmatch
+from collections import deque
+
+import numpy as np
+
+import parce
+from surface_reader import read_surface_file
+from scan_pipeline import run_tasks
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # нет inotify (не Linux или пакет не установлен) — опрашиваем папку
+    INotify = None
+
+# --- Настройки ---
+POLL_INTERVAL = 1.0  # период опроса папки, с
+SETTLE_TIME = 2.0  # файл считается дописанным, если не менялся столько секунд
+LATENCY_ALERT = 30.0  # порог задержки скана для предупреждения, с
+STATUS_PATH = 'watch_status.json'  # задержки по сканам для мониторинга
+LATENCY_WINDOW = 1000  # по скольким последним сканам считать медиану и максимум задержки
+PATTERN = 'surface-tank *.txt'
+QUALITY_MEMORY = 10000  # по скольким последним сканам помнить качество; изменение качества более ранних — полный пересчёт
+QUALITY_LAG = 300.0  # сколько ждать в CSV строк качества на момент скана, с; потом скан берёт последнее известное качество
+
+
+# --- Отслеживание новых и готовых файлов ---
+# Новые сканы (новее after) приходят событиями inotify; без inotify папка
+# перечитывается, только когда меняется её mtime, и разбираются лишь новые
+# имена. Файл готов, если inotify сообщил о закрытии после записи (или о
+# переносе в папку), либо если его размер и mtime не менялись SETTLE_TIME
+# секунд. Полный просмотр папки — при запуске, после пересчёта и при
+# переполнении очереди inotify.
+class FileTracker:
+    def __init__(self, directory):
+        self.directory = directory
+        self.after = None
+        self.pending = {}    # путь -> время скана, ещё не применённые
+        self.listed = set()  # имена в папке при последнем просмотре (без inotify)
+        self.listed_mtime = None
+        self.seen = {}       # путь -> (размер, mtime_ns, время последнего изменения, время обнаружения)
+        self.closed = set()  # пути, для которых пришёл IN_CLOSE_WRITE / IN_MOVED_TO
+        self.inotify = None
+        if INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(directory, flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    # Полный просмотр: ожидают сканы новее after; возвращает времена остальных (уже применённых)
+    def rescan(self, after):
+        self.after = after
+        self.pending.clear()
+        self.listed_mtime = os.stat(self.directory).st_mtime_ns
+        self.listed = set(fnmatch.filter(os.listdir(self.directory), PATTERN))
+        applied = []
+        for name in self.listed:
+            surface_time = self._add(name)
+            if surface_time is not None and after is not None and surface_time <= after:
+                applied.append(surface_time)
+        return sorted(applied)
+
+    def _add(self, name):
+        try:
+            surface_time = parce.parse_surface_timestamp(name)
+        except ValueError:
+            return None
+        if self.after is None or surface_time > self.after:
+            self.pending[os.path.join(self.directory, name)] = surface_time
+        return surface_time
+
+    def wait(self, timeout):
+        if self.inotify is None:
+            time.sleep(timeout)
+            mtime = os.stat(self.directory).st_mtime_ns
+            if mtime != self.listed_mtime:
+                self.listed_mtime = mtime
+                names = set(fnmatch.filter(os.listdir(self.directory), PATTERN))
+                for name in names - self.listed:
+                    self._add(name)
+                self.listed = names
+            return
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & flags.Q_OVERFLOW:
+                print("[!] Переполнена очередь inotify, просматриваем папку заново")
+                self.rescan(self.after)
+            elif fnmatch.fnmatch(event.name, PATTERN):
+                self._add(event.name)
+                if event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    self.closed.add(os.path.join(self.directory, event.name))
+
+    # Ожидающие сканы по времени
+    def ordered(self):
+        return sorted(self.pending, key=self.pending.get)
+
+    def update(self, path, now):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            self.seen.pop(path, None)
+            return None
+        size, mtime = st.st_size, st.st_mtime_ns
+        prev = self.seen.get(path)
+        if prev is None:
+            # Для только что замеченного файла отсчёт идёт от его mtime
+            self.seen[path] = (size, mtime, min(now, mtime / 1e9), now)
+        elif prev[:2] != (size, mtime):
+            self.seen[path] = (size, mtime, now, prev[3])
+        return st
+
+    def ready(self, path, now):
+        size, _, changed, _ = self.seen[path]
+        return size > 0 and (path in self.closed or now - changed >= SETTLE_TIME)
+
+    # Скан применён: более ранние больше не ждём
+    def done(self, path, surface_time):
+        self.after = surface_time
+        self.pending.pop(path, None)
+        self.seen.pop(path, None)
+        self.closed.discard(path)
+
+
+# --- Статус для мониторинга: последняя задержка, максимум и медиана ---
+def write_status(latencies, scans, record):
+    window = sorted(latencies)
+    status = dict(record)
+    status['scans'] = scans
+    status['latency_p50_s'] = window[len(window) // 2]
+    status['latency_max_s'] = window[-1]
+    tmp_path = f"{STATUS_PATH}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, STATUS_PATH)
+
+
+# --- Изменилось ли качество уже применённых сканов (used: время скана -> качество) ---
+# Сравниваются только сканы не раньше changed_from — первой различающейся записи CSV.
+# used хранит не больше QUALITY_MEMORY последних сканов; forgotten — время
+# самого нового из забытых: если запись изменилась не позже, он мог измениться.
+def quality_changed(used, quality_index, changed_from, forgotten):
+    if forgotten is not None and changed_from <= np.datetime64(forgotten, 'ns'):
+        return True
+    times = [t for t in used if np.datetime64(t, 'ns') >= changed_from]
+    for t, quality in zip(times, quality_index.at_many(times, parce.QUALITY_WINDOW)):
+        before = used[t]
+        if (quality is None) != (before is None):
+            return True
+        if quality is not None and quality != before and not (np.isnan(quality) and np.isnan(before)):
+            return True
+    return False
+
+
+# --- Запомнить качество скана; сверх QUALITY_MEMORY забывается самый старый (возвращает его время или forgotten) ---
+def remember(used, surface_time, quality, forgotten):
+    used[surface_time] = quality
+    if len(used) <= QUALITY_MEMORY:
+        return forgotten
+    oldest = next(iter(used))
+    del used[oldest]
+    return oldest
+
+
+# --- CSV качества или None, если он не читается (например, дописывается последняя строка) ---
+def reload_quality(quality_path):
+    try:
+        return parce.load_quality(quality_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[!] {quality_path} не читается ({e}), повторим при следующем опросе")
+        return None
+
+
+# --- Режим наблюдения ---
+def watch():
+    quality_path = os.path.join(parce.INPUT_DIR, parce.QUALITY_CSV)
+    quality_index = None
+    while quality_index is None:
+        quality_mtime = os.stat(quality_path).st_mtime_ns
+        quality_index = reload_quality(quality_path)
+        if quality_index is None:
+            time.sleep(POLL_INTERVAL)
+    stack, last_time = parce.open_state(quality_index)
+    delta_writer = parce.new_delta_writer()
+    metrics = parce.new_metrics()
+    tracker = FileTracker(parce.INPUT_DIR)
+    latencies = deque(maxlen=LATENCY_WINDOW)
+    scans = 0
+    started_at = time.time()
+    # Качество, с которым применён каждый скан; для обработанных до запуска — по CSV, с которым сошлась контрольная точка
+    done_times = tracker.rescan(last_time)
+    forgotten = done_times[-QUALITY_MEMORY - 1] if len(done_times) > QUALITY_MEMORY else None
+    done_times = done_times[-QUALITY_MEMORY:]
+    used = dict(zip(done_times, quality_index.at_many(done_times, parce.QUALITY_WINDOW)))
+    print(f"[+] Наблюдение за {parce.INPUT_DIR} ({'inotify' if tracker.inotify else 'опрос'})")
+
+    while True:
+        # Качество дописывается постоянно — перечитываем CSV при изменении;
+        # не прочитался — остаётся прежний индекс, mtime не запоминается, и чтение повторится
+        try:
+            mtime = os.stat(quality_path).st_mtime_ns
+        except OSError as e:
+            print(f"[!] {quality_path} недоступен ({e})")
+            mtime = quality_mtime
+        new_index = reload_quality(quality_path) if mtime != quality_mtime else None
+        if new_index is not None:
+            quality_mtime = mtime
+            changed_from = new_index.first_change(quality_index)
+            new_index.adopt_digest(quality_index, changed_from)
+            if last_time is not None and changed_from is not None and changed_from <= np.datetime64(last_time, 'ns'):
+                if quality_changed(used, new_index, changed_from, forgotten):
+                    print("[!] Изменилось качество уже обработанных сканов, пересчитываем всё")
+                    shutil.rmtree(parce.OUTPUT_DIR, ignore_errors=True)
+                    os.makedirs(parce.OUTPUT_DIR, exist_ok=True)
+                    stack, last_time = parce.new_stack(), None
+                    delta_writer = parce.new_delta_writer()
+                    used, forgotten = {}, None
+                    tracker.rescan(None)
+                else:
+                    # Изменились записи, которые сканы не использовали: только новый отпечаток контрольной точки
+                    run_tasks([parce.checkpoint_task(stack, last_time, parce.state_digest(new_index, last_time))])
+            quality_index = new_index
+
+        # Сканы применяются строго по времени: ждём, пока допишется самый ранний
+        now = time.time()
+        pending = tracker.ordered()
+        stats = {file: tracker.update(file, now) for file in pending}
+        for file in pending:
+            st = stats[file]
+            if st is None:
+                continue
+            if not tracker.ready(file, time.time()):
+                break
+            detected = tracker.seen[file][3]
+            surface_time = tracker.pending[file]
+            # CSV качества отстаёт от сканера: ждём запись на момент скана, но не дольше QUALITY_LAG
+            if not quality_index.covers(surface_time):
+                if time.time() - max(detected, st.st_mtime_ns / 1e9) < QUALITY_LAG:
+                    break
+                print(f"[!] В {parce.QUALITY_CSV} нет записей на {surface_time} за {QUALITY_LAG} с, "
+                      f"берём последнее известное качество")
+            tracker.done(file, surface_time)
+            with metrics.stage('quality'):
+                quality = parce.get_quality_for_timestamp(surface_time, quality_index)
+            last_time = surface_time
+            forgotten = remember(used, surface_time, quality, forgotten)
+            if quality is None:
+                print(f"[!] Нет качества для {file}, пропускаем")
+                metrics.count('skipped_files')
+                continue
+            started = time.time()
+            # Битый файл (не читается, нечисловой объём в заголовке) пропускается, стек он не трогает
+            try:
+                scan = read_surface_file(file)
+            except (OSError, ValueError) as e:
+                print(f"[!] Не читается {file} ({e}), пропускаем")
+                metrics.count('bad_files')
+                continue
+            json_path = parce.process_scan(stack, file, surface_time, quality, quality_index, delta_writer, metrics,
+                                           prefetched=(scan, time.time() - started, 0.0))
+            finished = time.time()
+
+            # Задержка от последней записи файла сканером до готового JSON
+            record = {
+                'file': os.path.basename(file),
+                'output': os.path.basename(json_path),
+                'surface_time': surface_time.isoformat(),
+                'written_at': finished,
+                'latency_s': finished - st.st_mtime_ns / 1e9,
+                'wait_s': started - max(detected, st.st_mtime_ns / 1e9),
+                'process_s': finished - started,
+            }
+            latencies.append(record['latency_s'])
+            scans += 1
+            write_status(latencies, scans, record)
+            print(f"[+] Задержка {record['latency_s']:.2f} с (обработка {record['process_s']:.2f} с)")
+            # Файлы, лежавшие в папке до запуска, — догоняемый хвост, не тревога
+            if record['latency_s'] > LATENCY_ALERT and st.st_mtime_ns / 1e9 >= started_at:
+                print(f"[!] Задержка {record['latency_s']:.2f} с превышает {LATENCY_ALERT} с")
+
+        tracker.wait(POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    watch()
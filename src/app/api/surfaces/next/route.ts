@@ -1,20 +1,13 @@
 import { NextResponse } from 'next/server';
-import fs from 'fs';
 import path from 'path';
+import { listSurfaceFiles } from '@/utils/surfaceManifest';
 
 const SURFACES_DIR = path.join(process.cwd(), 'public', 'surfaces');
 
 export async function GET(request: Request) {
     try {
-        // Получаем список всех файлов
-        const files = fs.readdirSync(SURFACES_DIR)
-            .filter(file => file.endsWith('.json'))
-            .sort((a, b) => {
-                // Сортируем по времени создания
-                const statA = fs.statSync(path.join(SURFACES_DIR, a));
-                const statB = fs.statSync(path.join(SURFACES_DIR, b));
-                return statA.mtime.getTime() - statB.mtime.getTime();
-            });
+        // Список файлов по времени — из оглавления, без stat на каждый файл
+        const files = listSurfaceFiles(SURFACES_DIR);
 
         if (files.length === 0) {
             return NextResponse.json({ error: 'Нет доступных файлов' }, { status: 404 });
@@ -34,7 +27,8 @@ export async function GET(request: Request) {
         return NextResponse.json({ 
             filename: nextFile,
             totalFiles: files.length,
-            currentIndex: nextIndex
+            currentIndex: nextIndex,
+            latest: files[files.length - 1]
         });
     } catch (error) {
         console.error('Ошибка при получении следующего файла:', error);
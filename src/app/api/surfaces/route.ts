@@ -1,6 +1,7 @@
 import { NextResponse } from 'next/server';
 import fs from 'fs';
 import path from 'path';
+import { listSurfaceFiles } from '@/utils/surfaceManifest';
 
 export async function GET() {
     try {
@@ -11,8 +12,8 @@ export async function GET() {
             fs.mkdirSync(surfacesDir, { recursive: true });
         }
 
-        const files = fs.readdirSync(surfacesDir)
-            .filter(file => file.endsWith('.json'))
+        // Порядок и имена — из оглавления, если оно есть; без него — порядок папки, как раньше
+        const files = listSurfaceFiles(surfacesDir, false)
             .map(file => {
                 const filePath = path.join(surfacesDir, file);
                 const content = fs.readFileSync(filePath, 'utf-8');
@@ -0,0 +1,46 @@
+import fs from 'fs';
+import path from 'path';
+
+// Оглавление папки сканов, его пишет process/parce.py (см. process/surface_manifest.py)
+export const MANIFEST_FILE = 'manifest.json';
+
+export interface ManifestScan {
+    filename: string;
+    timestamp: string;
+    points: number;
+    bytes: number;
+    quality: number;
+    avg_disappeared_quality: number | null;
+    sha256: string;
+}
+
+// Записи оглавления или null, если его нет или оно не читается
+export function readManifest(surfacesDir: string): ManifestScan[] | null {
+    const manifestPath = path.join(surfacesDir, MANIFEST_FILE);
+    if (!fs.existsSync(manifestPath)) {
+        return null;
+    }
+    try {
+        return JSON.parse(fs.readFileSync(manifestPath, 'utf-8')).scans as ManifestScan[];
+    } catch (error) {
+        console.error('Ошибка чтения оглавления сканов:', error);
+        return null;
+    }
+}
+
+// JSON-файлы сканов по времени: из оглавления, а если его нет или оно не читается — по папке
+// (с byTime — с сортировкой по времени изменения, это stat на каждый файл)
+export function listSurfaceFiles(surfacesDir: string, byTime = true): string[] {
+    const scans = readManifest(surfacesDir);
+    if (scans) {
+        return scans.map(scan => scan.filename).filter(file => file.endsWith('.json'));
+    }
+    const files = fs.readdirSync(surfacesDir).filter(file => file.endsWith('.json') && file !== MANIFEST_FILE);
+    if (!byTime) {
+        return files;
+    }
+    return files
+        .map(file => ({ file, mtime: fs.statSync(path.join(surfacesDir, file)).mtime.getTime() }))
+        .sort((a, b) => a.mtime - b.mtime)
+        .map(({ file }) => file);
+}